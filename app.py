@@ -1,13 +1,21 @@
 import os
+import time
 import logging
-import tempfile
 import shutil
-import mimetypes
-from flask import Flask, request, jsonify, send_file, make_response
+from flask import Flask, request, jsonify, send_file, make_response, Response
 
-from utils import create_temp_file_from_env
-from instagram_downloader import get_instaloader_instance, download_instagram_content
-from platform_downloader import download_with_yt_dlp
+import metrics
+from cache import media_cache, is_cache_key, CACHE_RESULT_RETENTION_SECONDS
+from download_service import (fetch_media, get_cached_media, open_media_stream, open_instagram_result,
+                              parse_download_request, describe_media, resolve_media_url, result_token_for, ZIP_STREAMING_ENABLED,
+                              SUPPORTED_FORMATS, URL_FORMAT, URL_MEDIA_KINDS, upstream_stats)
+from jobs import job_manager, public_job_view, QueueFullError, JOBS_RETRY_AFTER_SECONDS, JOBS_DIR
+from batch import parse_batch_request, iter_batch_zip_members, iter_batch_ndjson
+from utils import MediaStream, iter_zip_stream, guess_mimetype, attachment_disposition
+from instagram_session_pool import start_background_warm_up
+from ytdlp_pool import info_cache
+from upstream_guard import UpstreamUnavailableError
+from storage import StorageFullError, create_workdir, start_orphan_sweeper, storage_manager
 
 # --- Configuração do Logging ---
 logging.basicConfig(
@@ -19,90 +27,309 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# --- Constantes ---
-TMP_COOKIE_FILENAME_YT = "youtube_cookies.txt"
-
 # --- Inicialização do Flask ---
 app = Flask(__name__)
 
+# As threads de segundo plano (warm-up do Instagram, limpeza de órfãos) não nascem no import: com preload_app
+# o app é importado no master antes do fork. O gunicorn.conf.py as inicia no post_fork de cada worker.
+
+# --- Funções Auxiliares ---
+def _track_send(response, platform, num_bytes):
+    """Registra a etapa 'send' (da criação da resposta até o fim do envio) e os bytes enviados."""
+    started = time.monotonic()
+    def observe():
+        metrics.observe_stage('send', platform, time.monotonic() - started)
+        metrics.add_bytes_sent(platform, num_bytes() if callable(num_bytes) else num_bytes)
+
+    if response.direct_passthrough and hasattr(response.response, 'close'):
+        # send_file entrega o file wrapper direto ao servidor (sendfile), sem passar pelo call_on_close
+        file_close = response.response.close
+        def close():
+            try:
+                file_close()
+            finally:
+                observe()
+        response.response.close = close
+    else:
+        response.call_on_close(observe)
+
+def send_media_file(file_path, req_id, platform='unknown'):
+    mimetype = guess_mimetype(file_path)
+    logger.info(f"Req ID: {req_id} - Enviando arquivo: {file_path}, mimetype: {mimetype}")
+    # conditional: Range, If-Range e ETag (mtime + tamanho), permitindo retomar e baixar em partes
+    response = make_response(send_file(
+        file_path,
+        as_attachment=True,
+        download_name=os.path.basename(file_path),
+        mimetype=mimetype,
+        conditional=True
+    ))
+    token = result_token_for(file_path)
+    if token:
+        response.headers['X-Result-Token'] = token
+        response.headers['Content-Location'] = f"/api/files/{token}"
+    _track_send(response, platform, response.content_length or 0)
+    return response
+
+def stream_media_response(media_stream, temp_dir, req_id, platform='unknown'):
+    """Envia a mídia (ou o ZIP em geração) em chunked transfer à medida que os bytes ficam prontos."""
+    sent = 0
+
+    def generate():
+        nonlocal sent
+        try:
+            for chunk in media_stream.iter_chunks():
+                sent += len(chunk)
+                yield chunk
+            logger.info(f"Req ID: {req_id} - Streaming concluído: {sent} bytes.")
+        except Exception:
+            logger.exception(f"Req ID: {req_id} - Erro durante o streaming após {sent} bytes")
+            raise
+
+    def cleanup():
+        media_stream.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        logger.info(f"Req ID: {req_id} - Limpeza concluída (streaming).")
+
+    filename = media_stream.filename
+    response = Response(generate(), mimetype=guess_mimetype(filename))
+    response.headers['Content-Disposition'] = attachment_disposition(filename)
+    response.call_on_close(cleanup)
+    _track_send(response, platform, lambda: sent)
+    logger.info(f"Req ID: {req_id} - Iniciando streaming: {filename}")
+    return response
+
 # --- Rota Health Check ---
 @app.route('/')
 def health_check():
     return "API Media Downloader is healthy and running!", 200
 
+# --- Rota de Estatísticas do Cache ---
+@app.route('/api/cache/stats')
+def cache_stats_route():
+    if not media_cache:
+        return jsonify({"enabled": False, "info_cache": info_cache.stats()}), 200
+    return jsonify(dict(media_cache.stats(), enabled=True, info_cache=info_cache.stats())), 200
+
+# --- Rota de Estado das Origens (limitador / circuit breaker) ---
+@app.route('/api/upstream/stats')
+def upstream_stats_route():
+    return jsonify(upstream_stats()), 200
+
+# --- Rota de Uso do Armazenamento Temporário ---
+@app.route('/api/storage/stats')
+def storage_stats_route():
+    return jsonify(storage_manager.stats()), 200
+
+# --- Rota de Métricas (Prometheus) ---
+@app.route('/metrics')
+def metrics_route():
+    payload, content_type = metrics.render_metrics(extra_dirs=[JOBS_DIR])
+    return Response(payload, content_type=content_type)
+
+def retry_later_response(error):
+    """503 com Retry-After: origem bloqueando ou sem espaço temporário; a requisição nem chegou a ser enviada."""
+    response = jsonify({"error": str(error)})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
+# --- Rotas de Metadados (sem download) ---
+def metadata_response(resolve, download_request):
+    """Executa uma consulta de metadados em um diretório temporário (cookies) e devolve o JSON."""
+    temp_dir_req = create_workdir(reserve_bytes=0) # Nenhuma mídia é baixada
+    req_id = os.path.basename(temp_dir_req)
+    logger.info(f"Req ID: {req_id} - Metadados: URL='{download_request['url']}', UserIG='{download_request['username']}'")
+    try:
+        return jsonify(resolve(temp_dir_req)), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except UpstreamUnavailableError as e:
+        logger.warning(f"Req ID: {req_id} - {e}")
+        return retry_later_response(e)
+    except Exception as e:
+        logger.exception(f"Req ID: {req_id} - Erro ao obter metadados")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        shutil.rmtree(temp_dir_req, ignore_errors=True)
+
+@app.route('/api/info', methods=['GET'])
+def media_info_route():
+    download_request, request_error = parse_download_request(request.args, SUPPORTED_FORMATS + [URL_FORMAT])
+    if request_error:
+        return jsonify({"error": request_error}), 400
+    return metadata_response(lambda temp_dir: describe_media(download_request['platform'], download_request['url'],
+                                                             download_request['username'], download_request['ig_action'],
+                                                             temp_dir), download_request)
+
+def media_url_response(download_request):
+    """format=url: devolve a URL direta da mídia (param 'media': video, audio ou image) em vez do arquivo."""
+    media_kind = request.args.get('media', 'video').lower()
+    if media_kind not in URL_MEDIA_KINDS:
+        return jsonify({"error": "Parâmetro 'media' inválido. Use 'video', 'audio' ou 'image'."}), 400
+    return metadata_response(lambda temp_dir: resolve_media_url(download_request['platform'], download_request['url'],
+                                                                download_request['username'], download_request['ig_action'],
+                                                                media_kind, temp_dir), download_request)
+
 # --- Rota da API Principal ---
 @app.route('/api/download', methods=['GET'])
 def main_download_route():
-    url = request.args.get('url')
-    username_ig = request.args.get('username') # Para ações do Instagram baseadas em username
-    download_format_req = request.args.get('format', 'video').lower() # video, image, mp3
-    ig_action_req = request.args.get('ig_action') # profile_pic, stories, highlights, post (post é inferido de URL)
-
-    if not url and not (username_ig and ig_action_req):
-        return jsonify({"error": "Parâmetro 'url' (ou 'username' e 'ig_action' para Instagram) é obrigatório."}), 400
-    if download_format_req not in ['video', 'image', 'mp3']:
-        return jsonify({"error": "Parâmetro 'format' inválido. Use 'video', 'image' ou 'mp3'."}), 400
-    if ig_action_req and ig_action_req not in ['profile_pic', 'stories', 'highlights']:
-        return jsonify({"error": "Parâmetro 'ig_action' inválido. Use 'profile_pic', 'stories', 'highlights'."}), 400
-
-    temp_dir_req = tempfile.mkdtemp(prefix="downloader_")
+    stream_req = request.args.get('stream', '').lower() in ('1', 'true', 'yes') # Streaming direto da origem
+    routing_started = time.monotonic()
+
+    download_request, request_error = parse_download_request(request.args, SUPPORTED_FORMATS + [URL_FORMAT])
+    if request_error:
+        metrics.count_request(None, 'invalid')
+        return jsonify({"error": request_error}), 400
+    if download_request['format'] == URL_FORMAT:
+        return media_url_response(download_request)
+    platform = download_request['platform']
+    url, username_ig, ig_action_req = download_request['url'], download_request['username'], download_request['ig_action']
+    download_format_req, ig_options = download_request['format'], download_request['ig_options']
+    format_options = download_request['format_options']
+    metrics.observe_stage('routing', platform, time.monotonic() - routing_started)
+
+    try:
+        temp_dir_req = create_workdir()
+    except StorageFullError as e:
+        metrics.count_request(platform, 'storage_full')
+        return retry_later_response(e)
     req_id = os.path.basename(temp_dir_req)
     logger.info(f"Req ID: {req_id} - URL='{url}', UserIG='{username_ig}', Format='{download_format_req}', IGAction='{ig_action_req}'")
 
-    downloaded_file_paths = []
-    final_file_to_send = None
-
+    cleanup_on_return = True
     try:
-        cookie_file_yt = None
-        target_platform_input = url if url else username_ig
-
-        if url and ("youtube.com" in url or "youtu.be" in url):
-            cookie_file_yt = create_temp_file_from_env('YOUTUBE_COOKIES_FILE_CONTENT', TMP_COOKIE_FILENAME_YT, temp_dir_req)
-            downloaded_file_paths = download_with_yt_dlp('YouTube', url, temp_dir_req, download_format_req, cookie_file_yt)
-        elif url and "tiktok.com" in url:
-            downloaded_file_paths = download_with_yt_dlp('TikTok', url, temp_dir_req, download_format_req)
-        elif (url and "instagram.com" in url) or (username_ig and ig_action_req):
-            instaloader_instance = get_instaloader_instance(temp_dir_req)
-            downloaded_file_paths = download_instagram_content(instaloader_instance, target_platform_input, temp_dir_req, download_format_req, ig_action_req)
-        else:
-            return jsonify({"error": "URL não suportada ou combinação de parâmetros inválida."}), 400
-
-        if not downloaded_file_paths:
-            raise Exception("Nenhum arquivo foi retornado pela função de download.")
-
-        final_file_to_send = downloaded_file_paths[0]
-
-        if not os.path.exists(final_file_to_send):
-            raise Exception(f"Arquivo final '{final_file_to_send}' não encontrado no servidor.")
-
-        mimetype, _ = mimetypes.guess_type(final_file_to_send)
-        if final_file_to_send.lower().endswith(".zip"):
-            mimetype = "application/zip"
-        elif mimetype is None:
-            if final_file_to_send.lower().endswith(".mp4"): mimetype = "video/mp4"
-            elif final_file_to_send.lower().endswith(".mp3"): mimetype = "audio/mpeg"
-            else: mimetype = 'application/octet-stream'
-
-        logger.info(f"Req ID: {req_id} - Enviando arquivo: {final_file_to_send}, mimetype: {mimetype}")
-        
-        response = make_response(send_file(
-            final_file_to_send,
-            as_attachment=True,
-            download_name=os.path.basename(final_file_to_send),
-            mimetype=mimetype
-        ))
-        
-        return response
+        if stream_req:
+            cached_file = get_cached_media(url, username_ig, download_format_req, ig_action_req, format_options=format_options)
+            if cached_file:
+                metrics.count_request(platform, 'cache_hit')
+                return send_media_file(cached_file, req_id, platform)
+            media_stream = open_media_stream(platform, url, username_ig, download_format_req, ig_action_req, temp_dir_req, format_options)
+            if media_stream:
+                # A limpeza passa a acontecer quando o streaming terminar
+                cleanup_on_return = False
+                metrics.count_request(platform, 'streamed')
+                return stream_media_response(media_stream, temp_dir_req, req_id, platform)
+            logger.info(f"Req ID: {req_id} - Streaming indisponível para esta mídia; usando download completo.")
+
+        if platform == 'Instagram' and ZIP_STREAMING_ENABLED:
+            cached_file = get_cached_media(url, username_ig, download_format_req, ig_action_req, ig_options)
+            if cached_file:
+                metrics.count_request(platform, 'cache_hit')
+                return send_media_file(cached_file, req_id, platform)
+            single_file, archive_stream = open_instagram_result(url, username_ig, download_format_req, ig_action_req, temp_dir_req,
+                                                                 req_id, ig_options)
+            if single_file:
+                metrics.count_request(platform, 'success')
+                return send_media_file(single_file, req_id, platform)
+            cleanup_on_return = False
+            metrics.count_request(platform, 'streamed')
+            return stream_media_response(archive_stream, temp_dir_req, req_id, platform)
 
+        final_file_to_send = fetch_media(platform, url, username_ig, download_format_req, ig_action_req, temp_dir_req, req_id,
+                                         ig_options=ig_options, format_options=format_options)
+        metrics.count_request(platform, 'success')
+        return send_media_file(final_file_to_send, req_id, platform)
+
+    except ValueError as e: # Nenhum formato atende a 'max_height'/'max_filesize'
+        logger.info(f"Req ID: {req_id} - Requisição recusada: {e}")
+        metrics.count_request(platform, 'invalid')
+        return jsonify({"error": str(e)}), 400
+    except UpstreamUnavailableError as e:
+        logger.warning(f"Req ID: {req_id} - {e}")
+        metrics.count_request(platform, 'upstream_unavailable')
+        return retry_later_response(e)
     except Exception as e:
         logger.exception(f"Req ID: {req_id} - Erro no processamento da API")
+        metrics.count_request(platform, 'error')
         return jsonify({"error": str(e)}), 500
     finally:
-        logger.info(f"Req ID: {req_id} - Iniciando limpeza de: {temp_dir_req}")
+        if cleanup_on_return:
+            logger.info(f"Req ID: {req_id} - Iniciando limpeza de: {temp_dir_req}")
+            shutil.rmtree(temp_dir_req, ignore_errors=True)
+            logger.info(f"Req ID: {req_id} - Limpeza concluída.")
+
+# --- Rota de Resultados Retidos (retomada / Range) ---
+@app.route('/api/files/<token>', methods=['GET'])
+def result_file_route(token):
+    if not media_cache or not is_cache_key(token):
+        return jsonify({"error": "Resultado não encontrado."}), 404
+    file_path = media_cache.get_result(token)
+    if not file_path:
+        return jsonify({"error": "Resultado expirado ou inexistente."}), 404
+    response = send_media_file(file_path, f"file-{token}")
+    # Cada versão armazenada tem o próprio token e o conteúdo dele nunca muda: proxies/CDN podem guardar a resposta
+    response.headers['Cache-Control'] = f"public, max-age={CACHE_RESULT_RETENTION_SECONDS}"
+    return response
+
+# --- Rota de Download em Lote ---
+@app.route('/api/batch', methods=['POST'])
+def batch_download_route():
+    download_requests, output, request_error = parse_batch_request(request.get_json(silent=True))
+    if request_error:
+        return jsonify({"error": request_error}), 400
+
+    try:
+        temp_dir_req = create_workdir()
+    except StorageFullError as e:
+        return retry_later_response(e)
+    batch_id = os.path.basename(temp_dir_req)
+    logger.info(f"Req ID: {batch_id} - Lote com {len(download_requests)} item(ns), saída '{output}'")
+
+    if output == 'zip':
+        # Os arquivos podem estar no cache: não são apagados ao entrar no ZIP (a limpeza remove só o diretório do lote)
+        members = iter_batch_zip_members(download_requests, temp_dir_req, batch_id)
+        archive_stream = MediaStream(f"{batch_id}.zip", iter_zip_stream(members, remove_after=False, platform='batch'), members.close)
+        return stream_media_response(archive_stream, temp_dir_req, batch_id, 'batch')
+
+    lines = iter_batch_ndjson(download_requests, temp_dir_req, batch_id)
+    def cleanup():
+        lines.close()
         shutil.rmtree(temp_dir_req, ignore_errors=True)
-        logger.info(f"Req ID: {req_id} - Limpeza concluída.")
+        logger.info(f"Req ID: {batch_id} - Limpeza concluída (lote).")
+    response = Response(lines, mimetype='application/x-ndjson')
+    response.call_on_close(cleanup)
+    return response
+
+# --- Rotas de Jobs Assíncronos ---
+@app.route('/api/jobs', methods=['POST'])
+def create_job_route():
+    params = request.get_json(silent=True) or request.values
+    download_request, request_error = parse_download_request(params)
+    if request_error:
+        return jsonify({"error": request_error}), 400
+
+    try:
+        job = job_manager.submit(download_request['platform'], download_request['url'], download_request['username'],
+                                 download_request['format'], download_request['ig_action'], download_request['ig_options'],
+                                 download_request['format_options'])
+    except QueueFullError as e:
+        response = jsonify({"error": str(e)})
+        response.headers['Retry-After'] = str(JOBS_RETRY_AFTER_SECONDS)
+        return response, 429
+    return jsonify(public_job_view(job)), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status_route(job_id):
+    job = job_manager.get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job não encontrado."}), 404
+    return jsonify(public_job_view(job)), 200
+
+@app.route('/api/jobs/<job_id>/file', methods=['GET'])
+def job_file_route(job_id):
+    job = job_manager.get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job não encontrado."}), 404
+    if job['status'] != 'finished':
+        return jsonify({"error": f"Job ainda não concluído (status: {job['status']}).", "status": job['status']}), 409
+    if not os.path.exists(job['file_path']):
+        return jsonify({"error": "Arquivo do job não está mais disponível."}), 410
+    return send_media_file(job['file_path'], f"job-{job_id}", job['platform'])
 
 
 if __name__ == '__main__':
+    # Servidor de desenvolvimento (um processo, sem fork)
+    start_background_warm_up()
+    start_orphan_sweeper()
     port = int(os.environ.get("PORT", 8080))
     app.run(host='0.0.0.0', port=port, debug=False)
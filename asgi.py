@@ -0,0 +1,398 @@
+import os
+import time
+import shutil
+import asyncio
+import logging
+from functools import partial
+from urllib.parse import parse_qsl
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import metrics
+from cache import media_cache, is_cache_key, CACHE_RESULT_RETENTION_SECONDS
+from download_service import (fetch_media, get_cached_media, open_media_stream, open_instagram_result,
+                              parse_download_request, describe_media, resolve_media_url, result_token_for, ZIP_STREAMING_ENABLED,
+                              SUPPORTED_FORMATS, URL_FORMAT, URL_MEDIA_KINDS, upstream_stats)
+from jobs import job_manager, public_job_view, QueueFullError, JOBS_RETRY_AFTER_SECONDS, JOBS_DIR
+from batch import parse_batch_request, iter_batch_zip_members, iter_batch_ndjson
+from utils import MediaStream, iter_zip_stream, guess_mimetype, attachment_disposition
+from instagram_session_pool import start_background_warm_up
+from ytdlp_pool import info_cache
+from upstream_guard import UpstreamUnavailableError
+from storage import StorageFullError, create_workdir, start_orphan_sweeper, storage_manager
+
+# Variante ASGI da API (mesmas rotas e respostas do app.py). Um único processo mantém dezenas de
+# downloads em andamento: o trabalho bloqueante roda em threads e o event loop só repassa os bytes.
+# Uso: uvicorn asgi:app --host 0.0.0.0 --port $PORT
+
+# --- Configuração do Logging ---
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler() # Envia logs para o console (stderr)
+    ]
+)
+logger = logging.getLogger(__name__)
+
+# Downloads/extrações simultâneos por processo (threads que passam a maior parte do tempo esperando rede ou ffmpeg)
+ASGI_DOWNLOAD_WORKERS = int(os.environ.get('ASGI_DOWNLOAD_WORKERS', '32'))
+
+_download_executor = ThreadPoolExecutor(max_workers=ASGI_DOWNLOAD_WORKERS, thread_name_prefix="asgi-download")
+
+# --- Funções Auxiliares ---
+class RequestWorkspace:
+    """Diretório temporário da requisição; só é apagado quando nenhuma tarefa em thread ainda o usa."""
+
+    def __init__(self, path):
+        self.path = path
+        self.req_id = os.path.basename(path)
+        self._pending = set()
+        self._released = False
+
+    @classmethod
+    async def create(cls, reserve_bytes=None):
+        """Cria o diretório após a admissão na cota de armazenamento (em thread: pode aguardar por espaço)."""
+        return cls(await run_in_threadpool(create_workdir, reserve_bytes))
+
+    async def run(self, fn, *args, **kwargs):
+        """Executa `fn` no pool de downloads sem bloquear o event loop."""
+        future = asyncio.get_running_loop().run_in_executor(_download_executor, partial(fn, *args, **kwargs))
+        self._pending.add(future)
+        future.add_done_callback(self._task_done)
+        # shield: se o cliente desconectar, a thread termina normalmente e só então o diretório é removido
+        return await asyncio.shield(future)
+
+    def _task_done(self, future):
+        if not future.cancelled():
+            future.exception() # Evita o aviso de exceção não lida quando a requisição já foi cancelada
+        self._pending.discard(future)
+        if self._released and not self._pending:
+            self._remove()
+
+    def release(self):
+        self._released = True
+        if not self._pending:
+            self._remove()
+
+    def _remove(self):
+        _download_executor.submit(shutil.rmtree, self.path, ignore_errors=True)
+        logger.info(f"Req ID: {self.req_id} - Limpeza concluída.")
+
+def _after_send(platform, num_bytes, close=None, workspace=None):
+    """Tarefa executada ao fim do envio: métricas de 'send' e liberação dos recursos da requisição."""
+    started = time.monotonic()
+
+    async def finish():
+        if close:
+            await run_in_threadpool(close)
+        if workspace:
+            workspace.release()
+        metrics.observe_stage('send', platform, time.monotonic() - started)
+        metrics.add_bytes_sent(platform, num_bytes() if callable(num_bytes) else num_bytes)
+    return BackgroundTask(finish)
+
+async def file_response(file_path, req_id, platform='unknown', workspace=None):
+    """Envia um arquivo com Range/If-Range/ETag. Servidores com a extensão 'pathsend' enviam sem cópia em Python."""
+    mimetype = guess_mimetype(file_path)
+    logger.info(f"Req ID: {req_id} - Enviando arquivo: {file_path}, mimetype: {mimetype}")
+    token = await run_in_threadpool(result_token_for, file_path)
+    size = await run_in_threadpool(os.path.getsize, file_path)
+    response = FileResponse(file_path, media_type=mimetype, filename=os.path.basename(file_path),
+                            background=_after_send(platform, size, workspace=workspace))
+    if token:
+        response.headers['X-Result-Token'] = token
+        response.headers['Content-Location'] = f"/api/files/{token}"
+    return response
+
+def stream_response(media_stream, workspace, platform='unknown'):
+    """Envia a mídia (ou o ZIP em geração) em chunked transfer à medida que os bytes ficam prontos."""
+    sent = 0
+    req_id = workspace.req_id
+
+    async def generate():
+        nonlocal sent
+        try:
+            async for chunk in iterate_in_threadpool(media_stream.iter_chunks()):
+                sent += len(chunk)
+                yield chunk
+            logger.info(f"Req ID: {req_id} - Streaming concluído: {sent} bytes.")
+        except Exception:
+            logger.exception(f"Req ID: {req_id} - Erro durante o streaming após {sent} bytes")
+            raise
+
+    filename = media_stream.filename
+    logger.info(f"Req ID: {req_id} - Iniciando streaming: {filename}")
+    return StreamingResponse(generate(), media_type=guess_mimetype(filename),
+                             headers={'Content-Disposition': attachment_disposition(filename)},
+                             background=_after_send(platform, lambda: sent, media_stream.close, workspace))
+
+def error_response(message, status_code, headers=None):
+    return JSONResponse({"error": message}, status_code=status_code, headers=headers)
+
+def retry_later_response(error):
+    """503 com Retry-After: origem bloqueando ou sem espaço temporário; a requisição nem chegou a ser enviada."""
+    return error_response(str(error), 503, headers={'Retry-After': str(error.retry_after)})
+
+# --- Rota Health Check ---
+async def health_check(request):
+    return PlainTextResponse("API Media Downloader is healthy and running!")
+
+# --- Rota de Estatísticas do Cache ---
+async def cache_stats_route(request):
+    if not media_cache:
+        return JSONResponse({"enabled": False, "info_cache": info_cache.stats()})
+    stats = await run_in_threadpool(media_cache.stats)
+    return JSONResponse(dict(stats, enabled=True, info_cache=info_cache.stats()))
+
+# --- Rota de Estado das Origens (limitador / circuit breaker) ---
+async def upstream_stats_route(request):
+    return JSONResponse(await run_in_threadpool(upstream_stats))
+
+# --- Rota de Uso do Armazenamento Temporário ---
+async def storage_stats_route(request):
+    return JSONResponse(await run_in_threadpool(storage_manager.stats))
+
+# --- Rota de Métricas (Prometheus) ---
+async def metrics_route(request):
+    payload, content_type = await run_in_threadpool(metrics.render_metrics, [JOBS_DIR])
+    return Response(payload, headers={'Content-Type': content_type})
+
+# --- Rotas de Metadados (sem download) ---
+async def metadata_response(resolve, download_request):
+    """Executa uma consulta de metadados em um diretório temporário (cookies) e devolve o JSON."""
+    workspace = await RequestWorkspace.create(reserve_bytes=0) # Nenhuma mídia é baixada
+    logger.info(f"Req ID: {workspace.req_id} - Metadados: URL='{download_request['url']}', UserIG='{download_request['username']}'")
+    try:
+        return JSONResponse(await workspace.run(resolve, workspace.path))
+    except ValueError as e:
+        return error_response(str(e), 400)
+    except UpstreamUnavailableError as e:
+        logger.warning(f"Req ID: {workspace.req_id} - {e}")
+        return retry_later_response(e)
+    except Exception as e:
+        logger.exception(f"Req ID: {workspace.req_id} - Erro ao obter metadados")
+        return error_response(str(e), 500)
+    finally:
+        workspace.release()
+
+async def media_info_route(request):
+    download_request, request_error = parse_download_request(request.query_params, SUPPORTED_FORMATS + [URL_FORMAT])
+    if request_error:
+        return error_response(request_error, 400)
+    return await metadata_response(lambda temp_dir: describe_media(download_request['platform'], download_request['url'],
+                                                                   download_request['username'], download_request['ig_action'],
+                                                                   temp_dir), download_request)
+
+async def media_url_response(request, download_request):
+    """format=url: devolve a URL direta da mídia (param 'media': video, audio ou image) em vez do arquivo."""
+    media_kind = request.query_params.get('media', 'video').lower()
+    if media_kind not in URL_MEDIA_KINDS:
+        return error_response("Parâmetro 'media' inválido. Use 'video', 'audio' ou 'image'.", 400)
+    return await metadata_response(lambda temp_dir: resolve_media_url(download_request['platform'], download_request['url'],
+                                                                      download_request['username'], download_request['ig_action'],
+                                                                      media_kind, temp_dir), download_request)
+
+# --- Rota da API Principal ---
+async def _download_response(download_request, stream_req, workspace):
+    """Mesma sequência do app.py (cache, streaming, ZIP do Instagram, download completo); a resposta assume o workspace."""
+    platform = download_request['platform']
+    url, username_ig, ig_action_req = download_request['url'], download_request['username'], download_request['ig_action']
+    download_format_req, ig_options = download_request['format'], download_request['ig_options']
+    format_options = download_request['format_options']
+    req_id = workspace.req_id
+
+    if stream_req:
+        cached_file = await workspace.run(get_cached_media, url, username_ig, download_format_req, ig_action_req,
+                                          format_options=format_options)
+        if cached_file:
+            metrics.count_request(platform, 'cache_hit')
+            return await file_response(cached_file, req_id, platform, workspace)
+        media_stream = await workspace.run(open_media_stream, platform, url, username_ig, download_format_req, ig_action_req,
+                                           workspace.path, format_options)
+        if media_stream:
+            metrics.count_request(platform, 'streamed')
+            return stream_response(media_stream, workspace, platform)
+        logger.info(f"Req ID: {req_id} - Streaming indisponível para esta mídia; usando download completo.")
+
+    if platform == 'Instagram' and ZIP_STREAMING_ENABLED:
+        cached_file = await workspace.run(get_cached_media, url, username_ig, download_format_req, ig_action_req, ig_options)
+        if cached_file:
+            metrics.count_request(platform, 'cache_hit')
+            return await file_response(cached_file, req_id, platform, workspace)
+        single_file, archive_stream = await workspace.run(open_instagram_result, url, username_ig, download_format_req,
+                                                          ig_action_req, workspace.path, req_id, ig_options)
+        if single_file:
+            metrics.count_request(platform, 'success')
+            return await file_response(single_file, req_id, platform, workspace)
+        metrics.count_request(platform, 'streamed')
+        return stream_response(archive_stream, workspace, platform)
+
+    final_file_to_send = await workspace.run(fetch_media, platform, url, username_ig, download_format_req, ig_action_req,
+                                             workspace.path, req_id, ig_options=ig_options, format_options=format_options)
+    metrics.count_request(platform, 'success')
+    return await file_response(final_file_to_send, req_id, platform, workspace)
+
+async def main_download_route(request):
+    stream_req = request.query_params.get('stream', '').lower() in ('1', 'true', 'yes') # Streaming direto da origem
+    routing_started = time.monotonic()
+
+    download_request, request_error = parse_download_request(request.query_params, SUPPORTED_FORMATS + [URL_FORMAT])
+    if request_error:
+        metrics.count_request(None, 'invalid')
+        return error_response(request_error, 400)
+    if download_request['format'] == URL_FORMAT:
+        return await media_url_response(request, download_request)
+    platform = download_request['platform']
+    metrics.observe_stage('routing', platform, time.monotonic() - routing_started)
+
+    try:
+        workspace = await RequestWorkspace.create()
+    except StorageFullError as e:
+        metrics.count_request(platform, 'storage_full')
+        return retry_later_response(e)
+    logger.info(f"Req ID: {workspace.req_id} - URL='{download_request['url']}', UserIG='{download_request['username']}', "
+                f"Format='{download_request['format']}', IGAction='{download_request['ig_action']}'")
+    try:
+        return await _download_response(download_request, stream_req, workspace)
+    except ValueError as e: # Nenhum formato atende a 'max_height'/'max_filesize'
+        logger.info(f"Req ID: {workspace.req_id} - Requisição recusada: {e}")
+        metrics.count_request(platform, 'invalid')
+        workspace.release()
+        return error_response(str(e), 400)
+    except UpstreamUnavailableError as e:
+        logger.warning(f"Req ID: {workspace.req_id} - {e}")
+        metrics.count_request(platform, 'upstream_unavailable')
+        workspace.release()
+        return retry_later_response(e)
+    except Exception as e:
+        logger.exception(f"Req ID: {workspace.req_id} - Erro no processamento da API")
+        metrics.count_request(platform, 'error')
+        workspace.release()
+        return error_response(str(e), 500)
+
+# --- Rota de Resultados Retidos (retomada / Range) ---
+async def result_file_route(request):
+    token = request.path_params['token']
+    if not media_cache or not is_cache_key(token):
+        return error_response("Resultado não encontrado.", 404)
+    file_path = await run_in_threadpool(media_cache.get_result, token)
+    if not file_path:
+        return error_response("Resultado expirado ou inexistente.", 404)
+    response = await file_response(file_path, f"file-{token}")
+    # Cada versão armazenada tem o próprio token e o conteúdo dele nunca muda: proxies/CDN podem guardar a resposta
+    response.headers['Cache-Control'] = f"public, max-age={CACHE_RESULT_RETENTION_SECONDS}"
+    return response
+
+# --- Rota de Download em Lote ---
+async def _json_body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+async def batch_download_route(request):
+    download_requests, output, request_error = parse_batch_request(await _json_body(request))
+    if request_error:
+        return error_response(request_error, 400)
+
+    try:
+        workspace = await RequestWorkspace.create()
+    except StorageFullError as e:
+        return retry_later_response(e)
+    batch_id = workspace.req_id
+    logger.info(f"Req ID: {batch_id} - Lote com {len(download_requests)} item(ns), saída '{output}'")
+
+    if output == 'zip':
+        # Os arquivos podem estar no cache: não são apagados ao entrar no ZIP (a limpeza remove só o diretório do lote)
+        members = iter_batch_zip_members(download_requests, workspace.path, batch_id)
+        archive_stream = MediaStream(f"{batch_id}.zip", iter_zip_stream(members, remove_after=False, platform='batch'), members.close)
+        return stream_response(archive_stream, workspace, 'batch')
+
+    lines = iter_batch_ndjson(download_requests, workspace.path, batch_id)
+    # MediaStream: o fechamento após uma desconexão espera a linha que ainda está sendo gerada em outra thread
+    report_stream = MediaStream(f"{batch_id}.ndjson", lines, lines.close)
+    return StreamingResponse(iterate_in_threadpool(report_stream.iter_chunks()), media_type='application/x-ndjson',
+                             background=_after_send('batch', 0, report_stream.close, workspace))
+
+# --- Rotas de Jobs Assíncronos ---
+async def _request_params(request):
+    """JSON, formulário urlencoded ou query string (equivalente a get_json() or request.values no Flask)."""
+    params = await _json_body(request)
+    if params:
+        return params
+    params = dict(request.query_params)
+    if request.headers.get('content-type', '').startswith('application/x-www-form-urlencoded'):
+        params.update(parse_qsl((await request.body()).decode('utf-8')))
+    return params
+
+async def create_job_route(request):
+    params = await _request_params(request)
+    if not isinstance(params, dict):
+        return error_response("Corpo JSON inválido.", 400)
+    download_request, request_error = parse_download_request(params)
+    if request_error:
+        return error_response(request_error, 400)
+
+    try:
+        job = await run_in_threadpool(job_manager.submit, download_request['platform'], download_request['url'],
+                                      download_request['username'], download_request['format'],
+                                      download_request['ig_action'], download_request['ig_options'],
+                                      download_request['format_options'])
+    except QueueFullError as e:
+        return error_response(str(e), 429, headers={'Retry-After': str(JOBS_RETRY_AFTER_SECONDS)})
+    return JSONResponse(public_job_view(job), status_code=202)
+
+async def job_status_route(request):
+    job = await run_in_threadpool(job_manager.get_job, request.path_params['job_id'])
+    if not job:
+        return error_response("Job não encontrado.", 404)
+    return JSONResponse(public_job_view(job))
+
+async def job_file_route(request):
+    job_id = request.path_params['job_id']
+    job = await run_in_threadpool(job_manager.get_job, job_id)
+    if not job:
+        return error_response("Job não encontrado.", 404)
+    if job['status'] != 'finished':
+        return JSONResponse({"error": f"Job ainda não concluído (status: {job['status']}).", "status": job['status']}, status_code=409)
+    if not os.path.exists(job['file_path']):
+        return error_response("Arquivo do job não está mais disponível.", 410)
+    return await file_response(job['file_path'], f"job-{job_id}", job['platform'])
+
+# --- Inicialização do Starlette ---
+@asynccontextmanager
+async def lifespan(app):
+    # Autentica as contas do Instagram em segundo plano, sem atrasar o boot do worker
+    start_background_warm_up()
+    # Remove diretórios de trabalho deixados por processos mortos no boot e periodicamente
+    start_orphan_sweeper()
+    yield
+    _download_executor.shutdown(wait=False, cancel_futures=True)
+
+app = Starlette(lifespan=lifespan, routes=[
+    Route('/', health_check),
+    Route('/api/cache/stats', cache_stats_route),
+    Route('/api/upstream/stats', upstream_stats_route),
+    Route('/api/storage/stats', storage_stats_route),
+    Route('/metrics', metrics_route),
+    Route('/api/info', media_info_route),
+    Route('/api/download', main_download_route),
+    Route('/api/files/{token}', result_file_route),
+    Route('/api/batch', batch_download_route, methods=['POST']),
+    Route('/api/jobs', create_job_route, methods=['POST']),
+    Route('/api/jobs/{job_id}', job_status_route),
+    Route('/api/jobs/{job_id}/file', job_file_route),
+])
+
+
+if __name__ == '__main__':
+    import uvicorn
+    port = int(os.environ.get("PORT", 8080))
+    uvicorn.run(app, host='0.0.0.0', port=port)
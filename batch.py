@@ -0,0 +1,142 @@
+import os
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import metrics
+from download_service import fetch_media, parse_download_request, result_token_for
+from jobs import parse_platform_limits, job_manager, public_job_view
+
+logger = logging.getLogger(__name__)
+
+# --- Configuração dos Lotes (via variáveis de ambiente) ---
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '25'))
+# Itens baixados em paralelo dentro de um mesmo lote
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', '6'))
+# Downloads simultâneos por plataforma, somando todos os lotes do worker
+BATCH_PLATFORM_LIMITS = os.environ.get('BATCH_PLATFORM_LIMITS', 'YouTube=2,TikTok=3,Instagram=1')
+
+BATCH_OUTPUTS = ('zip', 'ndjson')
+BATCH_REPORT_FILENAME = "batch_report.json"
+
+_platform_slots = {name: threading.BoundedSemaphore(limit)
+                   for name, limit in parse_platform_limits(BATCH_PLATFORM_LIMITS).items()}
+
+def parse_batch_request(payload):
+    """Valida o corpo do lote. Retorna (pedidos, saída, erro).
+
+    Aceita {"urls": [...]} ou {"items": [{"url": ..., "username": ..., "ig_action": ...}, ...]};
+    'format', 'limit', 'since', 'max_height' e 'max_filesize' no nível do lote valem para os itens que não os definem.
+    """
+    if not isinstance(payload, dict):
+        return None, None, "Corpo JSON inválido."
+    output = (payload.get('output') or 'zip').lower()
+    if output not in BATCH_OUTPUTS:
+        return None, None, "Parâmetro 'output' inválido. Use 'zip' ou 'ndjson'."
+
+    raw_items = payload.get('items') or payload.get('urls')
+    if not isinstance(raw_items, list) or not raw_items:
+        return None, None, "Informe uma lista não vazia em 'urls' ou 'items'."
+    if len(raw_items) > BATCH_MAX_ITEMS:
+        return None, None, f"Lote com {len(raw_items)} itens excede o máximo de {BATCH_MAX_ITEMS}."
+
+    defaults = {k: payload[k] for k in ('format', 'limit', 'since', 'max_height', 'max_filesize') if payload.get(k)}
+    download_requests = []
+    for index, raw_item in enumerate(raw_items):
+        item = {'url': raw_item} if isinstance(raw_item, str) else raw_item
+        if not isinstance(item, dict):
+            return None, None, f"Item {index}: formato inválido."
+        download_request, request_error = parse_download_request(dict(defaults, **item))
+        if request_error:
+            return None, None, f"Item {index}: {request_error}"
+        download_requests.append(download_request)
+    return download_requests, output, None
+
+def _fetch_item(index, download_request, temp_dir, batch_id):
+    item_dir = os.path.join(temp_dir, f"item_{index}")
+    os.makedirs(item_dir, exist_ok=True)
+    slot = _platform_slots.get(download_request['platform'])
+    if slot:
+        slot.acquire()
+    try:
+        return fetch_media(download_request['platform'], download_request['url'], download_request['username'],
+                           download_request['format'], download_request['ig_action'], item_dir, f"{batch_id}#{index}",
+                           ig_options=download_request['ig_options'], format_options=download_request['format_options'])
+    finally:
+        if slot:
+            slot.release()
+
+def iter_batch_results(download_requests, temp_dir, batch_id):
+    """Baixa os itens em paralelo e produz (índice, pedido, caminho, erro) na ordem em que terminam."""
+    workers = min(BATCH_MAX_WORKERS, len(download_requests))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as executor:
+        futures = {executor.submit(_fetch_item, index, download_request, temp_dir, batch_id): (index, download_request)
+                   for index, download_request in enumerate(download_requests)}
+        try:
+            for future in as_completed(futures):
+                index, download_request = futures[future]
+                try:
+                    path = future.result()
+                except Exception as e:
+                    logger.error(f"Lote {batch_id} - Item {index} falhou: {e}")
+                    metrics.count_request(download_request['platform'], 'batch_failed')
+                    yield index, download_request, None, str(e)
+                    continue
+                metrics.count_request(download_request['platform'], 'batch_finished')
+                yield index, download_request, path, None
+        finally:
+            # Cliente desconectou: descarta os itens que ainda nem começaram
+            for future in futures:
+                future.cancel()
+
+def _item_report(index, download_request, path, error):
+    report = {
+        'index': index, 'platform': download_request['platform'], 'url': download_request['url'],
+        'username': download_request['username'], 'ig_action': download_request['ig_action'],
+        'format': download_request['format'], 'status': 'failed' if error else 'finished', 'error': error,
+    }
+    if path:
+        report['filename'] = os.path.basename(path)
+        report['size'] = os.path.getsize(path)
+    return report
+
+def iter_batch_zip_members(download_requests, temp_dir, batch_id):
+    """Arquivos para o ZIP do lote, na ordem de conclusão; por último, um relatório com o status de cada item."""
+    reports = []
+    for index, download_request, path, error in iter_batch_results(download_requests, temp_dir, batch_id):
+        reports.append(_item_report(index, download_request, path, error))
+        if path:
+            yield path
+
+    report_path = os.path.join(temp_dir, BATCH_REPORT_FILENAME)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(sorted(reports, key=lambda r: r['index']), f, ensure_ascii=False, indent=2)
+    yield report_path
+
+def iter_batch_ndjson(download_requests, temp_dir, batch_id):
+    """Uma linha JSON por item concluído e uma linha final de resumo.
+
+    Cada item concluído recebe 'download_url' para o cliente baixar depois: /api/files/<token> (retido no cache)
+    ou, se o arquivo não ficou no cache (cache desligado ou arquivo grande demais), /api/jobs/<id>/file.
+    """
+    finished = failed = 0
+    for index, download_request, path, error in iter_batch_results(download_requests, temp_dir, batch_id):
+        report = _item_report(index, download_request, path, error)
+        if not error:
+            token = result_token_for(path)
+            if token:
+                report['download_url'] = f"/api/files/{token}"
+            else:
+                # O diretório do lote é apagado ao final: o arquivo passa a ser o resultado de um job
+                try:
+                    report['download_url'] = public_job_view(job_manager.store_result(download_request, path))['file_url']
+                except OSError as e:
+                    logger.error(f"Lote {batch_id} - Item {index}: Não foi possível guardar o resultado: {e}")
+                    report.update(status='failed', error="Resultado baixado, mas não pôde ser guardado para download.")
+        if report['status'] == 'failed':
+            failed += 1
+        else:
+            finished += 1
+        yield json.dumps(report, ensure_ascii=False) + "\n"
+    yield json.dumps({'done': True, 'finished': finished, 'failed': failed}) + "\n"
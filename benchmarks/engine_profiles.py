@@ -0,0 +1,77 @@
+"""Benchmark dos perfis do motor de download do yt-dlp contra o servidor de fixtures local.
+
+Uso (na raiz do projeto):
+    python benchmarks/engine_profiles.py [--profiles default,fast,aria2c] [--runs 3] [--json resultado.json]
+
+Para cada perfil baixa um arquivo progressivo (Range) e uma playlist HLS fragmentada, com a banda por
+conexão limitada no servidor, e reporta a mediana do tempo, a vazão e as requisições feitas à origem.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import yt_dlp # noqa: E402
+import platform_downloader # noqa: E402
+from fixture_server import FixtureServer # noqa: E402
+
+FIXTURES = {'progressive': '/progressive.mp4', 'hls': '/hls/playlist.m3u8'}
+
+def download_once(server, path, profile_name):
+    """Baixa a fixture com as opções do perfil. Retorna (segundos, bytes, requisições à origem)."""
+    temp_dir = tempfile.mkdtemp(prefix='bench_engine_')
+    try:
+        ydl_opts = platform_downloader._base_ydl_opts('benchmark', temp_dir)
+        ydl_opts.update(platform_downloader.engine_options(profile_name))
+        ydl_opts.update({'quiet': True, 'verbose': False, 'format': 'best', 'fixup': 'never', 'ffmpeg_location': None})
+        requests_before = server.requests
+        started = time.monotonic()
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            ydl.download([server.url(path)])
+        elapsed = time.monotonic() - started
+        size = sum(os.path.getsize(os.path.join(temp_dir, name)) for name in os.listdir(temp_dir))
+        return elapsed, size, server.requests - requests_before
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profiles', default=','.join(platform_downloader._engine_profiles))
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--size-mb', type=int, default=16)
+    parser.add_argument('--segments', type=int, default=32)
+    parser.add_argument('--bandwidth-kb', type=int, default=2048, help="Limite por conexão em KiB/s (0 = sem limite)")
+    parser.add_argument('--latency-ms', type=int, default=20)
+    parser.add_argument('--json', dest='json_path', help="Grava o resultado neste arquivo")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    results = []
+    with FixtureServer(0, args.size_mb, args.segments, args.bandwidth_kb * 1024, args.latency_ms / 1000) as server:
+        for profile_name in args.profiles.split(','):
+            options = platform_downloader.engine_options(profile_name)
+            for fixture, path in FIXTURES.items():
+                samples = sorted(download_once(server, path, profile_name) for _ in range(args.runs))
+                elapsed, size, origin_requests = samples[len(samples) // 2]
+                result = {
+                    'profile': profile_name, 'fixture': fixture, 'options': options,
+                    'median_seconds': round(elapsed, 3), 'throughput_mb_s': round(size / elapsed / 1024 / 1024, 2),
+                    'bytes': size, 'origin_requests': origin_requests,
+                }
+                results.append(result)
+                print(f"{profile_name:<10} {fixture:<12} {result['median_seconds']:>8.3f}s "
+                      f"{result['throughput_mb_s']:>8.2f} MB/s {origin_requests:>5} req")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
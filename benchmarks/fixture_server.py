@@ -0,0 +1,149 @@
+"""Servidor HTTP local de mídias sintéticas para os benchmarks (sem depender das plataformas reais).
+
+Serve, a partir de bytes gerados em memória:
+    /progressive.mp4          arquivo único, com suporte a Range (http_chunk_size / aria2c)
+    /hls/playlist.m3u8        playlist HLS com SEGMENTS fragmentos (/hls/seg<N>.ts)
+    /media/<nome>.mp4|.jpg    o mesmo vídeo (ou uma imagem pequena) sob qualquer nome, para URLs únicas por requisição
+
+Cada conexão é limitada a `bandwidth` bytes/s e cada requisição recebe `latency` segundos de atraso,
+simulando uma origem que estrangula conexões individuais.
+
+Uso isolado: python benchmarks/fixture_server.py --port 8765 --size-mb 16 --bandwidth-kb 2048
+"""
+import os
+import re
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WRITE_CHUNK_SIZE = 64 * 1024
+IMAGE_SIZE = 256 * 1024
+
+class FixtureServer:
+    """Servidor em thread; use como context manager e monte as URLs com `url(path)`."""
+
+    def __init__(self, port=0, size_mb=16, segments=32, bandwidth=2 * 1024 * 1024, latency=0.02):
+        self.payload = os.urandom(size_mb * 1024 * 1024)
+        self.image = self.payload[:IMAGE_SIZE]
+        self.segment_size = len(self.payload) // segments
+        self.segments = segments
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.port}{path}"
+
+    def playlist(self):
+        duration = 4
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{duration}', '#EXT-X-MEDIA-SEQUENCE:0']
+        for index in range(self.segments):
+            lines += [f'#EXTINF:{duration}.0,', f'seg{index}.ts']
+        return ('\n'.join(lines + ['#EXT-X-ENDLIST']) + '\n').encode()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def handle(self):
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass # Cliente fechou a conexão keep-alive
+
+            def _resolve(self):
+                path = self.path.split('?')[0]
+                if path == '/progressive.mp4' or (path.startswith('/media/') and path.endswith('.mp4')):
+                    return server.payload, 'video/mp4'
+                if path.startswith('/media/') and path.endswith('.jpg'):
+                    return server.image, 'image/jpeg'
+                if path == '/hls/playlist.m3u8':
+                    return server.playlist(), 'application/vnd.apple.mpegurl'
+                match = re.match(r'^/hls/seg(\d+)\.ts', self.path)
+                if match and int(match.group(1)) < server.segments:
+                    start = int(match.group(1)) * server.segment_size
+                    return server.payload[start:start + server.segment_size], 'video/mp2t'
+                return None, None
+
+            def _send_body(self, body):
+                started = time.monotonic()
+                for offset in range(0, len(body), WRITE_CHUNK_SIZE):
+                    self.wfile.write(body[offset:offset + WRITE_CHUNK_SIZE])
+                    if server.bandwidth:
+                        # Mantém a conexão no máximo em `bandwidth` bytes/s
+                        delay = (offset + WRITE_CHUNK_SIZE) / server.bandwidth - (time.monotonic() - started)
+                        if delay > 0:
+                            time.sleep(delay)
+
+            def _respond(self, send_body):
+                with server._lock:
+                    server.requests += 1
+                time.sleep(server.latency)
+                body, content_type = self._resolve()
+                if body is None:
+                    self.send_error(404)
+                    return
+                status, headers = 200, {}
+                range_match = re.match(r'^bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+                if range_match and (range_match.group(1) or range_match.group(2)):
+                    start = int(range_match.group(1) or 0)
+                    end = min(int(range_match.group(2) or len(body) - 1), len(body) - 1)
+                    headers['Content-Range'] = f"bytes {start}-{end}/{len(body)}"
+                    body, status = body[start:end + 1], 206
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Accept-Ranges', 'bytes')
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if send_body:
+                    try:
+                        self._send_body(body)
+                    except (BrokenPipeError, ConnectionResetError):
+                        pass
+
+            def do_HEAD(self):
+                self._respond(send_body=False)
+
+            def do_GET(self):
+                self._respond(send_body=True)
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, name="fixture-server", daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--size-mb', type=int, default=16)
+    parser.add_argument('--segments', type=int, default=32)
+    parser.add_argument('--bandwidth-kb', type=int, default=2048, help="Limite por conexão em KiB/s (0 = sem limite)")
+    parser.add_argument('--latency-ms', type=int, default=20)
+    args = parser.parse_args()
+    with FixtureServer(args.port, args.size_mb, args.segments, args.bandwidth_kb * 1024, args.latency_ms / 1000) as server:
+        print(f"Servindo em {server.url('/')} (Ctrl+C para encerrar)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()
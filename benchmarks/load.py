@@ -0,0 +1,234 @@
+"""Teste de carga local: o app sob gunicorn contra origens substitutas (fixture_server + standin_app).
+
+Uso (na raiz do projeto):
+    python benchmarks/load.py [--scenarios single,concurrent,mp3,zip] [--json resultado.json] [--compare base.json]
+
+Sobe o servidor de fixtures e o gunicorn (gunicorn.conf.py) com benchmarks/standin_app.py, que encaminha
+YouTube/TikTok para o extractor genérico do yt-dlp e o Instagram para um Instaloader simulado. Para cada
+cenário mede vazão, latência p50/p99 (resposta completa), pico de RSS (master + workers) e pico de uso do
+disco temporário (TMPDIR dedicado ao app). Com --compare, mostra a variação em relação a um resultado anterior.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fixture_server import FixtureServer # noqa: E402
+from startup import _children, _wait_health # noqa: E402
+
+SAMPLE_INTERVAL_SECONDS = 0.05
+# Métricas comparadas com --compare: (chave, maior é melhor)
+COMPARED_METRICS = (('throughput_rps', True), ('p50_seconds', False), ('p99_seconds', False),
+                    ('peak_rss_kb', False), ('peak_temp_disk_kb', False))
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except FileNotFoundError:
+        pass
+    return 0
+
+def _disk_usage_kb(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_blocks * 512
+            except FileNotFoundError:
+                pass # Arquivo removido durante a varredura
+    return total // 1024
+
+class ResourceSampler:
+    """Amostra em thread a soma do RSS do master e workers e o uso do TMPDIR do app, guardando os picos."""
+
+    def __init__(self, master_pid, temp_root):
+        self.master_pid = master_pid
+        self.temp_root = temp_root
+        self.peak_rss_kb = 0
+        self.peak_temp_disk_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="resource-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            pids = [self.master_pid] + _children(self.master_pid)
+            self.peak_rss_kb = max(self.peak_rss_kb, sum(_rss_kb(pid) for pid in pids))
+            self.peak_temp_disk_kb = max(self.peak_temp_disk_kb, _disk_usage_kb(self.temp_root))
+            self._stop.wait(SAMPLE_INTERVAL_SECONDS)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def _fetch(url, timeout):
+    """Faz a requisição e consome a resposta inteira. Retorna (segundos, bytes, status)."""
+    started = time.monotonic()
+    size = 0
+    try:
+        with requests.get(url, stream=True, timeout=timeout) as response:
+            for chunk in response.iter_content(64 * 1024):
+                size += len(chunk)
+            status = response.status_code
+    except requests.RequestException:
+        status = None
+    return time.monotonic() - started, size, status
+
+def _scenarios(server, args):
+    """Nome -> (concorrência, função que monta a URL da i-ésima requisição). URLs únicas evitam os caches."""
+    run_id = int(time.time())
+
+    def api(**params):
+        return f"http://127.0.0.1:{args.port}/api/download?{urllib.parse.urlencode(params)}"
+
+    def media(prefix, index):
+        return server.url(f"/media/{prefix}-{run_id}-{index}.mp4")
+
+    return {
+        'single': (1, lambda i: api(url=media('yt', i))),
+        'concurrent': (args.concurrency, lambda i: api(url=media('tt' if i % 2 else 'yt', i))),
+        'mp3': (1, lambda i: api(url=media('yt', f"mp3-{i}"), format='mp3')),
+        'zip': (1, lambda i: api(url=f"https://www.instagram.com/p/BENCH{run_id}x{i}/")),
+    }
+
+def run_scenario(name, concurrency, build_url, master_pid, temp_root, args):
+    urls = [build_url(index) for index in range(args.requests)]
+    with ResourceSampler(master_pid, temp_root) as sampler:
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(lambda url: _fetch(url, args.timeout), urls))
+        elapsed = time.monotonic() - started
+    latencies = [seconds for seconds, _, status in results if status == 200]
+    total_bytes = sum(size for _, size, status in results if status == 200)
+    return {
+        'scenario': name, 'concurrency': concurrency, 'requests': len(urls),
+        'ok': len(latencies), 'errors': len(urls) - len(latencies),
+        'statuses': sorted({str(status) for _, _, status in results}),
+        'wall_seconds': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 3),
+        'throughput_mb_s': round(total_bytes / elapsed / 1024 / 1024, 2),
+        'p50_seconds': round(_percentile(latencies, 0.5), 3) if latencies else None,
+        'p99_seconds': round(_percentile(latencies, 0.99), 3) if latencies else None,
+        'peak_rss_kb': sampler.peak_rss_kb,
+        'peak_temp_disk_kb': sampler.peak_temp_disk_kb,
+    }
+
+def start_app(args, fixture_url, work_dir):
+    """Sobe o gunicorn com o standin_app; o TMPDIR e o diretório do Prometheus ficam dentro de work_dir."""
+    env = dict(os.environ, PORT=str(args.port), WEB_CONCURRENCY=str(args.workers), FIXTURE_BASE_URL=fixture_url,
+               TMPDIR=os.path.join(work_dir, 'tmp'), PROMETHEUS_MULTIPROC_DIR=os.path.join(work_dir, 'prometheus'),
+               INSTAGRAM_WARMUP='0', MEDIA_CACHE_ENABLED='1' if args.cache else '0',
+               UPSTREAM_RATE_LIMITS=args.upstream_rate_limits, STANDIN_CAROUSEL_ITEMS=str(args.carousel_items),
+               PYTHONDONTWRITEBYTECODE='1')
+    log_path = os.path.join(work_dir, 'gunicorn.log')
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'standin_app:app', '-c', 'gunicorn.conf.py',
+                                    '--pythonpath', 'benchmarks'], cwd=ROOT_DIR, env=env, stdout=log, stderr=log)
+    if not _wait_health(args.port, time.monotonic() + 60):
+        process.kill()
+        with open(log_path) as log:
+            raise Exception(f"gunicorn não respondeu:\n{''.join(log.readlines()[-20:])}")
+    return process
+
+def compare(results, baseline_path):
+    """Imprime a variação percentual de cada métrica em relação ao resultado anterior."""
+    with open(baseline_path) as f:
+        baseline = {run['scenario']: run for run in json.load(f)['results']}
+    for run in results:
+        previous = baseline.get(run['scenario'])
+        if not previous:
+            continue
+        deltas = []
+        for key, higher_is_better in COMPARED_METRICS:
+            if run.get(key) is None or not previous.get(key):
+                continue
+            change = (run[key] - previous[key]) / previous[key] * 100
+            worse = change < 0 if higher_is_better else change > 0
+            deltas.append(f"{key} {change:+.1f}%{' (pior)' if worse and abs(change) >= 10 else ''}")
+        print(f"  {run['scenario']:<11} {', '.join(deltas)}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default='single,concurrent,mp3,zip')
+    parser.add_argument('--requests', type=int, default=8, help="Requisições por cenário")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--port', type=int, default=0, help="Porta do gunicorn (0 = livre)")
+    parser.add_argument('--size-mb', type=int, default=8, help="Tamanho de cada vídeo servido pelas fixtures")
+    parser.add_argument('--bandwidth-kb', type=int, default=0, help="Limite por conexão na origem em KiB/s (0 = sem limite)")
+    parser.add_argument('--latency-ms', type=int, default=20)
+    parser.add_argument('--carousel-items', type=int, default=6, help="Itens do post do Instagram no cenário zip")
+    parser.add_argument('--upstream-rate-limits', default='', help="UPSTREAM_RATE_LIMITS do app (vazio = sem limite)")
+    parser.add_argument('--cache', action='store_true', help="Mantém o cache de mídia ligado (desligado por padrão)")
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--json', dest='json_path', help="Grava o resultado neste arquivo")
+    parser.add_argument('--compare', dest='baseline_path', help="Resultado anterior (--json) para comparação")
+    args = parser.parse_args()
+    args.port = args.port or _free_port()
+
+    work_dir = tempfile.mkdtemp(prefix='bench_load_')
+    temp_root = os.path.join(work_dir, 'tmp')
+    os.makedirs(temp_root)
+    os.makedirs(os.path.join(work_dir, 'prometheus'))
+    results = []
+    try:
+        with FixtureServer(0, args.size_mb, 32, args.bandwidth_kb * 1024, args.latency_ms / 1000) as server:
+            process = start_app(args, server.url(''), work_dir)
+            try:
+                scenarios = _scenarios(server, args)
+                for name in args.scenarios.split(','):
+                    if name == 'mp3' and not shutil.which('ffmpeg'):
+                        print(f"{name:<11} ignorado: ffmpeg não encontrado")
+                        results.append({'scenario': name, 'skipped': 'ffmpeg não encontrado'})
+                        continue
+                    concurrency, build_url = scenarios[name]
+                    run = run_scenario(name, concurrency, build_url, process.pid, temp_root, args)
+                    results.append(run)
+                    print(f"{name:<11} {run['ok']}/{run['requests']} ok  {run['throughput_rps']:>7.2f} req/s "
+                          f"{run['throughput_mb_s']:>7.2f} MB/s  p50={run['p50_seconds']}s p99={run['p99_seconds']}s  "
+                          f"rss={run['peak_rss_kb']}kB  disco={run['peak_temp_disk_kb']}kB")
+            finally:
+                process.send_signal(signal.SIGTERM)
+                process.wait(timeout=30)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.baseline_path:
+        print(f"Comparação com {args.baseline_path}:")
+        compare([run for run in results if 'skipped' not in run], args.baseline_path)
+    if args.json_path:
+        config = {key: value for key, value in vars(args).items() if key not in ('json_path', 'baseline_path')}
+        with open(args.json_path, 'w') as f:
+            json.dump({'config': config, 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
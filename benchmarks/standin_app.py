@@ -0,0 +1,50 @@
+"""App Flask com as plataformas substituídas pelo servidor de fixtures (benchmarks/fixture_server.py).
+
+    FIXTURE_BASE_URL=http://127.0.0.1:8765 gunicorn standin_app:app -c gunicorn.conf.py --pythonpath benchmarks
+
+- URLs '<FIXTURE_BASE_URL>/media/yt-*.mp4' e '.../media/tt-*.mp4' são tratadas como YouTube e TikTok
+  e baixadas pelo extractor genérico do yt-dlp (mesmo caminho de download, formato e pós-processamento).
+- Posts do Instagram ('https://www.instagram.com/p/<shortcode>/') vêm de um Instaloader simulado:
+  Post.from_shortcode devolve um carrossel de STANDIN_CAROUSEL_ITEMS itens (vídeos e imagens) servidos
+  pelas fixtures; o download paralelo, a extração e o ZIP em streaming são os reais.
+"""
+import os
+import sys
+import zlib
+from datetime import datetime
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIXTURE_BASE_URL = os.environ.get('FIXTURE_BASE_URL', 'http://127.0.0.1:8765').rstrip('/')
+STANDIN_CAROUSEL_ITEMS = int(os.environ.get('STANDIN_CAROUSEL_ITEMS', '6'))
+
+import instaloader # noqa: E402
+import download_service # noqa: E402
+
+_detect_platform = download_service.detect_platform
+
+def detect_platform(url, username_ig=None, ig_action=None):
+    if url and url.startswith(f"{FIXTURE_BASE_URL}/media/"):
+        return 'TikTok' if '/media/tt-' in url else 'YouTube'
+    return _detect_platform(url, username_ig, ig_action)
+
+class StandInPost:
+    """Carrossel com vídeos e imagens alternados, no formato que instagram_downloader._post_media lê."""
+    typename = 'GraphSidecar'
+    owner_username = 'benchmark'
+    date_utc = datetime(2024, 1, 1)
+
+    def __init__(self, shortcode):
+        self.shortcode = shortcode
+        self.mediaid = zlib.crc32(shortcode.encode())
+
+    def get_sidecar_nodes(self):
+        for index in range(STANDIN_CAROUSEL_ITEMS):
+            name = f"{FIXTURE_BASE_URL}/media/ig-{self.shortcode}-{index}"
+            yield SimpleNamespace(is_video=index % 2 == 0, video_url=f"{name}.mp4", display_url=f"{name}.jpg")
+
+download_service.detect_platform = detect_platform
+instaloader.Post.from_shortcode = classmethod(lambda cls, context, shortcode: StandInPost(shortcode))
+
+from app import app # noqa: E402,F401
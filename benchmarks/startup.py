@@ -0,0 +1,129 @@
+"""Benchmark de inicialização: tempo de import e memória (RSS/PSS) por worker do gunicorn.
+
+Uso (na raiz do projeto):
+    python benchmarks/startup.py [--workers 2] [--port 8765] [--json resultado.json]
+
+Mede, em subprocessos limpos, o import do app e dos backends, e sobe o gunicorn com e sem
+preload_app (GUNICORN_PRELOAD) para comparar o tempo até o primeiro health check e a memória de cada processo.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_CASES = {
+    'app': "import app",
+    'asgi': "import asgi",
+    'yt_dlp': "import yt_dlp",
+    'instaloader': "import instaloader",
+    'ytdlp_pool.preload': "import ytdlp_pool; ytdlp_pool.preload()",
+}
+
+def _child_env(extra=None):
+    env = dict(os.environ, INSTAGRAM_WARMUP='0', PYTHONDONTWRITEBYTECODE='1')
+    env.update(extra or {})
+    return env
+
+def measure_import(statement, runs):
+    """Mediana (em segundos) do tempo de execução do statement em um interpretador novo."""
+    code = f"import time; t = time.perf_counter(); {statement}; print(time.perf_counter() - t)"
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', code], cwd=ROOT_DIR, env=_child_env(),
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(float(output.strip().splitlines()[-1]))
+    samples.sort()
+    return samples[len(samples) // 2]
+
+def _memory_kb(pid):
+    """RSS e PSS (páginas compartilhadas divididas entre os processos) em kB, lidos do /proc."""
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('Rss', 'Pss'):
+                    memory[key.lower() + '_kb'] = int(value.split()[0])
+    except FileNotFoundError:
+        pass
+    return memory
+
+def _children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except FileNotFoundError:
+        return []
+
+def _wait_health(port, deadline):
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+def measure_gunicorn(preload, workers, port, settle_seconds):
+    """Sobe o gunicorn, mede o tempo até o primeiro 200 em '/' e a memória do master e de cada worker."""
+    multiproc_dir = tempfile.mkdtemp(prefix='bench_prom_')
+    env = _child_env({'PORT': str(port), 'WEB_CONCURRENCY': str(workers),
+                      'GUNICORN_PRELOAD': '1' if preload else '0', 'PROMETHEUS_MULTIPROC_DIR': multiproc_dir})
+    started = time.monotonic()
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:app', '-c', 'gunicorn.conf.py'],
+                               cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        healthy = _wait_health(port, started + 60)
+        first_health = time.monotonic() - started
+        # Deixa os workers terminarem de subir (e, sem preload, de carregar o yt-dlp em segundo plano)
+        time.sleep(settle_seconds)
+        worker_pids = _children(process.pid)
+        return {
+            'preload': preload,
+            'healthy': healthy,
+            'first_health_check_seconds': round(first_health, 3),
+            'master': _memory_kb(process.pid),
+            'workers': [dict(pid=pid, **_memory_kb(pid)) for pid in worker_pids],
+        }
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=30)
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--runs', type=int, default=3, help="Repetições de cada medida de import")
+    parser.add_argument('--settle', type=float, default=5.0, help="Segundos de espera antes de medir a memória")
+    parser.add_argument('--json', dest='json_path', help="Grava o resultado neste arquivo")
+    args = parser.parse_args()
+
+    results = {'imports_seconds': {}, 'gunicorn': []}
+    for name, statement in IMPORT_CASES.items():
+        results['imports_seconds'][name] = round(measure_import(statement, args.runs), 3)
+        print(f"import {name:<20} {results['imports_seconds'][name]:.3f}s")
+
+    for preload in (True, False):
+        run = measure_gunicorn(preload, args.workers, args.port, args.settle)
+        results['gunicorn'].append(run)
+        print(f"gunicorn preload={'on ' if preload else 'off'} health check em {run['first_health_check_seconds']:.3f}s, "
+              f"master rss={run['master'].get('rss_kb')}kB")
+        for worker in run['workers']:
+            print(f"  worker {worker['pid']}: rss={worker.get('rss_kb')}kB pss={worker.get('pss_kb')}kB")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
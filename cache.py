@@ -0,0 +1,346 @@
+import os
+import re
+import copy
+import json
+import time
+import shutil
+import fcntl
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlparse, parse_qs
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# --- Configuração do Cache (via variáveis de ambiente) ---
+CACHE_ENABLED = os.environ.get('MEDIA_CACHE_ENABLED', '1') != '0'
+CACHE_DIR = os.environ.get('MEDIA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'media_cache'))
+CACHE_MAX_BYTES = int(os.environ.get('MEDIA_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))  # 2 GiB
+CACHE_TTL_SECONDS = int(os.environ.get('MEDIA_CACHE_TTL_SECONDS', str(6 * 3600)))
+# Stories, highlights e perfis mudam com frequência: TTL menor
+CACHE_DYNAMIC_TTL_SECONDS = int(os.environ.get('MEDIA_CACHE_DYNAMIC_TTL_SECONDS', '600'))
+# Resultados entregues continuam disponíveis por /api/files/<token> (retomada, Range) ao menos por este tempo
+CACHE_RESULT_RETENTION_SECONDS = int(os.environ.get('MEDIA_CACHE_RESULT_RETENTION_SECONDS', '1800'))
+# Links curtos do TikTok já resolvidos (ou que falharam) não repetem o HEAD na origem durante este tempo
+TIKTOK_SHARE_CACHE_TTL_SECONDS = int(os.environ.get('TIKTOK_SHARE_CACHE_TTL_SECONDS', '3600'))
+TIKTOK_SHARE_CACHE_MAX_ENTRIES = int(os.environ.get('TIKTOK_SHARE_CACHE_MAX_ENTRIES', '1024'))
+
+INDEX_FILENAME = "index.json"
+LOCK_FILENAME = ".lock"
+OBJECTS_DIRNAME = "objects"
+
+DYNAMIC_KINDS = ('stories', 'highlights', 'profile', 'profile_pic')
+
+_YOUTUBE_ID_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+_CACHE_KEY_RE = re.compile(r'^[a-f0-9]{32}$')
+_TIKTOK_SHARE_HOSTS = ('vm.tiktok.com', 'vt.tiktok.com')
+
+# --- Cache em Memória ---
+class InfoCache:
+    """Cache em memória (info-dicts, resoluções de URL) com TTL e limite de entradas; os valores são copiados."""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+    def put(self, key, info):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, copy.deepcopy(info))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+_tiktok_share_cache = InfoCache(TIKTOK_SHARE_CACHE_TTL_SECONDS, TIKTOK_SHARE_CACHE_MAX_ENTRIES)
+
+# --- Normalização de URLs ---
+def _normalize_youtube(parsed):
+    host = parsed.netloc.lower()
+    path_parts = [p for p in parsed.path.split('/') if p]
+    video_id = None
+    if host.endswith('youtu.be') and path_parts:
+        video_id = path_parts[0]
+    elif path_parts and path_parts[0] == 'watch':
+        video_id = parse_qs(parsed.query).get('v', [None])[0]
+    elif len(path_parts) >= 2 and path_parts[0] in ('shorts', 'embed', 'live', 'v'):
+        video_id = path_parts[1]
+    if video_id and _YOUTUBE_ID_RE.match(video_id):
+        return f"youtube:video:{video_id}"
+    return None
+
+def _resolve_tiktok_share_link(url):
+    """Resolve links curtos do TikTok (vm./vt./tiktok.com/t/) para a URL canônica do vídeo."""
+    resolved = _tiktok_share_cache.get(url)
+    if resolved is not None:
+        return resolved or None # '' = falha já registrada
+    try:
+        resp = requests.head(url, allow_redirects=True, timeout=5)
+        resolved = resp.url
+    except Exception as e:
+        logger.warning(f"Cache: Falha ao resolver link curto do TikTok '{url}': {e}")
+        resolved = ''
+    _tiktok_share_cache.put(url, resolved)
+    return resolved or None
+
+def _normalize_tiktok(parsed, url, resolve_share_links=True):
+    match = re.search(r'/video/(\d+)', parsed.path)
+    if match:
+        return f"tiktok:video:{match.group(1)}"
+    host = parsed.netloc.lower()
+    is_share_link = host in _TIKTOK_SHARE_HOSTS or parsed.path.startswith('/t/')
+    if is_share_link and resolve_share_links:
+        resolved = _resolve_tiktok_share_link(url)
+        if resolved:
+            match = re.search(r'/video/(\d+)', urlparse(resolved).path)
+            if match:
+                return f"tiktok:video:{match.group(1)}"
+    if is_share_link:
+        code = parsed.path.strip('/').split('/')[-1]
+        return f"tiktok:share:{code}" if code else None
+    return None
+
+def _normalize_instagram(parsed):
+    path_parts = [p for p in parsed.path.split('/') if p]
+    if len(path_parts) >= 2 and path_parts[0] in ('p', 'reel', 'reels', 'tv'):
+        return f"instagram:post:{path_parts[1]}"
+    if len(path_parts) >= 2 and path_parts[0] in ('stories', 's'):
+        return f"instagram:stories:{path_parts[1].lower()}"
+    if len(path_parts) >= 3 and path_parts[1] in ('p', 'reel'):  # instagram.com/<user>/p/<shortcode>
+        return f"instagram:post:{path_parts[2]}"
+    if len(path_parts) == 1:
+        return f"instagram:profile:{path_parts[0].lower()}"
+    return None
+
+def canonical_media_id(url=None, username_ig=None, ig_action=None, resolve_share_links=True):
+    """Retorna um identificador canônico ('plataforma:tipo:id') para a mídia, ou None se não reconhecida."""
+    if ig_action:
+        target = (username_ig or url or '').strip().lower()
+        return f"instagram:{ig_action}:{target}" if target else None
+    if not url:
+        return None
+    parsed = urlparse(url if '://' in url else f"https://{url}")
+    host = parsed.netloc.lower()
+    if host.endswith('youtube.com') or host.endswith('youtu.be'):
+        return _normalize_youtube(parsed)
+    if host.endswith('tiktok.com'):
+        return _normalize_tiktok(parsed, url, resolve_share_links)
+    if host.endswith('instagram.com'):
+        return _normalize_instagram(parsed)
+    return None
+
+def build_cache_key(media_id, download_format, variant=None):
+    """Gera a chave do cache (hash do id canônico + formato + variante opcional, ex: limit/since)."""
+    key_source = f"{media_id}|{download_format}" + (f"|{variant}" if variant else "")
+    return hashlib.sha256(key_source.encode('utf-8')).hexdigest()[:32]
+
+def ttl_for_media_id(media_id):
+    kind = media_id.split(':')[1] if media_id and ':' in media_id else None
+    return CACHE_DYNAMIC_TTL_SECONDS if kind in DYNAMIC_KINDS else CACHE_TTL_SECONDS
+
+# --- Cache em Disco ---
+class MediaCache:
+    """Cache de resultados em disco com TTL, limite de tamanho e remoção LRU.
+
+    O índice é compartilhado entre os workers do gunicorn através de um lock de arquivo. Cada resultado
+    armazenado recebe um token próprio (nome do diretório do objeto): o token nunca passa a servir outro
+    conteúdo, e uma versão substituída continua disponível por ele enquanto estiver retida.
+    """
+
+    def __init__(self, root, max_bytes, default_ttl):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.objects_dir = os.path.join(root, OBJECTS_DIRNAME)
+        self.index_path = os.path.join(root, INDEX_FILENAME)
+        self.lock_path = os.path.join(root, LOCK_FILENAME)
+        self._thread_lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    @contextmanager
+    def _locked_index(self):
+        """Abre o índice com lock exclusivo (threads e processos) e o regrava ao final."""
+        with self._thread_lock, open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = self._read_index()
+                yield index
+                self._write_index(index)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            index = {}
+        index.setdefault('entries', {})
+        if 'current' not in index:
+            # Índice anterior aos tokens por versão: o diretório de cada entrada tinha o nome da própria chave
+            index['current'] = {key: key for key in index['entries']}
+            for key, entry in index['entries'].items():
+                entry.setdefault('key', key)
+        index.setdefault('stats', {'hits': 0, 'misses': 0, 'evicted': 0, 'expired': 0, 'stored': 0})
+        return index
+
+    def _write_index(self, index):
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _entry_path(self, token, entry):
+        return os.path.join(self.objects_dir, token, entry['filename'])
+
+    def _drop(self, index, token):
+        entry = index['entries'].pop(token, None)
+        if entry and index['current'].get(entry.get('key')) == token:
+            index['current'].pop(entry['key'])
+        shutil.rmtree(os.path.join(self.objects_dir, token), ignore_errors=True)
+
+    def _retained(self, entry, now):
+        return entry.get('retain_until', 0) > now
+
+    def _lookup(self, index, token, count_miss, allow_retained):
+        now = time.time()
+        entry = index['entries'].get(token) if token else None
+        if entry and entry['expires'] <= now:
+            if self._retained(entry, now):
+                # Expirada para novas requisições, mas o arquivo fica até o fim da retenção
+                entry = entry if allow_retained else None
+            else:
+                self._drop(index, token)
+                index['stats']['expired'] += 1
+                entry = None
+        if entry and not os.path.exists(self._entry_path(token, entry)):
+            self._drop(index, token)
+            entry = None
+        if not entry:
+            if count_miss:
+                index['stats']['misses'] += 1
+            return None
+        entry['last_access'] = now
+        index['stats']['hits'] += 1
+        return self._entry_path(token, entry)
+
+    def get(self, key, count_miss=True, allow_retained=False):
+        """Retorna o caminho do arquivo em cache para a chave, ou None (miss).
+
+        Com allow_retained, entradas expiradas mas ainda retidas (resultado já entregue) também valem.
+        """
+        with self._locked_index() as index:
+            return self._lookup(index, index['current'].get(key), count_miss, allow_retained)
+
+    def get_result(self, token):
+        """Arquivo de um resultado entregue (token de /api/files), inclusive de uma versão já substituída."""
+        with self._locked_index() as index:
+            return self._lookup(index, token, count_miss=False, allow_retained=True)
+
+    def put(self, key, src_path, ttl=None):
+        """Move o arquivo para o cache e retorna o novo caminho (ou o original, se não couber)."""
+        size = os.path.getsize(src_path)
+        if size > self.max_bytes:
+            logger.info(f"Cache: Arquivo '{src_path}' ({size} bytes) excede o limite do cache; não será armazenado.")
+            return src_path
+
+        # Move para um diretório de staging fora do lock; publica com rename atômico
+        staging_dir = tempfile.mkdtemp(prefix=f"{key}.", suffix=".tmp", dir=self.objects_dir)
+        filename = os.path.basename(src_path)
+        shutil.move(src_path, os.path.join(staging_dir, filename))
+        token = hashlib.sha256(f"{key}|{time.time_ns()}|{os.getpid()}|{threading.get_ident()}".encode('utf-8')).hexdigest()[:32]
+
+        now = time.time()
+        with self._locked_index() as index:
+            previous_token = index['current'].get(key)
+            previous = index['entries'].get(previous_token)
+            if previous and self._retained(previous, now):
+                # Quem recebeu o token antigo continua baixando os mesmos bytes até o fim da retenção
+                previous['expires'] = min(previous['expires'], now)
+            elif previous_token:
+                self._drop(index, previous_token)
+            os.replace(staging_dir, os.path.join(self.objects_dir, token))
+            index['entries'][token] = {
+                'key': key, 'filename': filename, 'size': size,
+                'created': now, 'last_access': now,
+                'expires': now + (ttl if ttl is not None else self.default_ttl),
+            }
+            index['current'][key] = token
+            index['stats']['stored'] += 1
+            self._evict(index, now, protect_key=token)
+        return os.path.join(self.objects_dir, token, filename)
+
+    def retain(self, token, seconds=CACHE_RESULT_RETENTION_SECONDS):
+        """Protege uma entrada entregue a um cliente contra expiração e LRU pelos próximos `seconds`."""
+        with self._locked_index() as index:
+            entry = index['entries'].get(token)
+            if entry:
+                entry['retain_until'] = max(entry.get('retain_until', 0), time.time() + seconds)
+
+    def token_for_path(self, path):
+        """Token do arquivo se ele estiver no cache, senão None."""
+        parent = os.path.dirname(os.path.abspath(path))
+        token = os.path.basename(parent)
+        if os.path.dirname(parent) == os.path.abspath(self.objects_dir) and _CACHE_KEY_RE.match(token):
+            return token
+        return None
+
+    def _evict(self, index, now, protect_key=None):
+        """Remove entradas expiradas e, depois, as menos usadas até caber no limite.
+
+        Entradas retidas só saem pelo LRU se as demais não bastarem.
+        """
+        entries = index['entries']
+        for key in [k for k, e in entries.items() if e['expires'] <= now and k != protect_key and not self._retained(e, now)]:
+            self._drop(index, key)
+            index['stats']['expired'] += 1
+
+        total = sum(e['size'] for e in entries.values())
+        for key, entry in sorted(entries.items(), key=lambda item: (self._retained(item[1], now), item[1]['last_access'])):
+            if total <= self.max_bytes:
+                break
+            if key == protect_key:
+                continue
+            total -= entry['size']
+            self._drop(index, key)
+            index['stats']['evicted'] += 1
+            logger.info(f"Cache: Entrada '{key}' removida (LRU).")
+
+    def stats(self):
+        with self._locked_index() as index:
+            entries = index['entries']
+            return dict(index['stats'],
+                        entries=len(entries),
+                        bytes=sum(e['size'] for e in entries.values()),
+                        max_bytes=self.max_bytes)
+
+def is_cache_key(value):
+    return bool(value and _CACHE_KEY_RE.match(value))
+
+media_cache = MediaCache(CACHE_DIR, CACHE_MAX_BYTES, CACHE_TTL_SECONDS) if CACHE_ENABLED else None
@@ -0,0 +1,186 @@
+import os
+import copy
+import json
+import time
+import base64
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from platform_downloader import classify_download_error
+from upstream_guard import chained_messages, THROTTLE_ERROR_CLASSES
+
+logger = logging.getLogger(__name__)
+
+# --- Configuração das Credenciais (via variáveis de ambiente) ---
+# Conjunto principal de cookies do YouTube: arquivo de cookies (formato Netscape) em Base64
+YOUTUBE_COOKIES_FILE_CONTENT = os.environ.get('YOUTUBE_COOKIES_FILE_CONTENT')
+# Conjuntos extras para rodízio entre contas: lista JSON de arquivos em Base64, ex: '["<b64>", "<b64>"]'
+YOUTUBE_COOKIES_POOL_JSON = os.environ.get('YOUTUBE_COOKIES_POOL_JSON')
+# Cookies renovados pelo yt-dlp são persistidos aqui e recarregados no próximo start e pelos outros workers
+CREDENTIALS_DIR = os.environ.get('CREDENTIALS_DIR', os.path.join(tempfile.gettempdir(), 'credentials'))
+# Tempo que um conjunto de cookies fica fora do rodízio após um bloqueio (bot/429)
+COOKIE_SET_COOLDOWN_SECONDS = int(os.environ.get('COOKIE_SET_COOLDOWN_SECONDS', '900'))
+
+SOURCE_SUFFIX = ".source"
+
+def load_cookie_sets_from_env():
+    """Decodifica os cookies configurados uma única vez. Retorna {plataforma: [(nome, conteúdo Netscape)]}."""
+    encoded = [YOUTUBE_COOKIES_FILE_CONTENT] if YOUTUBE_COOKIES_FILE_CONTENT else []
+    if YOUTUBE_COOKIES_POOL_JSON:
+        try:
+            encoded += [item for item in json.loads(YOUTUBE_COOKIES_POOL_JSON) if item not in encoded]
+        except ValueError as e:
+            logger.error(f"Credenciais: YOUTUBE_COOKIES_POOL_JSON inválido: {e}")
+    sets = []
+    for index, content_b64 in enumerate(encoded):
+        try:
+            sets.append((f"youtube_{index}", base64.b64decode(content_b64).decode('utf-8')))
+        except Exception as e:
+            logger.error(f"Credenciais: Falha ao decodificar o conjunto {index} de cookies do YouTube: {e}")
+    return {'YouTube': sets} if sets else {}
+
+def _jar_fingerprint(jar):
+    cookies = sorted((c.domain, c.path, c.name, c.value or '', c.expires or 0) for c in jar)
+    return hashlib.sha256(repr(cookies).encode('utf-8')).hexdigest()
+
+class CookieSet:
+    """Cookie jar em memória de uma conta, compartilhado por todas as instâncias do yt-dlp do processo."""
+
+    def __init__(self, platform, name, content):
+        self.platform = platform
+        self.name = name
+        self.content = content
+        self.path = os.path.join(CREDENTIALS_DIR, f"{name}.cookies.txt")
+        self.jar = None
+        self.loaded_mtime = 0
+        self.fingerprint = None
+        self.cooldown_until = 0
+        self.uses = 0
+        self.lock = threading.Lock()
+
+    def _write_seed(self, source_hash):
+        """Grava o conteúdo do env como ponto de partida (também quando o env mudou desde a última persistência)."""
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            f.write(self.content)
+        os.replace(tmp_path, self.path)
+        with open(self.path + SOURCE_SUFFIX, 'w') as f:
+            f.write(source_hash)
+
+    def ensure_loaded(self):
+        """Carrega o jar (na primeira vez) ou incorpora cookies persistidos por outro worker desde a última leitura."""
+        from yt_dlp.cookies import YoutubeDLCookieJar # Importado sob demanda: não pesa no boot do worker
+        with self.lock:
+            if self.jar is None:
+                source_hash = hashlib.sha256(self.content.encode('utf-8')).hexdigest()
+                try:
+                    with open(self.path + SOURCE_SUFFIX) as f:
+                        seeded_from_env = f.read() == source_hash
+                except FileNotFoundError:
+                    seeded_from_env = False
+                if not seeded_from_env or not os.path.exists(self.path):
+                    self._write_seed(source_hash)
+                self.jar = YoutubeDLCookieJar(self.path)
+            mtime = os.path.getmtime(self.path)
+            if mtime > self.loaded_mtime:
+                # load() adiciona/atualiza no mesmo jar: instâncias do yt-dlp que já o usam veem os cookies novos
+                self.jar.load(ignore_discard=True, ignore_expires=True)
+                self.loaded_mtime = mtime
+                self.fingerprint = _jar_fingerprint(self.jar)
+                logger.info(f"Credenciais: Cookies '{self.name}' carregados de '{self.path}'.")
+        return self.jar
+
+    def persist_if_changed(self):
+        """Grava o jar em disco se o yt-dlp recebeu cookies novos (Set-Cookie) desde a última leitura/gravação."""
+        from yt_dlp.cookies import YoutubeDLCookieJar
+        with self.lock:
+            if self.jar is None:
+                return False
+            fingerprint = _jar_fingerprint(self.jar)
+            if fingerprint == self.fingerprint:
+                return False
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            # save() grava cookies de sessão com expires=0 alterando os próprios objetos: grava uma cópia,
+            # senão eles passariam a contar como expirados no jar em uso
+            snapshot = YoutubeDLCookieJar()
+            for cookie in self.jar:
+                snapshot.set_cookie(copy.copy(cookie))
+            try:
+                snapshot.save(tmp_path, ignore_discard=True, ignore_expires=True)
+                os.chmod(tmp_path, 0o600)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Credenciais: Não foi possível persistir os cookies '{self.name}': {e}")
+                return False
+            self.fingerprint = fingerprint
+            self.loaded_mtime = os.path.getmtime(self.path)
+        logger.info(f"Credenciais: Cookies renovados de '{self.name}' persistidos.")
+        return True
+
+class CredentialStore:
+    """Conjuntos de cookies por plataforma, entregues em rodízio e fora dele enquanto estiverem bloqueados."""
+
+    def __init__(self, cookie_sets):
+        self.sets = {platform: [CookieSet(platform, name, content) for name, content in entries]
+                     for platform, entries in cookie_sets.items()}
+        self._next = {}
+        self._lock = threading.Lock()
+        if self.sets:
+            os.makedirs(CREDENTIALS_DIR, mode=0o700, exist_ok=True)
+
+    def acquire(self, platform):
+        """Próximo conjunto de cookies da plataforma fora de cooldown (ou o que sai primeiro dele); None se não houver."""
+        candidates = self.sets.get(platform)
+        if not candidates:
+            return None
+        with self._lock:
+            start = self._next.get(platform, 0)
+            self._next[platform] = (start + 1) % len(candidates)
+        now = time.time()
+        ordered = candidates[start:] + candidates[:start]
+        cookie_set = next((c for c in ordered if c.cooldown_until <= now), None)
+        if cookie_set is None:
+            # Todos bloqueados: melhor tentar com o que libera antes do que seguir sem cookies
+            cookie_set = min(candidates, key=lambda c: c.cooldown_until)
+        cookie_set.ensure_loaded()
+        cookie_set.uses += 1
+        return cookie_set
+
+    def penalize(self, cookie_set):
+        cookie_set.cooldown_until = time.time() + COOKIE_SET_COOLDOWN_SECONDS
+        logger.warning(f"Credenciais: Cookies '{cookie_set.name}' bloqueados pela origem; fora do rodízio por "
+                       f"{COOKIE_SET_COOLDOWN_SECONDS}s.")
+
+    def preload(self):
+        """Carrega todos os jars (chamado no master do gunicorn com preload_app, antes do fork)."""
+        for candidates in self.sets.values():
+            for cookie_set in candidates:
+                cookie_set.ensure_loaded()
+
+    def stats(self):
+        now = time.time()
+        return {platform: [{'name': c.name, 'loaded': c.jar is not None, 'cookies': len(c.jar) if c.jar is not None else 0,
+                            'uses': c.uses, 'cooling_down': now < c.cooldown_until} for c in candidates]
+                for platform, candidates in self.sets.items()}
+
+credential_store = CredentialStore(load_cookie_sets_from_env())
+
+@contextmanager
+def cookies_for(platform):
+    """Empresta o conjunto de cookies da plataforma (ou None) durante uma chamada ao yt-dlp.
+
+    Ao final persiste os cookies renovados; um bloqueio (bot/429) tira o conjunto do rodízio.
+    """
+    cookie_set = credential_store.acquire(platform)
+    try:
+        yield cookie_set
+    except Exception as e:
+        if cookie_set and classify_download_error(chained_messages(e)) in THROTTLE_ERROR_CLASSES:
+            credential_store.penalize(cookie_set)
+        raise
+    finally:
+        if cookie_set:
+            cookie_set.persist_if_changed()
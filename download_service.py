@@ -0,0 +1,446 @@
+import os
+import re
+import logging
+import itertools
+import threading
+from contextlib import ExitStack
+
+from instagram_downloader import (lease_instaloader, download_instagram_content, open_instagram_post_stream,
+                                  iter_instagram_content, archive_name_for, parse_since, get_instagram_media_info)
+from platform_downloader import (download_with_yt_dlp, open_progressive_stream, extract_media_info, resolve_media_format,
+                                 PROGRESSIVE_VIDEO_FORMAT)
+from cache import media_cache, canonical_media_id, build_cache_key, ttl_for_media_id, InfoCache
+from singleflight import single_flight
+from upstream_guard import guarded, UpstreamUnavailableError, guard_stats
+from instagram_session_pool import get_session_pool
+from credentials import cookies_for, credential_store
+from utils import MediaStream, iter_zip_stream, STREAM_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# --- Constantes ---
+SUPPORTED_FORMATS = ['video', 'image', 'mp3', 'm4a', 'opus']
+# Áudio entregue no codec original quando disponível (sem ffmpeg); apenas YouTube/TikTok
+AUDIO_PASSTHROUGH_FORMATS = ['m4a', 'opus']
+SUPPORTED_IG_ACTIONS = ['profile_pic', 'stories', 'highlights']
+# format=url: devolve só as URLs diretas da mídia, sem baixar
+URL_FORMAT = 'url'
+URL_MEDIA_KINDS = ['video', 'audio', 'image']
+# Resultados do Instagram com vários arquivos são enviados como ZIP em streaming
+ZIP_STREAMING_ENABLED = os.environ.get('ZIP_STREAMING', '1') != '0'
+# Metadados e URLs assinadas resolvidas ficam pouco tempo em cache (as URLs da CDN expiram)
+MEDIA_INFO_CACHE_TTL_SECONDS = int(os.environ.get('MEDIA_INFO_CACHE_TTL_SECONDS', '300'))
+MEDIA_INFO_CACHE_MAX_ENTRIES = int(os.environ.get('MEDIA_INFO_CACHE_MAX_ENTRIES', '512'))
+# Intervalo com que o envio de um ZIP em geração verifica se há bytes novos no arquivo
+ARCHIVE_POLL_SECONDS = 0.5
+
+# Campos de cada formato devolvidos por /api/info
+INFO_FORMAT_FIELDS = ('format_id', 'ext', 'protocol', 'width', 'height', 'fps', 'vcodec', 'acodec',
+                      'abr', 'tbr', 'filesize', 'filesize_approx', 'format_note', 'url', 'http_headers')
+
+media_info_cache = InfoCache(MEDIA_INFO_CACHE_TTL_SECONDS, MEDIA_INFO_CACHE_MAX_ENTRIES)
+
+def validate_download_params(url, username_ig, download_format, ig_action, allowed_formats=SUPPORTED_FORMATS):
+    """Valida os parâmetros de download. Retorna a mensagem de erro ou None."""
+    if not url and not (username_ig and ig_action):
+        return "Parâmetro 'url' (ou 'username' e 'ig_action' para Instagram) é obrigatório."
+    if download_format not in allowed_formats:
+        return "Parâmetro 'format' inválido. Use 'video', 'image', 'mp3', 'm4a' ou 'opus'."
+    if ig_action and ig_action not in SUPPORTED_IG_ACTIONS:
+        return "Parâmetro 'ig_action' inválido. Use 'profile_pic', 'stories', 'highlights'."
+    return None
+
+def parse_instagram_options(params):
+    """Lê 'limit' (N itens mais recentes) e 'since' (data ISO ou timestamp). Retorna (opções, erro)."""
+    options = {}
+    limit = params.get('limit')
+    if limit:
+        if not str(limit).isdigit() or int(limit) < 1:
+            return None, "Parâmetro 'limit' inválido. Use um inteiro positivo."
+        options['limit'] = int(limit)
+    since = params.get('since')
+    if since:
+        try:
+            parse_since(str(since))
+        except (ValueError, OverflowError, OSError): # ex: since=inf, since=1e20
+            return None, "Parâmetro 'since' inválido. Use uma data ISO (ex: 2024-01-31) ou timestamp Unix."
+        options['since'] = str(since)
+    return options, None
+
+_FILESIZE_RE = re.compile(r'^(\d+)([KMG]?)B?$')
+_FILESIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+def parse_format_options(params):
+    """Lê 'max_height' (pixels) e 'max_filesize' (bytes, ou com sufixo K/M/G). Retorna (opções, erro)."""
+    options = {}
+    max_height = params.get('max_height')
+    if max_height:
+        if not str(max_height).isdigit() or int(max_height) < 1:
+            return None, "Parâmetro 'max_height' inválido. Use um inteiro positivo (ex: 720)."
+        options['max_height'] = int(max_height)
+    max_filesize = str(params.get('max_filesize') or '').strip().upper()
+    if max_filesize:
+        match = _FILESIZE_RE.match(max_filesize)
+        if not match or int(match.group(1)) < 1:
+            return None, "Parâmetro 'max_filesize' inválido. Use bytes ou um valor com K/M/G (ex: 50M)."
+        options['max_filesize'] = int(match.group(1)) * _FILESIZE_UNITS[match.group(2)]
+    return options, None
+
+def _options_variant(*option_sets):
+    """Representação estável das opções (Instagram, limites de formato) para compor a chave do cache."""
+    merged = {}
+    for options in option_sets:
+        merged.update(options or {})
+    return ','.join(f"{k}={v}" for k, v in sorted(merged.items())) or None
+
+def detect_platform(url, username_ig=None, ig_action=None):
+    """Identifica a plataforma da requisição ('YouTube', 'TikTok', 'Instagram') ou None."""
+    if url and ("youtube.com" in url or "youtu.be" in url):
+        return 'YouTube'
+    if url and "tiktok.com" in url:
+        return 'TikTok'
+    if (url and "instagram.com" in url) or (username_ig and ig_action):
+        return 'Instagram'
+    return None
+
+def parse_download_request(params, allowed_formats=SUPPORTED_FORMATS):
+    """Lê e valida um pedido de download (url, username, format, ig_action, limit, since, max_height, max_filesize).
+
+    Retorna (pedido, erro).
+    """
+    url = params.get('url')
+    username_ig = params.get('username') # Para ações do Instagram baseadas em username
+    download_format = (params.get('format') or 'video').lower() # video, image, mp3, m4a, opus
+    ig_action = params.get('ig_action') # profile_pic, stories, highlights, post (post é inferido de URL)
+
+    validation_error = validate_download_params(url, username_ig, download_format, ig_action, allowed_formats)
+    if validation_error:
+        return None, validation_error
+    ig_options, options_error = parse_instagram_options(params) # limit / since (Instagram)
+    if options_error:
+        return None, options_error
+    format_options, options_error = parse_format_options(params) # max_height / max_filesize (YouTube, TikTok)
+    if options_error:
+        return None, options_error
+    platform = detect_platform(url, username_ig, ig_action)
+    if not platform:
+        return None, "URL não suportada ou combinação de parâmetros inválida."
+    if platform == 'Instagram':
+        if download_format in AUDIO_PASSTHROUGH_FORMATS:
+            return None, f"Formato '{download_format}' disponível apenas para YouTube e TikTok."
+        format_options = {} # O Instagram entrega a mídia original, sem escolha de formato
+    return {
+        'platform': platform, 'url': url, 'username': username_ig,
+        'format': download_format, 'ig_action': ig_action, 'ig_options': ig_options, 'format_options': format_options,
+    }, None
+
+def run_platform_download(platform, url, username_ig, temp_dir, download_format, ig_action=None, progress_callback=None, ig_options=None,
+                          format_options=None):
+    """Executa o download na plataforma indicada e retorna a lista de arquivos gerados."""
+    if platform not in ('YouTube', 'TikTok', 'Instagram'):
+        raise ValueError(f"Plataforma não suportada: {platform}")
+    with guarded(platform):
+        if platform in ('YouTube', 'TikTok'):
+            with cookies_for(platform) as cookie_set:
+                return download_with_yt_dlp(platform, url, temp_dir, download_format, cookie_set, progress_callback=progress_callback,
+                                            **(format_options or {}))
+        with lease_instaloader(temp_dir) as instaloader_instance:
+            return download_instagram_content(instaloader_instance, url if url else username_ig, temp_dir, download_format, ig_action,
+                                              **(ig_options or {}))
+
+def _download_single_file(platform, url, username_ig, temp_dir, download_format, ig_action, progress_callback=None, ig_options=None,
+                          format_options=None):
+    downloaded_file_paths = run_platform_download(platform, url, username_ig, temp_dir, download_format, ig_action, progress_callback,
+                                                  ig_options, format_options)
+    if not downloaded_file_paths:
+        raise Exception("Nenhum arquivo foi retornado pela função de download.")
+
+    final_file = downloaded_file_paths[0]
+    if not os.path.exists(final_file):
+        raise Exception(f"Arquivo final '{final_file}' não encontrado no servidor.")
+    return final_file
+
+def _shared_flight_result(flight, cache_key, req_id, media_id):
+    """Outro worker/thread acabou de baixar a mesma mídia: reconsulta o cache e repassa a falha recente do líder."""
+    cached_file = media_cache.get(cache_key, count_miss=False)
+    if cached_file:
+        logger.info(f"Req ID: {req_id} - Resultado compartilhado de download simultâneo - MediaID='{media_id}'")
+        return cached_file
+    previous_failure = flight.recent_failure()
+    if previous_failure:
+        raise Exception(previous_failure)
+    return None
+
+def _stale_result(cache_key, req_id, media_id):
+    """Origem bloqueando: um resultado expirado, mas ainda retido, é melhor que falhar."""
+    stale_file = media_cache.get(cache_key, count_miss=False, allow_retained=True)
+    if stale_file:
+        logger.warning(f"Req ID: {req_id} - Origem indisponível; servindo resultado retido - MediaID='{media_id}'")
+    return stale_file
+
+def fetch_media(platform, url, username_ig, download_format, ig_action, temp_dir, req_id, progress_callback=None, ig_options=None,
+                format_options=None):
+    """Retorna o caminho do arquivo final, servindo do cache ou baixando uma única vez por chave.
+
+    Requisições simultâneas para a mesma mídia (mesmo id canônico e formato) são coalescidas:
+    apenas uma baixa, as demais aguardam e recebem o resultado publicado no cache.
+    """
+    media_id = canonical_media_id(url, username_ig, ig_action)
+    cache_key = (build_cache_key(media_id, download_format, _options_variant(ig_options, format_options))
+                 if media_cache and media_id else None)
+    if not cache_key:
+        return _download_single_file(platform, url, username_ig, temp_dir, download_format, ig_action, progress_callback, ig_options,
+                                     format_options)
+
+    cached_file = media_cache.get(cache_key)
+    if cached_file:
+        logger.info(f"Req ID: {req_id} - Cache HIT - MediaID='{media_id}', Format='{download_format}'")
+        return cached_file
+
+    with single_flight(cache_key) as flight:
+        if flight.waited:
+            cached_file = _shared_flight_result(flight, cache_key, req_id, media_id)
+            if cached_file:
+                return cached_file
+
+        try:
+            final_file = _download_single_file(platform, url, username_ig, temp_dir, download_format, ig_action, progress_callback, ig_options,
+                                               format_options)
+        except UpstreamUnavailableError:
+            stale_file = _stale_result(cache_key, req_id, media_id)
+            if stale_file:
+                return stale_file
+            raise
+        except Exception as e:
+            flight.record_failure(str(e))
+            raise
+        flight.clear_failure()
+        # Move o resultado para o cache antes da limpeza do diretório temporário
+        return media_cache.put(cache_key, final_file, ttl_for_media_id(media_id))
+
+def result_token_for(file_path):
+    """Token imutável do resultado no cache, já protegido para retomada; None fora do cache."""
+    token = media_cache.token_for_path(file_path) if media_cache else None
+    if token:
+        media_cache.retain(token)
+    return token
+
+def get_cached_media(url, username_ig, download_format, ig_action, ig_options=None, format_options=None):
+    """Consulta o cache sem baixar nada. Retorna o caminho do arquivo ou None."""
+    media_id = canonical_media_id(url, username_ig, ig_action)
+    if not media_cache or not media_id:
+        return None
+    return media_cache.get(build_cache_key(media_id, download_format, _options_variant(ig_options, format_options)), count_miss=False)
+
+def open_media_stream(platform, url, username_ig, download_format, ig_action, temp_dir, format_options=None):
+    """Abre um MediaStream para formatos progressivos, ou None se for preciso o download completo."""
+    if platform == 'Instagram' and (not url or ig_action):
+        return None
+    with guarded(platform):
+        if platform in ('YouTube', 'TikTok'):
+            with cookies_for(platform) as cookie_set:
+                return open_progressive_stream(platform, url, temp_dir, download_format, cookie_set, **(format_options or {}))
+        if platform == 'Instagram':
+            with lease_instaloader(temp_dir) as instaloader_instance:
+                return open_instagram_post_stream(instaloader_instance, url, download_format)
+    return None
+
+def _open_instagram_files(target, download_format, ig_action, temp_dir, ig_options):
+    """Inicia o download item a item. Retorna (primeiros arquivos, gerador com os demais, função de fechamento).
+
+    O gerador continua consultando o Instagram: o contexto do Instaloader fica emprestado até o fechamento.
+    """
+    with ExitStack() as lease_scope:
+        with guarded('Instagram'):
+            instaloader_instance = lease_scope.enter_context(lease_instaloader(temp_dir))
+            files = iter_instagram_content(instaloader_instance, target, temp_dir, download_format, ig_action, **(ig_options or {}))
+            first_files = list(itertools.islice(files, 2))
+        lease = lease_scope.pop_all()
+
+    def close():
+        try:
+            files.close()
+        finally:
+            lease.close()
+    return first_files, files, close
+
+def _archive_to_cache(archive_name, files, close_files, archive_path, cache_key, ttl, flight, release_flight, req_id):
+    """Gera o ZIP em uma thread própria, gravando-o em disco, e o publica no cache ao terminar.
+
+    Retorna um MediaStream que acompanha o arquivo enquanto ele cresce. O single-flight é liberado assim que o
+    ZIP fica pronto, sem depender da velocidade do cliente; fechar o stream aguarda o fim da geração.
+    """
+    try:
+        archive = open(archive_path, 'wb', buffering=0)
+        reader = open(archive_path, 'rb') # Aberto antes da publicação: continua válido quando o arquivo vai para o cache
+    except OSError:
+        with release_flight:
+            close_files()
+        raise
+    progress = threading.Event()
+    finished = threading.Event()
+    failures = []
+
+    def produce():
+        try:
+            with archive:
+                for chunk in iter_zip_stream(files, platform='Instagram'):
+                    archive.write(chunk)
+                    progress.set()
+        except Exception as e:
+            logger.exception(f"Req ID: {req_id} - Falha ao gerar o ZIP do Instagram")
+            failures.append(e)
+            flight.record_failure(str(e))
+        try:
+            close_files()
+            if not failures:
+                flight.clear_failure()
+                media_cache.put(cache_key, archive_path, ttl)
+        except Exception:
+            logger.exception(f"Req ID: {req_id} - Falha ao publicar o ZIP no cache")
+        finally:
+            release_flight.close()
+            finished.set()
+            progress.set()
+
+    def read_chunks():
+        while True:
+            progress.clear()
+            done = finished.is_set()
+            chunk = reader.read(STREAM_CHUNK_SIZE)
+            if chunk:
+                yield chunk
+            elif done:
+                if failures:
+                    raise Exception(f"Falha ao gerar o ZIP: {failures[0]}")
+                return
+            else:
+                progress.wait(ARCHIVE_POLL_SECONDS)
+
+    def close():
+        producer.join()
+        reader.close()
+
+    producer = threading.Thread(target=produce, name=f"zip-{req_id}", daemon=True)
+    producer.start()
+    return MediaStream(archive_name, read_chunks(), close)
+
+def open_instagram_result(url, username_ig, download_format, ig_action, temp_dir, req_id, ig_options=None):
+    """Baixa do Instagram item a item. Retorna (caminho, None) para um único arquivo, ou (None, MediaStream do ZIP).
+
+    O ZIP é gerado enquanto os itens ainda estão sendo baixados. Sem cache, ele é montado em memória à medida
+    que o cliente lê; com o cache ligado, uma thread o grava em disco e o publica no cache, e o cliente acompanha
+    o arquivo. O single-flight da chave fica com o líder até o ZIP ficar pronto (não até o fim do envio):
+    requisições simultâneas aguardam e recebem o resultado do cache, sem consultar o Instagram de novo.
+    """
+    target = url if url else username_ig
+    archive_name = archive_name_for(target, ig_action)
+    media_id = canonical_media_id(url, username_ig, ig_action)
+    cache_key = (build_cache_key(media_id, download_format, _options_variant(ig_options))
+                 if media_cache and media_id else None)
+    if not cache_key:
+        first_files, files, close_files = _open_instagram_files(target, download_format, ig_action, temp_dir, ig_options)
+        if len(first_files) > 1:
+            return None, MediaStream(archive_name, iter_zip_stream(itertools.chain(first_files, files), platform='Instagram'), close_files)
+        close_files()
+        return first_files[0], None
+
+    with ExitStack() as flight_scope:
+        flight = flight_scope.enter_context(single_flight(cache_key))
+        if flight.waited:
+            cached_file = _shared_flight_result(flight, cache_key, req_id, media_id)
+            if cached_file:
+                return cached_file, None
+        try:
+            first_files, files, close_files = _open_instagram_files(target, download_format, ig_action, temp_dir, ig_options)
+        except UpstreamUnavailableError:
+            stale_file = _stale_result(cache_key, req_id, media_id)
+            if stale_file:
+                return stale_file, None
+            raise
+        except Exception as e:
+            flight.record_failure(str(e))
+            raise
+        ttl = ttl_for_media_id(media_id)
+        if len(first_files) == 1:
+            close_files()
+            flight.clear_failure()
+            return media_cache.put(cache_key, first_files[0], ttl), None
+        # O single-flight passa a ser liberado pela thread que gera o ZIP
+        release_flight = flight_scope.pop_all()
+
+    return None, _archive_to_cache(archive_name, itertools.chain(first_files, files), close_files,
+                                   os.path.join(temp_dir, archive_name), cache_key, ttl, flight, release_flight, req_id)
+
+# --- Estado das Origens ---
+def upstream_stats():
+    """Estado de cada origem: limitador/circuit breaker, contas do Instagram e conjuntos de cookies do yt-dlp."""
+    stats = guard_stats()
+    stats.setdefault('Instagram', {})['accounts'] = get_session_pool().stats()
+    for platform, cookie_sets in credential_store.stats().items():
+        stats.setdefault(platform, {})['cookie_sets'] = cookie_sets
+    return stats
+
+# --- Metadados e URLs Diretas (sem download) ---
+def _media_info_key(platform, url, username_ig, ig_action, variant):
+    return f"{platform}|{canonical_media_id(url, username_ig, ig_action) or url or username_ig}|{variant}"
+
+def _summarize_ytdlp_info(platform, info):
+    return {
+        'platform': platform, 'id': info.get('id'), 'title': info.get('title'), 'description': info.get('description'),
+        'uploader': info.get('uploader'), 'duration': info.get('duration'), 'timestamp': info.get('timestamp'),
+        'thumbnail': info.get('thumbnail'), 'webpage_url': info.get('webpage_url') or info.get('original_url'),
+        'formats': [{k: f.get(k) for k in INFO_FORMAT_FIELDS} for f in info.get('formats') or [] if f.get('url')],
+    }
+
+def describe_media(platform, url, username_ig, ig_action, temp_dir):
+    """Título, duração, miniatura e formatos (com URLs diretas) da mídia, sem baixar nada."""
+    key = _media_info_key(platform, url, username_ig, ig_action, 'info')
+    summary = media_info_cache.get(key)
+    if summary is not None:
+        return summary
+
+    if platform not in ('YouTube', 'TikTok', 'Instagram'):
+        raise ValueError(f"Plataforma não suportada: {platform}")
+    with guarded(platform):
+        if platform == 'Instagram':
+            with lease_instaloader(temp_dir) as instaloader_instance:
+                summary = get_instagram_media_info(instaloader_instance, url if url else username_ig, ig_action)
+        else:
+            with cookies_for(platform) as cookie_set:
+                summary = _summarize_ytdlp_info(platform, extract_media_info(platform, url, cookie_set))
+    media_info_cache.put(key, summary)
+    return summary
+
+def resolve_media_url(platform, url, username_ig, ig_action, media_kind, temp_dir):
+    """Resolve a URL direta (CDN) da melhor mídia do tipo pedido ('video', 'audio' ou 'image'), sem baixar."""
+    key = _media_info_key(platform, url, username_ig, ig_action, f"url:{media_kind}")
+    resolved = media_info_cache.get(key)
+    if resolved is not None:
+        return resolved
+
+    if platform == 'Instagram' or media_kind == 'image':
+        summary = describe_media(platform, url, username_ig, ig_action, temp_dir)
+        if platform == 'Instagram':
+            wanted = 'image' if media_kind == 'image' else 'video'
+            items = [item for item in summary['items'] if item['type'] == wanted]
+        else:
+            items = [{'type': 'image', 'url': summary['thumbnail']}] if summary.get('thumbnail') else []
+        if not items:
+            raise ValueError(f"Nenhuma mídia do tipo '{media_kind}' disponível para esta URL.")
+        resolved = {'platform': platform, 'id': summary['id'], 'title': summary['title'],
+                    'url': items[0]['url'], 'urls': [item['url'] for item in items], 'requires_merge': False}
+    else:
+        format_spec = f"{PROGRESSIVE_VIDEO_FORMAT}/best" if media_kind == 'video' else 'bestaudio/best'
+        with guarded(platform), cookies_for(platform) as cookie_set:
+            info = resolve_media_format(platform, url, temp_dir, format_spec, cookie_set)
+        # Sem formato progressivo, o yt-dlp escolhe vídeo e áudio separados (o cliente precisa juntar)
+        selected = info.get('requested_formats') or [info]
+        resolved = {
+            'platform': platform, 'id': info.get('id'), 'title': info.get('title'), 'filename': info.get('filename'),
+            'format_id': info.get('format_id'), 'ext': info.get('ext'), 'url': selected[0].get('url'),
+            'urls': [f.get('url') for f in selected], 'http_headers': selected[0].get('http_headers'),
+            'requires_merge': len(selected) > 1,
+        }
+    media_info_cache.put(key, resolved)
+    return resolved
@@ -0,0 +1,45 @@
+# Configuração do Gunicorn: gunicorn app:app -c gunicorn.conf.py
+#
+# Com preload_app o app é importado uma única vez no master e o yt-dlp/instaloader são carregados
+# antes do fork: cada worker nasce pronto (sem pagar o import na primeira requisição) e compartilha
+# essas páginas de memória com o master por copy-on-write.
+import os
+import threading
+
+import instagram_session_pool
+import storage
+
+# Hooks como on_starting rodam depois do preload do app; o warm-up do Instagram precisa ser adiado já aqui,
+# para que as sessões (e suas threads) nasçam em cada worker no post_fork, e não no master.
+instagram_session_pool.defer_warm_up()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '180')) # Downloads longos e conversões
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+def _preload_backends():
+    import ytdlp_pool
+    import credentials
+    ytdlp_pool.preload()
+    instagram_session_pool.preload()
+    credentials.credential_store.preload()
+
+def when_ready(server):
+    # Master já escutando na porta, antes do fork dos workers
+    if preload_app:
+        _preload_backends()
+
+def post_fork(server, worker):
+    # Threads de segundo plano só nos workers: um fork com threads vivas (locks, flock) no master é arriscado
+    instagram_session_pool.start_background_warm_up(force=True)
+    # Remove diretórios de trabalho deixados por workers mortos (timeout do gunicorn) no boot e periodicamente
+    storage.start_orphan_sweeper()
+    if not preload_app:
+        # Sem preload, o worker já responde ao health check e carrega o yt-dlp em segundo plano
+        threading.Thread(target=_preload_backends, name="backend-preload", daemon=True).start()
+
+def child_exit(server, worker):
+    # Descarta os gauges do worker morto nas métricas multiprocesso
+    import metrics
+    metrics.mark_process_dead(worker.pid)
@@ -1,20 +1,31 @@
 import os
+import time
 import logging
 import shutil
-import instaloader
-import base64
+import itertools
+import threading
 import re
-from utils import extract_audio_from_video_if_needed, create_zip_from_files
+import requests
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+import metrics
+from instagram_session_pool import get_session_pool
+from utils import iter_extracted_audio, create_zip_from_files, MediaStream, STREAM_CHUNK_SIZE
 
 logger = logging.getLogger(__name__)
 
 # --- Constantes Específicas do Instagram ---
 DOWNLOAD_TARGET_DIR_IG = "ig_media"
-TMP_SESSION_FILENAME_IG = "instagram_session.tmp"
+# Downloads de mídia simultâneos por requisição e limite de requisições de mídia por segundo (por worker)
+INSTAGRAM_FETCH_WORKERS = int(os.environ.get('INSTAGRAM_FETCH_WORKERS', '6'))
+INSTAGRAM_FETCH_RATE_PER_SECOND = float(os.environ.get('INSTAGRAM_FETCH_RATE_PER_SECOND', '10'))
+PINNED_POSTS_MAX = 3
 
-def get_instaloader_instance(temp_dir):
-    """Cria e configura uma instância do Instaloader, gerenciando a sessão."""
-    session_file_path = os.path.join(temp_dir, TMP_SESSION_FILENAME_IG)
+@contextmanager
+def lease_instaloader(temp_dir):
+    """Instância do Instaloader da requisição, com um contexto autenticado emprestado do pool até o fim do bloco."""
+    import instaloader
     L = instaloader.Instaloader(
         download_pictures=True, download_videos=True, download_video_thumbnails=False,
         save_metadata=False, compress_json=False,
@@ -22,153 +33,329 @@ def get_instaloader_instance(temp_dir):
         filename_pattern="{date_utc}__{mediaid}",
         quiet=False, # Silenciar a saída do instaloader?
     )
+    # A sessão HTTP (cookies, login) vem do pool; só os padrões de diretório são da requisição
+    with get_session_pool().lease_context() as context:
+        L.context = context
+        yield L
 
-    # Tenta carregar a sessão a partir da variável de ambiente
-    session_content_b64 = os.environ.get('INSTAGRAM_SESSION_FILE_CONTENT')
-    if session_content_b64:
-        try:
-            session_content = base64.b64decode(session_content_b64).decode('utf-8')
-            with open(session_file_path, 'w') as f:
-                f.write(session_content)
-            L.load_session_from_file(os.environ['INSTAGRAM_USERNAME'], session_file_path)
-            logger.info("Instaloader: Sessão carregada com sucesso a partir do arquivo de sessão.")
-            return L
-        except Exception as e:
-            logger.error(f"Instaloader: Falha ao carregar sessão a partir do arquivo: {e}")
-            # Continua para tentar login com user/pass se o carregamento falhar
-
-    # Fallback para login com usuário e senha se o carregamento da sessão falhar ou não existir
-    username = os.environ.get('INSTAGRAM_USERNAME')
-    password = os.environ.get('INSTAGRAM_PASSWORD')
-    if username and password:
-        try:
-            L.login(username, password)
-            logger.info(f"Instaloader: Login bem-sucedido para o usuário '{username}'.")
-            # Salva a nova sessão para uso futuro (opcional, mas bom para depuração)
-            L.save_session_to_file(session_file_path)
-            logger.info(f"Instaloader: Nova sessão salva em '{session_file_path}'.")
-            return L
-        except Exception as e:
-            logger.error(f"Instaloader: Falha no login para o usuário '{username}': {e}")
-            raise Exception("Falha na autenticação com Instagram. Verifique as credenciais.")
-    
-    logger.warning("Instaloader: Nenhuma sessão ou credenciais fornecidas. A funcionalidade será limitada.")
-    return L
-
-def download_instagram_content(L, url_or_username, temp_dir_req, download_format, ig_action=None):
-    """Baixa conteúdo do Instagram (posts, stories, etc.) usando uma instância do Instaloader."""
-    profile_username = None
-    is_single_post = False
-    
+def resolve_instagram_target(url_or_username, ig_action=None):
+    """Determina a ação (post, stories, highlights, profile_pic, profile) e o alvo (usuário ou shortcode)."""
     if ig_action in ['stories', 'highlights', 'profile_pic']:
-        profile_username = url_or_username
-    elif "/stories/" in url_or_username or "/s/" in url_or_username:
-        ig_action = 'stories' # Inferir stories de URL
+        return ig_action, url_or_username, None
+    if "/stories/" in url_or_username or "/s/" in url_or_username:
         match = re.search(r'/(?:stories|s)/([a-zA-Z0-9_.-]+)', url_or_username)
         if not match:
             raise ValueError("URL de Story do Instagram inválida.")
-        profile_username = match.group(1)
-    else: # É um post ou perfil
-        is_single_post = "/p/" in url_or_username or "/reel/" in url_or_username
-        if is_single_post:
-            ig_action = 'post'
-        else: # Se não for post, asumimos que é um perfil para baixar tudo
-            ig_action = 'profile' 
-            profile_username = url_or_username
+        return 'stories', match.group(1), None # Inferir stories de URL
+    if "/p/" in url_or_username or "/reel/" in url_or_username:
+        match = re.search(r"/(?:p|reel)/([A-Za-z0-9-_]+)", url_or_username)
+        if not match:
+            raise ValueError("URL de Post do Instagram inválida.")
+        return 'post', None, match.group(1)
+    # Se não for post, assumimos que é um perfil para baixar tudo
+    match = re.search(r'instagram\.com/([a-zA-Z0-9_.-]+)', url_or_username)
+    return 'profile', match.group(1) if match else url_or_username, None
+
+def archive_name_for(url_or_username, ig_action=None):
+    """Nome do ZIP para resultados com vários arquivos."""
+    ig_action, profile_username, shortcode = resolve_instagram_target(url_or_username, ig_action)
+    return f"instagram_{profile_username or shortcode}_{ig_action}.zip"
+
+class _RateLimiter:
+    """Espaça as requisições de mídia para no máximo `rate` por segundo (0 = sem limite)."""
 
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._next_allowed = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_allowed - now
+            self._next_allowed = max(now, self._next_allowed) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+_media_session = None
+_media_session_lock = threading.Lock()
+_rate_limiter = _RateLimiter(INSTAGRAM_FETCH_RATE_PER_SECOND)
+
+def _get_media_session():
+    """Sessão HTTP compartilhada (keep-alive) para baixar mídias da CDN do Instagram."""
+    global _media_session
+    with _media_session_lock:
+        if _media_session is None:
+            _media_session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=INSTAGRAM_FETCH_WORKERS * 2)
+            _media_session.mount('https://', adapter)
+            _media_session.mount('http://', adapter)
+        return _media_session
+
+def parse_since(value):
+    """Converte 'since' (data ISO ou timestamp Unix) em datetime UTC sem fuso, como o Instaloader usa."""
+    if not value:
+        return None
     try:
-        if ig_action == 'post':
-            match = re.search(r"/(?:p|reel)/([A-Za-z0-9-_]+)", url_or_username)
-            if not match:
-                raise ValueError("URL de Post do Instagram inválida.")
-            shortcode = match.group(1)
+        return datetime.fromtimestamp(float(value), timezone.utc).replace(tzinfo=None)
+    except ValueError:
+        pass
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def _media_basename(item):
+    return f"{item.date_utc.strftime('%Y-%m-%d_%H-%M-%S')}__{item.mediaid}"
+
+def _post_media(post):
+    """Lista (URL, nome do arquivo) das mídias de um post, incluindo todos os itens de carrosséis."""
+    basename = _media_basename(post)
+    if post.typename == 'GraphSidecar':
+        return [(node.video_url, f"{basename}_{i}.mp4") if node.is_video else (node.display_url, f"{basename}_{i}.jpg")
+                for i, node in enumerate(post.get_sidecar_nodes(), start=1)]
+    if post.is_video:
+        return [(post.video_url, f"{basename}.mp4")]
+    return [(post.url, f"{basename}.jpg")]
+
+def _story_item_media(item):
+    basename = _media_basename(item)
+    if item.is_video:
+        return [(item.video_url, f"{basename}.mp4")]
+    return [(item.url, f"{basename}.jpg")]
+
+def _fetch_media_file(media_url, target_path):
+    """Baixa uma mídia. Falhas individuais são registradas e ignoradas, como faz o Instaloader."""
+    _rate_limiter.wait()
+    try:
+        with metrics.timed('download', 'Instagram'), _get_media_session().get(media_url, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            with open(target_path, 'wb') as f:
+                for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                    f.write(chunk)
+    except requests.RequestException as e:
+        logger.error(f"Instagram: Falha ao baixar mídia '{os.path.basename(target_path)}': {e}")
+        metrics.count_error('Instagram', 'media_fetch')
+        if os.path.exists(target_path):
+            os.remove(target_path)
+        return None
+    metrics.add_bytes_downloaded('Instagram', os.path.getsize(target_path))
+    return target_path
+
+def _iter_profile_items(L, profile, ig_action, since):
+    """Stories, destaques ou posts do perfil, do mais recente para o mais antigo, filtrados por `since`."""
+    if ig_action == 'stories':
+        for story in L.get_stories(userids=[profile.userid]):
+            for item in story.get_items():
+                if not since or item.date_utc >= since:
+                    yield profile.username, _story_item_media(item)
+    elif ig_action == 'highlights':
+        for highlight in L.get_highlights(profile):
+            for item in highlight.get_items():
+                if not since or item.date_utc >= since:
+                    yield profile.username, _story_item_media(item)
+    elif ig_action == 'profile':
+        older_in_a_row = 0
+        for post in profile.get_posts():
+            if since and post.date_utc < since:
+                # Posts fixados podem aparecer antes dos recentes; só para após vários antigos seguidos
+                older_in_a_row += 1
+                if older_in_a_row > PINNED_POSTS_MAX:
+                    break
+                continue
+            older_in_a_row = 0
+            yield profile.username, _post_media(post)
+
+def _enumerate_items(L, ig_action, profile_username, shortcode, since, limit):
+    """Percorre (sequencialmente, via iteradores do Instaloader) os itens e produz (dono, lista de mídias)."""
+    import instaloader
+    if ig_action == 'post':
+        with metrics.timed('extraction', 'Instagram'):
             post = instaloader.Post.from_shortcode(L.context, shortcode)
-            L.download_post(post, target=os.path.join(temp_dir_req, DOWNLOAD_TARGET_DIR_IG, post.owner_username))
-        elif profile_username:
-            profile = instaloader.Profile.from_username(L.context, profile_username)
-            if ig_action == 'profile_pic':
-                L.download_profilepic(profile, profile_pic_only=True)
-            elif ig_action == 'stories':
-                L.download_stories(userids=[profile.userid], filename_target=os.path.join(temp_dir_req, DOWNLOAD_TARGET_DIR_IG, profile_username))
-            elif ig_action == 'highlights':
-                L.download_highlights(userids=[profile.userid], filename_target=os.path.join(temp_dir_req, DOWNLOAD_TARGET_DIR_IG, profile_username))
-            elif ig_action == 'profile': # Baixar todos os posts do perfil
-                L.download_profile(profile, profile_pic_only=False)
-        else:
-            raise ValueError("Entrada para download do Instagram não reconhecida.")
+        yield post.owner_username, _post_media(post)
+        return
 
-        # --- Pós-processamento e Coleta de Arquivos ---
-        absolute_download_path_for_L = os.path.join(temp_dir_req, DOWNLOAD_TARGET_DIR_IG, profile_username or post.owner_username)
-        logger.info(f"Procurando por mídias baixadas em: {absolute_download_path_for_L}")
+    with metrics.timed('extraction', 'Instagram'):
+        profile = instaloader.Profile.from_username(L.context, profile_username)
+    if ig_action in ('profile_pic', 'profile'):
+        yield profile.username, [(profile.profile_pic_url, f"{profile.username}_profile_pic.jpg")]
+    yield from itertools.islice(_iter_profile_items(L, profile, ig_action, since), limit)
 
-        if not os.path.exists(absolute_download_path_for_L):
-            raise Exception(f"Diretório de download do Instagram não encontrado: {absolute_download_path_for_L}")
+def iter_instagram_media(L, url_or_username, temp_dir_req, ig_action=None, limit=None, since=None):
+    """Baixa as mídias em paralelo e produz cada arquivo assim que ele termina.
 
-        downloaded_videos = []
-        downloaded_images = []
-        for f in os.listdir(absolute_download_path_for_L):
-            if f.endswith('.mp4'):
-                downloaded_videos.append(os.path.join(absolute_download_path_for_L, f))
-            elif f.endswith('.jpg') or f.endswith('.png'):
-                downloaded_images.append(os.path.join(absolute_download_path_for_L, f))
+    A enumeração dos itens segue sequencial (paginação da API); os downloads das mídias rodam em um
+    pool de threads com sessão keep-alive compartilhada e limite de taxa. `limit` restringe aos N
+    itens mais recentes e `since` ignora itens anteriores à data.
+    """
+    ig_action, profile_username, shortcode = resolve_instagram_target(url_or_username, ig_action)
+    since = parse_since(since)
+    download_root = os.path.join(temp_dir_req, DOWNLOAD_TARGET_DIR_IG)
+    items = _enumerate_items(L, ig_action, profile_username, shortcode, since, int(limit) if limit else None)
 
-        if not downloaded_videos and not downloaded_images:
-            raise Exception("Nenhum arquivo do Instagram resultante foi encontrado após o download.")
+    pending = set()
+    with ThreadPoolExecutor(max_workers=INSTAGRAM_FETCH_WORKERS, thread_name_prefix="ig-fetch") as executor:
+        try:
+            for owner, media in items:
+                target_dir = os.path.join(download_root, owner)
+                os.makedirs(target_dir, exist_ok=True)
+                for media_url, filename in media:
+                    if media_url:
+                        pending.add(executor.submit(_fetch_media_file, media_url, os.path.join(target_dir, filename)))
+                # Entrega o que já terminou e limita a quantidade de downloads em andamento
+                done, pending = wait(pending, timeout=0 if len(pending) < INSTAGRAM_FETCH_WORKERS * 2 else None,
+                                     return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.result():
+                        yield future.result()
+            for future in as_completed(pending):
+                if future.result():
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+def iter_instagram_content(L, url_or_username, temp_dir_req, download_format, ig_action=None, limit=None, since=None):
+    """Produz os arquivos finais no formato pedido à medida que cada item do Instagram é baixado.
 
-        processed_files_for_output = []
+    Arquivos que não correspondem ao formato são apagados logo em seguida; no formato 'mp3',
+    os vídeos seguem em pipeline para a extração de áudio.
+    """
+    import instaloader
+    counts = {'media': 0, 'videos': 0, 'output': 0}
+
+    def selected_media():
+        for path in iter_instagram_media(L, url_or_username, temp_dir_req, ig_action, limit, since):
+            counts['media'] += 1
+            is_video = path.endswith('.mp4')
+            counts['videos'] += is_video
+            if (download_format == 'image') != is_video:
+                yield path
+            else:
+                os.remove(path)
+
+    try:
         if download_format == 'mp3':
-            if not downloaded_videos:
-                raise ValueError("Formato 'mp3' solicitado, mas nenhum vídeo foi encontrado para converter.")
-            processed_files_for_output = extract_audio_from_video_if_needed(downloaded_videos, temp_dir_req)
-            # Limpar vídeos originais após conversão
-            for v_path in downloaded_videos:
-                if os.path.exists(v_path): os.remove(v_path)
-        elif download_format == 'video':
-            processed_files_for_output = downloaded_videos
-        elif download_format == 'image':
-            processed_files_for_output = downloaded_images
-
-        if not processed_files_for_output:
-            raise Exception(f"Nenhum arquivo correspondente ao formato '{download_format}' foi encontrado.")
+            output_files = iter_extracted_audio(selected_media(), temp_dir_req, remove_source=True, platform='Instagram')
+        else:
+            output_files = selected_media()
+        for path in output_files:
+            counts['output'] += 1
+            yield path
 
-        # --- Empacotamento e Retorno ---
-        if len(processed_files_for_output) > 1:
-            zip_filename = f"instagram_{profile_username or post.owner_username}_{ig_action}.zip"
-            zip_path = create_zip_from_files(processed_files_for_output, zip_filename, temp_dir_req)
-            if not zip_path:
-                raise Exception("Falha ao criar arquivo ZIP.")
-            
-            # Limpar arquivos individuais após zippar (eles estão em temp_dir_req ou absolute_download_path_for_L)
-            for f_path in processed_files_for_output:
-                if os.path.exists(f_path): os.remove(f_path)
-            # Remover o diretório de download do Instaloader (que está dentro de temp_dir_req)
-            ig_media_root_in_temp = os.path.join(temp_dir_req, DOWNLOAD_TARGET_DIR_IG)
-            if os.path.exists(ig_media_root_in_temp):
-                shutil.rmtree(ig_media_root_in_temp, ignore_errors=True)
-            return [zip_path]
-        elif processed_files_for_output:
-            # Se for um único arquivo, ele pode estar em temp_dir_req (se for mp3 convertido)
-            # ou em absolute_download_path_for_L (se for o original).
-            # Para consistência, vamos mover para temp_dir_req se não estiver lá.
-            single_file = processed_files_for_output[0]
-            if os.path.dirname(single_file) != temp_dir_req:
-                moved_single_file = os.path.join(temp_dir_req, os.path.basename(single_file))
-                shutil.move(single_file, moved_single_file)
-                # Limpar o diretório de download do Instaloader
-                ig_media_root_in_temp = os.path.join(temp_dir_req, DOWNLOAD_TARGET_DIR_IG)
-                if os.path.exists(ig_media_root_in_temp):
-                    shutil.rmtree(ig_media_root_in_temp, ignore_errors=True)
-                return [moved_single_file]
-            return [single_file]
-        else: # Esta branch não deveria ser atingida se a exceção anterior foi levantada.
-            raise Exception("Instagram: Nenhum arquivo final para retornar.")
+        if not counts['media']:
+            raise Exception("Nenhum arquivo do Instagram resultante foi encontrado após o download.")
+        if download_format == 'mp3' and not counts['videos']:
+            raise ValueError("Formato 'mp3' solicitado, mas nenhum vídeo foi encontrado para converter.")
+        if not counts['output']:
+            raise Exception(f"Nenhum arquivo correspondente ao formato '{download_format}' foi encontrado.")
 
     except instaloader.exceptions.ProfileNotExistsException as e:
-        raise Exception(f"Instagram: Perfil '{profile_username or url_or_username}' não encontrado: {e}")
+        metrics.count_error('Instagram', 'private_or_unavailable')
+        raise Exception(f"Instagram: Perfil '{url_or_username}' não encontrado: {e}")
     except ValueError as e: # Nossos próprios ValueErrors
+        metrics.count_error('Instagram', 'invalid_request')
         raise e
     except Exception as e:
         logger.exception(f"Erro inesperado no download do Instagram para '{url_or_username}'")
-        if "Nenhum arquivo do Instagram resultante" in str(e) or "Nenhum vídeo encontrado para converter" in str(e):
+        if isinstance(e, instaloader.exceptions.LoginRequiredException):
+            metrics.count_error('Instagram', 'bot_detection')
+            get_session_pool().penalize(L.context) # A conta foi bloqueada: as próximas requisições usam outra
+        elif isinstance(e, instaloader.exceptions.TooManyRequestsException):
+            metrics.count_error('Instagram', 'rate_limited')
+            get_session_pool().penalize(L.context)
+        elif "Dependência 'ffmpeg'" in str(e):
+            metrics.count_error('Instagram', 'ffmpeg')
+        else:
+            metrics.count_error('Instagram', 'other')
+        if "Nenhum arquivo" in str(e) or "Dependência 'ffmpeg'" in str(e):
              raise e # Re-levanta a exceção mais específica
-        raise Exception(f"Instagram: Erro inesperado durante o processamento: {e}")
\ No newline at end of file
+        raise Exception(f"Instagram: Erro inesperado durante o processamento: {e}")
+
+def download_instagram_content(L, url_or_username, temp_dir_req, download_format, ig_action=None, limit=None, since=None):
+    """Baixa conteúdo do Instagram (posts, stories, etc.) usando uma instância do Instaloader."""
+    processed_files_for_output = list(iter_instagram_content(L, url_or_username, temp_dir_req, download_format, ig_action, limit, since))
+    ig_media_root_in_temp = os.path.join(temp_dir_req, DOWNLOAD_TARGET_DIR_IG)
+
+    # --- Empacotamento e Retorno ---
+    if len(processed_files_for_output) > 1:
+        zip_path = create_zip_from_files(processed_files_for_output, archive_name_for(url_or_username, ig_action), temp_dir_req, platform='Instagram')
+        if not zip_path:
+            raise Exception("Falha ao criar arquivo ZIP.")
+
+        # Limpar arquivos individuais após zippar (eles estão em temp_dir_req ou no diretório do Instaloader)
+        for f_path in processed_files_for_output:
+            if os.path.exists(f_path): os.remove(f_path)
+        shutil.rmtree(ig_media_root_in_temp, ignore_errors=True)
+        return [zip_path]
+
+    # Arquivo único: entregue (ou publicado no cache) direto de onde foi baixado, sem mover para a raiz do temp_dir_req
+    return [processed_files_for_output[0]]
+
+def _media_items(media):
+    return [{'type': 'video' if filename.endswith('.mp4') else 'image', 'ext': os.path.splitext(filename)[1][1:],
+             'url': media_url, 'filename': filename} for media_url, filename in media if media_url]
+
+def get_instagram_media_info(L, url_or_username, ig_action=None):
+    """Metadados e URLs diretas da CDN de um post ou da foto de perfil, sem baixar nenhuma mídia."""
+    import instaloader
+    ig_action, profile_username, shortcode = resolve_instagram_target(url_or_username, ig_action)
+    try:
+        if ig_action == 'post':
+            with metrics.timed('extraction', 'Instagram'):
+                post = instaloader.Post.from_shortcode(L.context, shortcode)
+            caption = post.caption or ''
+            return {
+                'platform': 'Instagram', 'id': post.shortcode, 'title': post.title or caption.split('\n', 1)[0],
+                'description': caption, 'uploader': post.owner_username, 'timestamp': post.date_utc.isoformat(),
+                'duration': post.video_duration, 'thumbnail': post.url,
+                'webpage_url': f"https://www.instagram.com/p/{post.shortcode}/",
+                'items': _media_items(_post_media(post)),
+            }
+        if ig_action == 'profile_pic':
+            with metrics.timed('extraction', 'Instagram'):
+                profile = instaloader.Profile.from_username(L.context, profile_username)
+            return {
+                'platform': 'Instagram', 'id': profile.username, 'title': profile.full_name,
+                'uploader': profile.username, 'thumbnail': profile.profile_pic_url,
+                'webpage_url': f"https://www.instagram.com/{profile.username}/",
+                'items': _media_items([(profile.profile_pic_url, f"{profile.username}_profile_pic.jpg")]),
+            }
+    except instaloader.exceptions.ProfileNotExistsException as e:
+        metrics.count_error('Instagram', 'private_or_unavailable')
+        raise Exception(f"Instagram: Perfil '{url_or_username}' não encontrado: {e}")
+    raise ValueError("Metadados disponíveis apenas para posts e foto de perfil do Instagram.")
+
+def open_instagram_post_stream(L, url, download_format):
+    """Abre um stream direto da mídia de um post com item único. Retorna None para carrosséis."""
+    import instaloader
+    match = re.search(r"/(?:p|reel)/([A-Za-z0-9-_]+)", url)
+    if not match or download_format not in ('video', 'image'):
+        return None
+    with metrics.timed('extraction', 'Instagram'):
+        post = instaloader.Post.from_shortcode(L.context, match.group(1))
+    if post.typename == 'GraphSidecar':
+        logger.info(f"Instagram: Post '{post.shortcode}' é um carrossel; streaming indisponível.")
+        return None
+    if download_format == 'video':
+        if not post.is_video:
+            return None
+        media_url, ext = post.video_url, 'mp4'
+    else:
+        media_url, ext = post.url, 'jpg'
+
+    response = None
+    try:
+        response = requests.get(media_url, stream=True, timeout=30)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        # CDN recusou/expirou a URL: o chamador segue com o download completo
+        logger.warning(f"Instagram: Falha ao abrir o stream do post '{post.shortcode}' ({e}); usando o download completo.")
+        if response is not None:
+            response.close()
+        return None
+    filename = f"{_media_basename(post)}.{ext}"
+    logger.info(f"Instagram: Streaming direto do post '{post.shortcode}' ({filename}).")
+    return MediaStream(filename, response.iter_content(STREAM_CHUNK_SIZE), response.close)
@@ -0,0 +1,353 @@
+import io
+import os
+import json
+import time
+import base64
+import logging
+import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# --- Configuração do Pool de Sessões (via variáveis de ambiente) ---
+# Lista JSON de contas extras: [{"username": "...", "password": "...", "session_b64": "..."}]
+INSTAGRAM_ACCOUNTS_JSON = os.environ.get('INSTAGRAM_ACCOUNTS_JSON')
+# Sessões renovadas são persistidas aqui e reaproveitadas nos próximos starts/workers
+INSTAGRAM_SESSION_DIR = os.environ.get('INSTAGRAM_SESSION_DIR', os.path.join(tempfile.gettempdir(), 'instagram_sessions'))
+INSTAGRAM_HEALTHCHECK_SECONDS = int(os.environ.get('INSTAGRAM_HEALTHCHECK_SECONDS', '600'))
+# Quantas requisições cada conta pode atender por hora (por worker)
+INSTAGRAM_ACCOUNT_BUDGET_PER_HOUR = int(os.environ.get('INSTAGRAM_ACCOUNT_BUDGET_PER_HOUR', '150'))
+# Tempo que uma conta fica fora do rodízio após falhar na autenticação
+INSTAGRAM_ACCOUNT_COOLDOWN_SECONDS = int(os.environ.get('INSTAGRAM_ACCOUNT_COOLDOWN_SECONDS', '900'))
+# Contextos do Instaloader por conta (por worker): cada requisição usa um com exclusividade
+INSTAGRAM_CONTEXTS_PER_ACCOUNT = int(os.environ.get('INSTAGRAM_CONTEXTS_PER_ACCOUNT', '2'))
+# Espera máxima por um contexto livre quando todos estão emprestados
+INSTAGRAM_CONTEXT_WAIT_SECONDS = float(os.environ.get('INSTAGRAM_CONTEXT_WAIT_SECONDS', '30'))
+
+# Autentica as contas em segundo plano assim que o worker sobe
+INSTAGRAM_WARMUP = os.environ.get('INSTAGRAM_WARMUP', '1') != '0'
+
+BUDGET_WINDOW_SECONDS = 3600
+
+def _new_loader():
+    """Instaloader usado apenas para manter o contexto (sessão HTTP autenticada) de uma conta."""
+    import instaloader # Importado sob demanda: não pesa no boot do worker
+    return instaloader.Instaloader(quiet=False)
+
+class ContextPool:
+    """Contextos do Instaloader de uma conta, emprestados com exclusividade (o InstaloaderContext não é thread-safe)."""
+
+    def __init__(self, size, factory):
+        self.size = size
+        self.factory = factory
+        self.created = 0
+        self.members = set()
+        self.idle = []
+        self._available = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """Contexto ocioso ou novo (até `size`); com todos emprestados, espera até `timeout` e retorna None."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._available:
+            while not self.idle and self.created >= self.size:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._available.wait(remaining)
+            if self.idle:
+                return self.idle.pop()
+            context = self.factory()
+            self.created += 1
+            self.members.add(context)
+            return context
+
+    def release(self, context):
+        with self._available:
+            if context in self.members: # Contextos de antes de um reset() são descartados
+                self.idle.append(context)
+                self._available.notify()
+
+    def reset(self):
+        """Descarta os contextos (a sessão da conta foi substituída); os emprestados não voltam ao pool."""
+        with self._available:
+            self.created = 0
+            self.members = set()
+            self.idle = []
+            self._available.notify_all()
+
+def load_accounts_from_env():
+    """Lê as contas configuradas: a conta principal (INSTAGRAM_USERNAME) e as de INSTAGRAM_ACCOUNTS_JSON."""
+    accounts = []
+    username = os.environ.get('INSTAGRAM_USERNAME')
+    if username:
+        accounts.append({
+            'username': username,
+            'password': os.environ.get('INSTAGRAM_PASSWORD'),
+            'session_b64': os.environ.get('INSTAGRAM_SESSION_FILE_CONTENT'),
+        })
+    if INSTAGRAM_ACCOUNTS_JSON:
+        try:
+            for account in json.loads(INSTAGRAM_ACCOUNTS_JSON):
+                if account.get('username') and account['username'] not in [a['username'] for a in accounts]:
+                    accounts.append(account)
+        except ValueError as e:
+            logger.error(f"Instaloader: INSTAGRAM_ACCOUNTS_JSON inválido: {e}")
+    return accounts
+
+class InstagramAccount:
+    """Contexto autenticado de uma conta, com verificação de saúde e orçamento de requisições."""
+
+    def __init__(self, username, password=None, session_b64=None):
+        self.username = username
+        self.password = password
+        self.session_bytes = self._decode_session(session_b64)
+        self.loader = None # Contexto principal: só valida e renova a sessão; as requisições usam `contexts`
+        self.contexts = ContextPool(INSTAGRAM_CONTEXTS_PER_ACCOUNT, self._clone_context)
+        self.last_check = 0
+        self.cooldown_until = 0
+        self.usage = deque()  # timestamps das requisições na janela do orçamento
+        self.lock = threading.Lock()
+        self.refreshing = False # Uma thread revalidando/reautenticando a sessão (rede), fora do `lock`
+        self._refreshed = threading.Condition(self.lock)
+
+    def _decode_session(self, session_b64):
+        """Decodifica a sessão do env uma única vez, na criação do pool."""
+        if not session_b64:
+            return None
+        try:
+            return base64.b64decode(session_b64)
+        except ValueError as e:
+            logger.error(f"Instaloader: Sessão em Base64 inválida para '{self.username}': {e}")
+            return None
+
+    @property
+    def session_path(self):
+        return os.path.join(INSTAGRAM_SESSION_DIR, f"{self.username}.session")
+
+    def _load_persisted_session(self, loader):
+        if not os.path.exists(self.session_path):
+            return False
+        loader.load_session_from_file(self.username, self.session_path)
+        logger.info(f"Instaloader: Sessão de '{self.username}' carregada de '{self.session_path}'.")
+        return True
+
+    def _load_env_session(self, loader):
+        if not self.session_bytes:
+            return False
+        loader.context.load_session_from_file(self.username, io.BytesIO(self.session_bytes))
+        logger.info(f"Instaloader: Sessão de '{self.username}' carregada a partir da variável de ambiente.")
+        return True
+
+    def _persist_session(self, loader):
+        try:
+            loader.save_session_to_file(self.session_path)
+        except Exception as e:
+            logger.warning(f"Instaloader: Não foi possível persistir a sessão de '{self.username}': {e}")
+
+    def _clone_context(self):
+        """Novo contexto com a sessão (cookies) do contexto principal."""
+        main_loader = self.loader
+        if main_loader is None:
+            raise Exception(f"Instagram: Sessão da conta '{self.username}' indisponível no momento.")
+        loader = _new_loader()
+        loader.context.load_session(self.username, main_loader.context.save_session())
+        return loader.context
+
+    def authenticate(self):
+        """Obtém um contexto autenticado: sessão persistida, sessão do env e, por último, login."""
+        for load in (self._load_persisted_session, self._load_env_session):
+            loader = _new_loader()
+            try:
+                if load(loader) and loader.test_login():
+                    self._persist_session(loader)
+                    return loader
+            except Exception as e:
+                logger.error(f"Instaloader: Falha ao carregar sessão de '{self.username}': {e}")
+
+        if self.password:
+            loader = _new_loader()
+            try:
+                loader.login(self.username, self.password)
+            except Exception as e:
+                logger.error(f"Instaloader: Falha no login para o usuário '{self.username}': {e}")
+                return None
+            logger.info(f"Instaloader: Login bem-sucedido para o usuário '{self.username}'.")
+            self._persist_session(loader)
+            return loader
+        return None
+
+    def ensure_healthy(self):
+        """Garante um contexto válido, revalidando a sessão a cada INSTAGRAM_HEALTHCHECK_SECONDS."""
+        now = time.time()
+        if now < self.cooldown_until:
+            return False
+        if self.loader and now - self.last_check < INSTAGRAM_HEALTHCHECK_SECONDS:
+            return True
+        if self.loader and self.loader.test_login():
+            self.last_check = now
+            # Cookies renovados pelo Instagram durante o uso (csrftoken, sessionid) sobrevivem a restarts
+            self._persist_session(self.loader)
+            return True
+        if self.loader:
+            logger.warning(f"Instaloader: Sessão de '{self.username}' expirou; reautenticando.")
+        self.loader = self.authenticate()
+        self.contexts.reset()
+        self.last_check = now
+        if not self.loader:
+            self.cooldown_until = now + INSTAGRAM_ACCOUNT_COOLDOWN_SECONDS
+            logger.error(f"Instaloader: Conta '{self.username}' fora do rodízio por {INSTAGRAM_ACCOUNT_COOLDOWN_SECONDS}s.")
+            return False
+        return True
+
+    def check_health(self):
+        """ensure_healthy sem segurar o `lock` durante a rede (test_login/login).
+
+        Só uma thread renova a sessão por vez; enquanto isso as demais recebem False e seguem para a próxima conta.
+        """
+        with self.lock:
+            now = time.time()
+            if now < self.cooldown_until or self.refreshing:
+                return False
+            if self.loader and now - self.last_check < INSTAGRAM_HEALTHCHECK_SECONDS:
+                return True
+            self.refreshing = True
+        try:
+            return self.ensure_healthy()
+        finally:
+            with self.lock:
+                self.refreshing = False
+                self._refreshed.notify_all()
+
+    def wait_refresh(self, timeout):
+        """Espera (até `timeout`) o fim de uma renovação de sessão em andamento."""
+        with self.lock:
+            self._refreshed.wait_for(lambda: not self.refreshing, timeout)
+
+    def has_budget(self, now):
+        while self.usage and now - self.usage[0] > BUDGET_WINDOW_SECONDS:
+            self.usage.popleft()
+        return len(self.usage) < INSTAGRAM_ACCOUNT_BUDGET_PER_HOUR
+
+class InstagramSessionPool:
+    """Pool de contextos do Instaloader pré-autenticados (vários por conta), emprestados em rodízio entre as contas."""
+
+    def __init__(self, accounts):
+        self.accounts = [InstagramAccount(a['username'], a.get('password'), a.get('session_b64')) for a in accounts]
+        self._next = 0
+        self._lock = threading.Lock()
+        self._anonymous_contexts = ContextPool(INSTAGRAM_CONTEXTS_PER_ACCOUNT, lambda: _new_loader().context)
+        os.makedirs(INSTAGRAM_SESSION_DIR, mode=0o700, exist_ok=True)
+
+    def _record_use(self, account):
+        with account.lock:
+            account.usage.append(time.time())
+            logger.info(f"Instaloader: Usando a conta '{account.username}' ({len(account.usage)} requisições na última hora).")
+
+    def _acquire_account_context(self):
+        """(pool, contexto) da próxima conta saudável e com orçamento; espera um contexto se todas estiverem ocupadas.
+
+        Contas renovando a sessão são puladas; se não houver outra, a requisição espera a renovação.
+        """
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.accounts)
+        busy_account = refreshing_account = None
+        for offset in range(len(self.accounts)):
+            account = self.accounts[(start + offset) % len(self.accounts)]
+            with account.lock:
+                if not account.has_budget(time.time()):
+                    continue
+                if account.refreshing:
+                    refreshing_account = refreshing_account or account
+                    continue
+            if not account.check_health():
+                continue
+            context = account.contexts.acquire(timeout=0)
+            if context is None:
+                busy_account = busy_account or account
+                continue
+            self._record_use(account)
+            return account.contexts, context
+
+        fallback = busy_account or refreshing_account
+        if fallback:
+            fallback.wait_refresh(INSTAGRAM_CONTEXT_WAIT_SECONDS)
+            if fallback.check_health():
+                context = fallback.contexts.acquire(timeout=INSTAGRAM_CONTEXT_WAIT_SECONDS)
+                if context is not None:
+                    self._record_use(fallback)
+                    return fallback.contexts, context
+        raise Exception("Instagram: Nenhuma conta disponível no momento (limite de requisições ou falha de autenticação).")
+
+    @contextmanager
+    def lease_context(self):
+        """Empresta com exclusividade o InstaloaderContext de uma conta (em rodízio) e o devolve ao final."""
+        if not self.accounts:
+            logger.warning("Instaloader: Nenhuma sessão ou credenciais fornecidas. A funcionalidade será limitada.")
+            contexts = self._anonymous_contexts
+            context = contexts.acquire(timeout=INSTAGRAM_CONTEXT_WAIT_SECONDS)
+            if context is None:
+                raise Exception("Instagram: Nenhum contexto disponível no momento; tente novamente.")
+        else:
+            contexts, context = self._acquire_account_context()
+        try:
+            yield context
+        finally:
+            contexts.release(context)
+
+    def penalize(self, context):
+        """Tira do rodízio, pelo cooldown, a conta dona do contexto que foi bloqueada (login exigido / 429)."""
+        for account in self.accounts:
+            if context in account.contexts.members:
+                with account.lock:
+                    account.cooldown_until = time.time() + INSTAGRAM_ACCOUNT_COOLDOWN_SECONDS
+                logger.warning(f"Instaloader: Conta '{account.username}' bloqueada pela origem; fora do rodízio por "
+                               f"{INSTAGRAM_ACCOUNT_COOLDOWN_SECONDS}s.")
+                return
+
+    def warm_up(self):
+        """Autentica todas as contas antecipadamente, para que a primeira requisição não pague o login."""
+        for account in self.accounts:
+            account.check_health()
+
+    def stats(self):
+        now = time.time()
+        return [{
+            'username': account.username,
+            'authenticated': account.loader is not None,
+            'contexts': account.contexts.created,
+            'idle_contexts': len(account.contexts.idle),
+            'cooling_down': now < account.cooldown_until,
+            'requests_last_hour': sum(1 for t in account.usage if now - t <= BUDGET_WINDOW_SECONDS),
+        } for account in self.accounts]
+
+_pool = None
+_pool_lock = threading.Lock()
+_warm_up_deferred = False
+
+def get_session_pool():
+    """Retorna o pool do processo, criando-o na primeira chamada."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = InstagramSessionPool(load_accounts_from_env())
+        return _pool
+
+def preload():
+    """Importa o instaloader no master do gunicorn (preload_app), antes do fork dos workers."""
+    import instaloader # noqa: F401
+
+def defer_warm_up():
+    """Adia o warm-up disparado pelo app (lifespan do asgi.py) para o post_fork do gunicorn.
+
+    Com preload_app o app é importado no master; as sessões (e suas threads) precisam nascer em cada worker.
+    """
+    global _warm_up_deferred
+    _warm_up_deferred = True
+
+def start_background_warm_up(force=False):
+    """Dispara o warm-up do pool em uma thread, sem atrasar o boot do worker (desligável com INSTAGRAM_WARMUP=0)."""
+    if INSTAGRAM_WARMUP and (force or not _warm_up_deferred):
+        threading.Thread(target=lambda: get_session_pool().warm_up(), name="instagram-warmup", daemon=True).start()
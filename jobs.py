@@ -0,0 +1,201 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from download_service import fetch_media
+
+logger = logging.getLogger(__name__)
+
+# --- Configuração da Fila de Jobs (via variáveis de ambiente) ---
+JOBS_DIR = os.environ.get('JOBS_DIR', os.path.join(tempfile.gettempdir(), 'media_jobs'))
+# Jobs aceitos (na fila + em execução) por worker do gunicorn antes de responder 429
+JOBS_MAX_PENDING = int(os.environ.get('JOBS_MAX_PENDING', '20'))
+# Downloads simultâneos por plataforma, ex: "YouTube=2,TikTok=3,Instagram=1"
+JOBS_PLATFORM_LIMITS = os.environ.get('JOBS_PLATFORM_LIMITS', 'YouTube=2,TikTok=3,Instagram=1')
+JOBS_RESULT_TTL_SECONDS = int(os.environ.get('JOBS_RESULT_TTL_SECONDS', '1800'))
+JOBS_RETRY_AFTER_SECONDS = int(os.environ.get('JOBS_RETRY_AFTER_SECONDS', '30'))
+
+JOB_FILENAME = "job.json"
+JOB_WORK_DIRNAME = "work"
+_JOB_ID_RE = re.compile(r'^[a-f0-9]{32}$')
+
+class QueueFullError(Exception):
+    """Fila de jobs cheia; o cliente deve tentar novamente mais tarde."""
+
+def parse_platform_limits(spec):
+    """Converte 'YouTube=2,TikTok=3' em {'YouTube': 2, 'TikTok': 3}."""
+    limits = {}
+    for item in spec.split(','):
+        if '=' not in item:
+            continue
+        name, value = item.split('=', 1)
+        limits[name.strip()] = max(1, int(value))
+    return limits
+
+class JobManager:
+    """Executa downloads em segundo plano, com um pool de threads limitado por plataforma.
+
+    O estado de cada job é gravado em disco, então qualquer worker do gunicorn
+    consegue responder consultas de status e entregar o arquivo final.
+    """
+
+    def __init__(self, jobs_dir, max_pending, platform_limits, result_ttl):
+        self.jobs_dir = jobs_dir
+        self.max_pending = max_pending
+        self.platform_limits = platform_limits
+        self.result_ttl = result_ttl
+        self._admission = threading.BoundedSemaphore(max_pending)
+        self._executors = {}
+        self._executors_lock = threading.Lock()
+        os.makedirs(jobs_dir, exist_ok=True)
+
+    # --- Estado em disco ---
+    def _job_dir(self, job_id):
+        return os.path.join(self.jobs_dir, job_id)
+
+    def _write_job(self, job):
+        job_path = os.path.join(self._job_dir(job['id']), JOB_FILENAME)
+        tmp_path = f"{job_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, job_path)
+
+    def _update_job(self, job, **fields):
+        job.update(fields, updated=time.time())
+        self._write_job(job)
+
+    def get_job(self, job_id):
+        """Retorna o estado do job, ou None se não existir."""
+        if not _JOB_ID_RE.match(job_id or ''):
+            return None
+        try:
+            with open(os.path.join(self._job_dir(job_id), JOB_FILENAME), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    # --- Execução ---
+    def _executor_for(self, platform):
+        with self._executors_lock:
+            if platform not in self._executors:
+                self._executors[platform] = ThreadPoolExecutor(
+                    max_workers=self.platform_limits.get(platform, 1),
+                    thread_name_prefix=f"job-{platform.lower()}",
+                )
+            return self._executors[platform]
+
+    def _new_job(self, platform, url, username_ig, download_format, ig_action, ig_options=None, format_options=None):
+        """Cria o diretório do job e retorna o estado inicial (ainda não gravado)."""
+        job_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self._job_dir(job_id), JOB_WORK_DIRNAME))
+        now = time.time()
+        return {
+            'id': job_id, 'status': 'queued', 'progress': None,
+            'platform': platform, 'url': url, 'username': username_ig,
+            'format': download_format, 'ig_action': ig_action, 'ig_options': ig_options or {},
+            'format_options': format_options or {},
+            'created': now, 'updated': now,
+            'error': None, 'filename': None, 'file_path': None,
+        }
+
+    def submit(self, platform, url, username_ig, download_format, ig_action, ig_options=None, format_options=None):
+        """Enfileira um download e retorna o estado inicial do job."""
+        if not self._admission.acquire(blocking=False):
+            raise QueueFullError(f"Fila de jobs cheia ({self.max_pending} pendentes).")
+        metrics.JOB_QUEUE_DEPTH.inc() # Profundidade da fila exposta em /metrics (downloader_job_queue_depth)
+
+        try:
+            self.cleanup_expired()
+            job = self._new_job(platform, url, username_ig, download_format, ig_action, ig_options, format_options)
+            job_id = job['id']
+            self._write_job(job)
+            snapshot = dict(job)  # o dict original passa a ser atualizado pela thread do job
+            self._executor_for(platform).submit(self._run_job, job)
+        except Exception:
+            self._release_slot()
+            raise
+        logger.info(f"Job {job_id} - Enfileirado: Plataforma='{platform}', URL='{url}', Format='{download_format}'")
+        return snapshot
+
+    def store_result(self, download_request, file_path):
+        """Guarda um resultado já baixado como job concluído (entregue por /api/jobs/<id>/file até o TTL).
+
+        Usado pelos lotes para arquivos que não ficaram no cache, cujo diretório de trabalho é apagado ao final.
+        """
+        self.cleanup_expired()
+        job = self._new_job(download_request['platform'], download_request['url'], download_request['username'],
+                            download_request['format'], download_request['ig_action'], download_request['ig_options'],
+                            download_request['format_options'])
+        work_dir = os.path.join(self._job_dir(job['id']), JOB_WORK_DIRNAME)
+        try:
+            final_file = shutil.move(file_path, os.path.join(work_dir, os.path.basename(file_path)))
+        except OSError:
+            shutil.rmtree(self._job_dir(job['id']), ignore_errors=True)
+            raise
+        job.update(status='finished', progress=100, filename=os.path.basename(final_file), file_path=final_file)
+        self._write_job(job)
+        return job
+
+    def _release_slot(self):
+        metrics.JOB_QUEUE_DEPTH.dec()
+        self._admission.release()
+
+    def _progress_callback(self, job):
+        def report(percent):
+            percent = int(percent)
+            if percent != job.get('progress'):
+                self._update_job(job, progress=percent)
+        return report
+
+    def _run_job(self, job):
+        job_id = job['id']
+        work_dir = os.path.join(self._job_dir(job_id), JOB_WORK_DIRNAME)
+        try:
+            self._update_job(job, status='running', progress=0)
+            final_file = fetch_media(job['platform'], job['url'], job['username'], job['format'], job['ig_action'],
+                                     work_dir, job_id, progress_callback=self._progress_callback(job),
+                                     ig_options=job['ig_options'], format_options=job.get('format_options'))
+            self._update_job(job, status='finished', progress=100,
+                             filename=os.path.basename(final_file), file_path=final_file)
+            metrics.count_request(job['platform'], 'job_finished')
+            logger.info(f"Job {job_id} - Concluído: {final_file}")
+            if not os.path.abspath(final_file).startswith(os.path.abspath(work_dir) + os.sep):
+                # O resultado foi para o cache; o diretório de trabalho não é mais necessário
+                shutil.rmtree(work_dir, ignore_errors=True)
+        except Exception as e:
+            logger.exception(f"Job {job_id} - Erro no processamento")
+            self._update_job(job, status='failed', error=str(e))
+            metrics.count_request(job['platform'], 'job_failed')
+            shutil.rmtree(work_dir, ignore_errors=True)
+        finally:
+            self._release_slot()
+
+    def cleanup_expired(self):
+        """Remove jobs finalizados há mais tempo que o TTL (ou abandonados por um worker que morreu)."""
+        now = time.time()
+        for job_id in os.listdir(self.jobs_dir):
+            job = self.get_job(job_id)
+            if not job:
+                continue
+            idle = now - job['updated']
+            if (job['status'] in ('finished', 'failed') and idle > self.result_ttl) or idle > 2 * self.result_ttl:
+                logger.info(f"Job {job_id} - Expirado; removendo.")
+                shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+
+def public_job_view(job):
+    """Estado do job para a API, sem caminhos internos e com as URLs de status e do arquivo."""
+    view = {k: v for k, v in job.items() if k != 'file_path'}
+    view['status_url'] = f"/api/jobs/{job['id']}"
+    if job['status'] == 'finished':
+        view['file_url'] = f"/api/jobs/{job['id']}/file"
+    return view
+
+job_manager = JobManager(JOBS_DIR, JOBS_MAX_PENDING, parse_platform_limits(JOBS_PLATFORM_LIMITS), JOBS_RESULT_TTL_SECONDS)
@@ -0,0 +1,102 @@
+import os
+import time
+import logging
+from contextlib import contextmanager
+
+# Com vários workers do gunicorn, cada processo grava seus valores neste diretório
+# (modo multiprocesso do prometheus_client). Precisa existir antes do import.
+PROMETHEUS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+if PROMETHEUS_MULTIPROC_DIR:
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram,
+                               CONTENT_TYPE_LATEST, generate_latest, multiprocess)
+from prometheus_client.core import GaugeMetricFamily
+
+from storage import storage_manager, dir_size
+
+logger = logging.getLogger(__name__)
+
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 180, 300, 600)
+
+# --- Métricas ---
+STAGE_DURATION = Histogram(
+    'downloader_stage_duration_seconds', 'Duração de cada etapa do processamento.',
+    ['stage', 'platform'], buckets=STAGE_BUCKETS,
+)
+BYTES_SENT = Counter(
+    'downloader_bytes_sent_total', 'Bytes de mídia enviados aos clientes.', ['platform'],
+)
+DOWNLOADED_BYTES = Counter(
+    'downloader_bytes_downloaded_total', 'Bytes de mídia baixados das plataformas.', ['platform'],
+)
+ERRORS = Counter(
+    'downloader_errors_total', 'Erros por plataforma e classe (bot_detection, private_or_unavailable, ffmpeg, ...).',
+    ['platform', 'error_class'],
+)
+REQUESTS = Counter(
+    'downloader_requests_total', 'Requisições de download por plataforma e resultado.', ['platform', 'outcome'],
+)
+JOB_QUEUE_DEPTH = Gauge(
+    'downloader_job_queue_depth', 'Jobs aceitos ainda não concluídos (na fila ou em execução).',
+    multiprocess_mode='livesum',
+)
+
+@contextmanager
+def timed(stage, platform='unknown'):
+    """Mede a duração de um bloco como uma etapa (routing, extraction, download, transcode, zip, send)."""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.labels(stage=stage, platform=platform).observe(time.monotonic() - started)
+
+def observe_stage(stage, platform, seconds):
+    STAGE_DURATION.labels(stage=stage, platform=platform).observe(seconds)
+
+def count_error(platform, error_class):
+    ERRORS.labels(platform=platform, error_class=error_class).inc()
+
+def count_request(platform, outcome):
+    REQUESTS.labels(platform=platform or 'unknown', outcome=outcome).inc()
+
+def add_bytes_sent(platform, num_bytes):
+    BYTES_SENT.labels(platform=platform or 'unknown').inc(num_bytes)
+
+def add_bytes_downloaded(platform, num_bytes):
+    DOWNLOADED_BYTES.labels(platform=platform).inc(num_bytes)
+
+# --- Uso de disco dos diretórios temporários (calculado no momento da coleta) ---
+class TempDiskUsageCollector:
+    """Soma o espaço ocupado pelos diretórios de trabalho ativos (sob STORAGE_ROOT) e pelos jobs."""
+
+    def __init__(self, extra_dirs=None):
+        self.extra_dirs = extra_dirs or []
+
+    def collect(self):
+        workdirs = storage_manager.usage()
+        total = workdirs['used_bytes'] + sum(dir_size(path) for path in self.extra_dirs)
+
+        usage = GaugeMetricFamily('downloader_temp_disk_bytes', 'Bytes ocupados pelos diretórios temporários ativos.')
+        usage.add_metric([], total)
+        yield usage
+        dirs = GaugeMetricFamily('downloader_temp_dirs', 'Diretórios temporários de requisição ativos.')
+        dirs.add_metric([], workdirs['workdirs'])
+        yield dirs
+
+def render_metrics(extra_dirs=None):
+    """Gera o texto no formato Prometheus, agregando todos os workers quando em modo multiprocesso."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = CollectorRegistry()
+        for collector in (STAGE_DURATION, BYTES_SENT, DOWNLOADED_BYTES, ERRORS, REQUESTS, JOB_QUEUE_DEPTH):
+            registry.register(collector)
+    registry.register(TempDiskUsageCollector(extra_dirs))
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+def mark_process_dead(pid):
+    """Para o hook child_exit do gunicorn: descarta os gauges 'live' do worker encerrado."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
@@ -1,19 +1,246 @@
 import os
+import json
+import time
+import shutil
 import logging
+import functools
+import threading
 import re
-import yt_dlp
-from yt_dlp.utils import DownloadError
+
+import metrics
+from utils import MediaStream, STREAM_CHUNK_SIZE
+from ytdlp_pool import extract_info_cached, invalidate_info
 
 logger = logging.getLogger(__name__)
 
+# Apenas formatos com vídeo e áudio no mesmo arquivo, servidos por HTTP simples (sem merge/HLS/DASH)
+PROGRESSIVE_VIDEO_FORMAT = ('best[ext=mp4][vcodec!=?none][acodec!=?none][protocol^=http]'
+                            '/best[vcodec!=?none][acodec!=?none][protocol^=http]')
+
+# --- Perfis do Motor de Download (via variáveis de ambiente) ---
+# Perfil usado pelas plataformas sem perfil próprio
+YTDLP_ENGINE_PROFILE = os.environ.get('YTDLP_ENGINE_PROFILE', 'default')
+# Perfil por plataforma, ex: "YouTube=fast,TikTok=default"
+YTDLP_ENGINE_PROFILES_BY_PLATFORM = os.environ.get('YTDLP_ENGINE_PROFILES_BY_PLATFORM', 'YouTube=fast')
+# Perfis extras ou ajustes dos existentes, em JSON: {"fast": {"concurrent_fragment_downloads": 8}}
+YTDLP_ENGINE_PROFILES_JSON = os.environ.get('YTDLP_ENGINE_PROFILES_JSON')
+# Re-extrações permitidas quando o yt-dlp pede nova extração (abaixo de 'throttledratelimit', fragmentos DASH expirados)
+YTDLP_THROTTLE_REEXTRACT_ATTEMPTS = int(os.environ.get('YTDLP_THROTTLE_REEXTRACT_ATTEMPTS', '2'))
+
+ENGINE_PROFILES = {
+    # Comportamento original: uma conexão, downloader nativo
+    'default': {'retries': 2, 'fragment_retries': 2},
+    # DASH/HLS com vários fragmentos em paralelo; downloads HTTP em blocos (a origem limita menos requisições curtas)
+    'fast': {
+        'retries': 3, 'fragment_retries': 5, 'concurrent_fragment_downloads': 4,
+        'http_chunk_size': 10 * 1024 * 1024, 'buffersize': 1024 * 1024, 'throttledratelimit': 100 * 1024,
+    },
+    # Downloader externo com várias conexões por arquivo (requer o binário aria2c)
+    'aria2c': {
+        'retries': 3, 'fragment_retries': 5,
+        'external_downloader': {'default': 'aria2c'},
+        'external_downloader_args': {'aria2c': ['--max-connection-per-server=8', '--split=8', '--min-split-size=1M']},
+    },
+}
+ENGINE_OPTION_KEYS = ('retries', 'fragment_retries', 'concurrent_fragment_downloads', 'http_chunk_size', 'buffersize',
+                      'noresizebuffer', 'throttledratelimit', 'external_downloader', 'external_downloader_args')
+
+def _load_engine_profiles():
+    profiles = {name: dict(options) for name, options in ENGINE_PROFILES.items()}
+    if YTDLP_ENGINE_PROFILES_JSON:
+        try:
+            for name, options in json.loads(YTDLP_ENGINE_PROFILES_JSON).items():
+                unknown = set(options) - set(ENGINE_OPTION_KEYS)
+                if unknown:
+                    logger.warning(f"yt-dlp: Opções ignoradas no perfil '{name}': {sorted(unknown)}")
+                profiles.setdefault(name, dict(ENGINE_PROFILES['default'])).update(
+                    {k: v for k, v in options.items() if k in ENGINE_OPTION_KEYS})
+        except (ValueError, AttributeError) as e:
+            logger.error(f"yt-dlp: YTDLP_ENGINE_PROFILES_JSON inválido: {e}")
+    for options in profiles.values():
+        if isinstance(options.get('external_downloader'), str):
+            options['external_downloader'] = {'default': options['external_downloader']}
+    return profiles
+
+_engine_profiles = _load_engine_profiles()
+_platform_profiles = {name.strip(): value.strip() for name, value in
+                      (item.split('=', 1) for item in YTDLP_ENGINE_PROFILES_BY_PLATFORM.split(',') if '=' in item)}
+
+def engine_profile_name(platform_name):
+    return _platform_profiles.get(platform_name, YTDLP_ENGINE_PROFILE)
+
+@functools.lru_cache(maxsize=None)
+def _binary_available(name):
+    if shutil.which(name):
+        return True
+    logger.warning(f"yt-dlp: Downloader externo '{name}' não encontrado; usando o downloader nativo.")
+    return False
+
+def engine_options(profile_name):
+    """Opções do yt-dlp do perfil. Sem o binário do downloader externo, volta ao downloader nativo."""
+    options = dict(_engine_profiles.get(profile_name) or _engine_profiles['default'])
+    external = options.get('external_downloader') or {}
+    if not all(_binary_available(name) for name in external.values()):
+        options.pop('external_downloader')
+        options.pop('external_downloader_args', None)
+    return options
+
+# O yt-dlp (centenas de extractors) só é importado na primeira requisição, ou no master do gunicorn
+# antes do fork (ytdlp_pool.preload), para que o worker suba e responda ao health check imediatamente.
+
 # --- Funções de Download yt-dlp (TikTok, YouTube) ---
-def download_with_yt_dlp(platform_name, url, temp_dir, download_format='video', cookie_file_path=None):
-    logger.info(f"{platform_name}: URL='{url}', Formato='{download_format}', Cookies={'Sim' if cookie_file_path else 'Não'}")
+def _make_progress_hook(progress_callback):
+    """Adapta os eventos de progresso do yt-dlp para um callback que recebe a porcentagem."""
+    def hook(d):
+        if d.get('status') != 'downloading':
+            return
+        total = d.get('total_bytes') or d.get('total_bytes_estimate')
+        if total:
+            progress_callback(min(99, d.get('downloaded_bytes', 0) * 100 / total))
+    return hook
+
+def _make_postprocessor_timer(platform_name, timings):
+    """Mede o tempo de cada pós-processador (merge, extração de áudio) como etapa 'transcode'."""
+    started = {}
+    def hook(d):
+        name = d.get('postprocessor')
+        if d.get('status') == 'started':
+            started[name] = time.monotonic()
+        elif d.get('status') == 'finished' and name in started:
+            elapsed = time.monotonic() - started.pop(name)
+            timings.append(elapsed)
+            metrics.observe_stage('transcode', platform_name, elapsed)
+    return hook
+
+def classify_download_error(message):
+    """Classifica a mensagem de erro do yt-dlp/Instaloader (usada nas métricas, nas mensagens ao cliente e no upstream_guard)."""
+    lowered = message.lower()
+    if "Sign in to confirm you're not a bot" in message or "login is required" in message:
+        return 'bot_detection'
+    if "LoginRequired" in message or "login required" in lowered or "checkpoint_required" in message or "challenge_required" in message:
+        return 'bot_detection'
+    if ("HTTP Error 429" in message or "Too Many Requests" in message or "TooManyRequests" in message
+            or "Please wait a few minutes" in message):
+        return 'rate_limited'
+    if "ffmpeg" in lowered and ("not found" in lowered or "ailed" in lowered):
+        return 'ffmpeg'
+    if "Private video" in message or "Video unavailable" in message:
+        return 'private_or_unavailable'
+    if "Unsupported URL" in message:
+        return 'unsupported_url'
+    return 'other'
+
+# --- Planejamento de Formato ---
+# Seleção genérica do yt-dlp, usada se o formato planejado deixar de existir numa re-extração
+FALLBACK_VIDEO_FORMAT = 'bestvideo[ext=mp4][vcodec^=avc1]+bestaudio[ext=m4a]/bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/bestvideo+bestaudio/best'
+# Saídas de áudio: extensão entregue sem recodificar e codec do FFmpegExtractAudio quando for preciso converter
+AUDIO_OUTPUTS = {
+    'mp3': {'passthrough': lambda f: f.get('ext') == 'mp3', 'codec': 'mp3', 'exts': ('.mp3',)},
+    'm4a': {'passthrough': lambda f: f.get('ext') == 'm4a', 'codec': 'm4a', 'exts': ('.m4a',)},
+    'opus': {'passthrough': lambda f: (f.get('acodec') or '').startswith('opus'), 'codec': 'opus', 'exts': ('.opus', '.webm', '.ogg')},
+}
+VIDEO_EXTS = ('.mp4', '.mkv', '.webm')
+
+def _has_video(f):
+    return f.get('vcodec') != 'none'
+
+def _has_audio(f):
+    return f.get('acodec') != 'none'
+
+def _format_size(f):
+    return f.get('filesize') or f.get('filesize_approx')
+
+def _fits(f, max_height, max_filesize, budget=None):
+    """Formatos com altura/tamanho desconhecidos passam (como o '<?' do yt-dlp)."""
+    if max_height and (f.get('height') or 0) > max_height:
+        return False
+    limit = budget if budget is not None else max_filesize
+    return not (limit and _format_size(f) and _format_size(f) > limit)
+
+def _quality_key(f):
+    """Qualidade para ordenar os formatos (pior -> melhor); ordem estável entre empates."""
+    return (f.get('preference') or 0, f.get('height') or 0, f.get('fps') or 0,
+            f.get('tbr') or f.get('abr') or f.get('vbr') or 0, f.get('asr') or 0)
+
+def _describe(f):
+    return f"{f.get('format_id')} ({f['height']}p)" if f.get('height') else str(f.get('format_id'))
+
+def _prefer_mp4(candidates):
+    """Entre formatos da mesma altura, H.264/AAC em MP4 (o mais compatível); senão o de maior qualidade."""
+    top_height = max(f.get('height') or 0 for f in candidates)
+    best = [f for f in candidates if (f.get('height') or 0) == top_height]
+    compatible = [f for f in best if f.get('ext') in ('mp4', 'm4a') and (f.get('vcodec') or 'avc1').startswith(('avc1', 'mp4a', 'none'))]
+    return (compatible or best)[-1]
+
+def _format_selector(formats, fallback):
+    """'id1+id2/<fallback>' com os formatos escolhidos; sem format_id (ex: extractor genérico), só a seleção genérica."""
+    format_ids = [f.get('format_id') for f in formats]
+    if not all(format_ids):
+        return fallback, False
+    return f"{'+'.join(format_ids)}/{fallback}", True
+
+def plan_download_format(info, download_format, max_height=None, max_filesize=None):
+    """Escolhe os formatos antes do download, evitando merge e recodificação sempre que possível.
+
+    Vídeo: um formato progressivo (vídeo+áudio no mesmo arquivo) vence se tiver a mesma altura do melhor
+    vídeo separado; senão, vídeo+áudio com merge. Áudio: o formato nativo é entregue como está quando já
+    está no codec pedido (m4a/opus/mp3); só então o FFmpegExtractAudio entra. Retorna um dict com
+    'format', 'postprocessors', 'merge', 'exts', 'description' e 'exact' (False quando o formato escolhido
+    não tem format_id e o download fica com a seleção genérica do yt-dlp).
+    """
+    # extract_info(process=False) devolve os formatos na ordem do extractor (o yt-dlp só ordena ao processar)
+    formats = sorted((f for f in (info.get('formats') or [info]) if f.get('url')), key=_quality_key)
+    plan = {'postprocessors': [], 'merge': False}
+
+    if download_format in AUDIO_OUTPUTS:
+        output = AUDIO_OUTPUTS[download_format]
+        audio = [f for f in formats if _has_audio(f) and _fits(f, None, max_filesize)]
+        audio_only = [f for f in audio if not _has_video(f)] or audio
+        if not audio_only:
+            raise ValueError("Nenhum formato de áudio atende ao limite de 'max_filesize'.")
+        native = [f for f in audio_only if output['passthrough'](f)]
+        chosen = native[-1] if native else audio_only[-1]
+        if not native:
+            plan['postprocessors'] = [{'key': 'FFmpegExtractAudio', 'preferredcodec': output['codec'], 'preferredquality': '192'}]
+        selector, exact = _format_selector([chosen], 'bestaudio/best')
+        plan.update(format=selector, exact=exact, exts=output['exts'],
+                    description=f"áudio {chosen.get('format_id')} ({chosen.get('acodec')}), "
+                                f"{'sem recodificação' if native else 'convertido para ' + output['codec']}")
+        return plan
+
+    plan['exts'] = VIDEO_EXTS
+    progressive = [f for f in formats if _has_video(f) and _has_audio(f) and _fits(f, max_height, max_filesize)]
+    video_only = [f for f in formats if _has_video(f) and not _has_audio(f) and _fits(f, max_height, None)]
+    audio_only = [f for f in formats if _has_audio(f) and not _has_video(f) and _fits(f, None, max_filesize)]
+    best_progressive = _prefer_mp4(progressive) if progressive else None
+
+    best_pair = None
+    if video_only and audio_only:
+        audio = ([f for f in audio_only if f.get('ext') == 'm4a'] or audio_only)[-1]
+        budget = max_filesize - (_format_size(audio) or 0) if max_filesize else None
+        videos = [f for f in video_only if _fits(f, max_height, max_filesize, budget)]
+        if videos and (budget is None or budget > 0):
+            best_pair = (_prefer_mp4(videos), audio)
+
+    if best_progressive and (not best_pair or (best_progressive.get('height') or 0) >= (best_pair[0].get('height') or 0)):
+        selector, exact = _format_selector([best_progressive], FALLBACK_VIDEO_FORMAT)
+        plan.update(format=selector, exact=exact, description=f"progressivo {_describe(best_progressive)}, sem merge")
+    elif best_pair:
+        video, audio = best_pair
+        selector, exact = _format_selector([video, audio], FALLBACK_VIDEO_FORMAT)
+        plan.update(format=selector, exact=exact, merge=True, description=f"merge {_describe(video)} + {_describe(audio)}")
+    elif max_height or max_filesize:
+        raise ValueError("Nenhum formato de vídeo atende aos limites de 'max_height'/'max_filesize'.")
+    else:
+        plan.update(format=FALLBACK_VIDEO_FORMAT, exact=False, description="seleção padrão do yt-dlp")
+    return plan
+
+def _base_ydl_opts(platform_name, temp_dir):
+    """Opções comuns do yt-dlp para todas as plataformas."""
     ydl_opts = {
         'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s' if platform_name == 'YouTube' else '%(id)s.%(ext)s'),
         'quiet': False, 'verbose': True, 'noplaylist': True,
         'ffmpeg_location': '/usr/bin/ffmpeg',
-        'retries': 2, 'fragment_retries': 2,
         'writedescription': False, 'writeinfojson': False, 'writethumbnail': False, 'writeannotations': False,
         'writesubtitles': False, 'writeautomaticsub': False,
         'progress': False, 'noprogress': True, # Desabilitar barra de progresso nos logs
@@ -32,44 +259,145 @@ def download_with_yt_dlp(platform_name, url, temp_dir, download_format='video',
             'Referer': 'https://www.youtube.com/',
         }
     }
-    if cookie_file_path:
-        ydl_opts['cookiefile'] = cookie_file_path
-
-    if download_format == 'mp3':
-        ydl_opts['format'] = 'bestaudio/best'
-        ydl_opts['postprocessors'] = [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }]
-    else: # Vídeo
-        # H.264 (avc1) + AAC (m4a) em MP4 é o mais compatível
-        ydl_opts['format'] = 'bestvideo[ext=mp4][vcodec^=avc1]+bestaudio[ext=m4a]/bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/bestvideo+bestaudio/best'
-        ydl_opts['merge_output_format'] = 'mp4' # Garante container MP4 após o merge
+    ydl_opts.update(engine_options(engine_profile_name(platform_name)))
+    return ydl_opts
+
+_anonymous_jars = {}
+_anonymous_jars_lock = threading.Lock()
+
+def _cookie_jar(platform_name, cookie_set):
+    """Jar do conjunto de cookies ou, sem credenciais, um jar anônimo da plataforma compartilhado no processo.
+
+    A extração (instâncias persistentes) e o download (instância por requisição) usam o mesmo jar: cookies
+    definidos pela origem durante a extração (ex: tt_chain_token do TikTok) chegam às requisições da mídia.
+    """
+    if cookie_set:
+        return cookie_set.jar
+    from yt_dlp.cookies import YoutubeDLCookieJar
+    with _anonymous_jars_lock:
+        if platform_name not in _anonymous_jars:
+            _anonymous_jars[platform_name] = YoutubeDLCookieJar()
+        return _anonymous_jars[platform_name]
+
+def _pool_key(platform_name, cookie_set):
+    """Identidade (plataforma e conjunto de cookies) das instâncias de extração e do cache de info-dicts."""
+    return f"{platform_name}/{cookie_set.name}" if cookie_set else platform_name
+
+def _new_ydl(ydl_opts, platform_name, cookie_set=None):
+    """YoutubeDL com o cookie jar em memória da plataforma/conjunto de cookies, sem arquivo por requisição."""
+    import yt_dlp
+    ydl = yt_dlp.YoutubeDL(ydl_opts)
+    ydl.cookiejar = _cookie_jar(platform_name, cookie_set)
+    if '_request_director' in ydl.__dict__:
+        # Com verbose o cabeçalho de debug já montou os handlers HTTP com o jar vazio: são recriados sob demanda
+        ydl._request_director.close()
+        del ydl._request_director
+    return ydl
+
+def _extract_info(platform_name, url, cookie_set):
+    """Info-dict bruto do cache de extração; instâncias e cache são separados por conjunto de cookies."""
+    def factory(work_dir):
+        # Instâncias persistentes de extração (sem formato nem pós-processamento)
+        return _new_ydl(_base_ydl_opts(platform_name, work_dir), platform_name, cookie_set)
+    return extract_info_cached(platform_name, url, factory, _pool_key(platform_name, cookie_set))
+
+def _process_with_cached_info(ydl, platform_name, url, cookie_set, download):
+    """Aplica formato/download do `ydl` sobre o info-dict em cache, evitando uma nova extração.
+
+    Se as URLs em cache tiverem expirado (ex: HTTP 403), refaz a extração uma única vez. Se o yt-dlp pedir uma nova
+    extração (ReExtractInfo: download abaixo de 'throttledratelimit' ou fragmentos DASH expirados), refaz a
+    extração (novas URLs) até YTDLP_THROTTLE_REEXTRACT_ATTEMPTS vezes.
+    """
+    from yt_dlp.utils import DownloadError, ReExtractInfo, ThrottledDownload
+    expired_retry_done = False
+    reextract_attempts = 0
+    while True:
+        info = _extract_info(platform_name, url, cookie_set)
+        try:
+            return ydl.process_ie_result(info, download=download)
+        except ReExtractInfo as e:
+            # O yt-dlp só re-extrai sozinho dentro de extract_info; aqui o info-dict vem do cache
+            throttled = isinstance(e, ThrottledDownload)
+            reextract_attempts += 1
+            metrics.count_error(platform_name, 'throttled' if throttled else 'reextract')
+            if reextract_attempts > YTDLP_THROTTLE_REEXTRACT_ATTEMPTS:
+                reason = "Download estrangulado pela origem (abaixo de throttledratelimit)" if throttled else f"A origem exigiu nova extração ({e})"
+                raise DownloadError(f"{reason} após {YTDLP_THROTTLE_REEXTRACT_ATTEMPTS} re-extrações.")
+            if throttled:
+                logger.warning(f"{platform_name}: Velocidade abaixo do limite para '{url}'; extraindo novamente.")
+            else:
+                logger.warning(f"{platform_name}: O yt-dlp pediu nova extração para '{url}' ({e}); extraindo novamente.")
+        except DownloadError as e:
+            if expired_retry_done or ('HTTP Error 403' not in str(e) and 'HTTP Error 410' not in str(e)):
+                raise
+            expired_retry_done = True
+            logger.warning(f"{platform_name}: URLs em cache expiradas para '{url}'; extraindo novamente.")
+        invalidate_info(_pool_key(platform_name, cookie_set), url)
+
+def _download_error_message(platform_name, url, download_format, error):
+    """Registra o erro do yt-dlp nas métricas e monta a mensagem devolvida ao cliente."""
+    logger.error(f"Erro yt-dlp ({platform_name}) para '{url}': {error}")
+    error_class = classify_download_error(str(error))
+    metrics.count_error(platform_name, error_class)
+    specific_error_msg = f"Falha ao baixar/processar {platform_name}"
+    if error_class == 'bot_detection':
+        specific_error_msg += ": Requer login/cookies (detecção de bot ou restrição)."
+    elif error_class == 'rate_limited':
+        specific_error_msg += ": Limite de requisições da plataforma atingido (HTTP 429)."
+    elif error_class == 'ffmpeg':
+        specific_error_msg += f": Problema com ffmpeg, necessário para formato '{download_format}'."
+    elif error_class == 'private_or_unavailable':
+        specific_error_msg += ": Vídeo privado ou indisponível."
+    elif error_class == 'unsupported_url':
+        specific_error_msg = f"URL não suportada pelo {platform_name} extractor: {url}"
+    else:
+        specific_error_msg += f": {str(error)}"
+    return specific_error_msg
+
+def download_with_yt_dlp(platform_name, url, temp_dir, download_format='video', cookie_set=None, progress_callback=None,
+                         max_height=None, max_filesize=None):
+    from yt_dlp.utils import DownloadError
+    logger.info(f"{platform_name}: URL='{url}', Formato='{download_format}', Cookies='{cookie_set.name if cookie_set else 'Não'}', "
+                f"Perfil='{engine_profile_name(platform_name)}', MaxHeight={max_height}, MaxFilesize={max_filesize}")
+    ydl_opts = _base_ydl_opts(platform_name, temp_dir)
+    if progress_callback:
+        ydl_opts['progress_hooks'] = [_make_progress_hook(progress_callback)]
+    transcode_timings = []
+    ydl_opts['postprocessor_hooks'] = [_make_postprocessor_timer(platform_name, transcode_timings)]
 
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
+        # O info-dict vem do cache de extração e é reaproveitado pelo download logo abaixo
+        info = _extract_info(platform_name, url, cookie_set)
+        plan = plan_download_format(info, download_format, max_height, max_filesize)
+        logger.info(f"{platform_name}: Plano de formato para '{url}': {plan['description']}.")
+        ydl_opts['format'] = plan['format']
+        if plan['postprocessors']:
+            ydl_opts['postprocessors'] = plan['postprocessors']
+        if plan['merge']:
+            ydl_opts['merge_output_format'] = 'mp4' # Garante container MP4 após o merge
+        if max_filesize:
+            ydl_opts['max_filesize'] = max_filesize # Tamanho real (Content-Length), quando o info-dict não informa
+
+        with _new_ydl(ydl_opts, platform_name, cookie_set) as ydl:
+            download_started = time.monotonic()
+            info = _process_with_cached_info(ydl, platform_name, url, cookie_set, download=True)
+            # O tempo dos pós-processadores já foi registrado como 'transcode'
+            metrics.observe_stage('download', platform_name, time.monotonic() - download_started - sum(transcode_timings))
             downloaded_file = None
             
             if 'requested_downloads' in info and info['requested_downloads']:
                 for req_dl_info in info['requested_downloads']:
                     fpath = req_dl_info.get('filepath')
-                    if fpath and os.path.exists(fpath):
-                        if download_format == 'mp3' and fpath.endswith('.mp3'):
-                            downloaded_file = fpath
-                            break
-                        elif download_format != 'mp3' and (fpath.endswith('.mp4') or fpath.endswith('.mkv') or fpath.endswith('.webm')):
-                            downloaded_file = fpath
-                            break
+                    if fpath and os.path.exists(fpath) and fpath.endswith(plan['exts']):
+                        downloaded_file = fpath
+                        break
                 if not downloaded_file and info['requested_downloads']: # Pega o primeiro se nenhum match exato
                     fpath = info['requested_downloads'][0].get('filepath')
                     if fpath and os.path.exists(fpath):
                         downloaded_file = fpath
 
             if not downloaded_file or not os.path.exists(downloaded_file):
-                expected_final_ext = f".{download_format}" if download_format == "mp3" else ".mp4"
-                base_name_template = ydl_opts['outtmpl'].replace('.%(ext)s', '')
+                expected_final_ext = plan['exts'][0]
                 
                 title_or_id = info.get('title', info.get('id', 'downloaded_media'))
                 sane_title_or_id = re.sub(r'[<>:"/\\|?*]', '_', title_or_id)[:100]
@@ -80,33 +408,121 @@ def download_with_yt_dlp(platform_name, url, temp_dir, download_format='video',
                 else: 
                     logger.warning(f"{platform_name}: Não foi possível determinar o nome do arquivo do info_dict. Listando '{temp_dir}'.")
                     for f_name in os.listdir(temp_dir):
-                        if download_format == 'mp3' and f_name.endswith(".mp3"):
-                            downloaded_file = os.path.join(temp_dir, f_name)
-                            break
-                        elif download_format != 'mp3' and (f_name.endswith(".mp4") or f_name.endswith(".mkv") or f_name.endswith(".webm")):
+                        if f_name.endswith(plan['exts']):
                             downloaded_file = os.path.join(temp_dir, f_name)
                             break
             
             if not downloaded_file or not os.path.exists(downloaded_file):
+                if max_filesize:
+                    raise ValueError(f"A mídia excede o limite de 'max_filesize' ({max_filesize} bytes).")
                 raise Exception(f"Arquivo final não encontrado em '{temp_dir}'. Conteúdo: {os.listdir(temp_dir)}")
 
+            metrics.add_bytes_downloaded(platform_name, os.path.getsize(downloaded_file))
             logger.info(f"{platform_name}: Baixado/Processado com sucesso: {downloaded_file}")
             return [downloaded_file]
 
     except DownloadError as e:
-        logger.error(f"Erro yt-dlp ({platform_name}) para '{url}': {e}")
-        specific_error_msg = f"Falha ao baixar/processar {platform_name}"
-        if "Sign in to confirm you're not a bot" in str(e) or "login is required" in str(e):
-            specific_error_msg += ": Requer login/cookies (detecção de bot ou restrição)."
-        elif "ffmpeg" in str(e).lower() and ("not found" in str(e).lower() or "ailed" in str(e).lower()):
-            specific_error_msg += f": Problema com ffmpeg, necessário para formato '{download_format}'."
-        elif "Private video" in str(e) or "Video unavailable" in str(e):
-            specific_error_msg += ": Vídeo privado ou indisponível."
-        elif "Unsupported URL" in str(e):
-            specific_error_msg = f"URL não suportada pelo {platform_name} extractor: {url}"
-        else:
-            specific_error_msg += f": {str(e)}"
-        raise Exception(specific_error_msg)
+        raise Exception(_download_error_message(platform_name, url, download_format, e))
+    except ValueError:
+        raise # Nenhum formato atende aos limites pedidos
     except Exception as e:
         logger.exception(f"Erro genérico ({platform_name}) para '{url}'")
-        raise Exception(f"Falha inesperada no {platform_name}: {e}")
\ No newline at end of file
+        metrics.count_error(platform_name, 'unexpected')
+        raise Exception(f"Falha inesperada no {platform_name}: {e}")
+
+# --- Metadados sem Download ---
+def extract_media_info(platform_name, url, cookie_set=None):
+    """Info-dict bruto do vídeo (título, duração, formatos com URLs assinadas), sem baixar a mídia."""
+    from yt_dlp.utils import DownloadError
+    try:
+        return _extract_info(platform_name, url, cookie_set)
+    except DownloadError as e:
+        raise Exception(_download_error_message(platform_name, url, 'info', e))
+
+def resolve_media_format(platform_name, url, temp_dir, format_spec, cookie_set=None):
+    """Aplica a seleção de formato do yt-dlp sem baixar. Retorna o info-dict com 'url' ou 'requested_formats'."""
+    from yt_dlp.utils import DownloadError
+    ydl_opts = _base_ydl_opts(platform_name, temp_dir)
+    ydl_opts['format'] = format_spec
+    try:
+        with _new_ydl(ydl_opts, platform_name, cookie_set) as ydl:
+            info = _process_with_cached_info(ydl, platform_name, url, cookie_set, download=False)
+            info['filename'] = os.path.basename(ydl.prepare_filename(info))
+            return info
+    except DownloadError as e:
+        raise Exception(_download_error_message(platform_name, url, 'url', e))
+
+# --- Streaming Progressivo ---
+def _progressive_format(max_height=None, max_filesize=None):
+    """PROGRESSIVE_VIDEO_FORMAT com os limites de altura/tamanho aplicados a cada alternativa."""
+    filters = (f"[height<=?{max_height}]" if max_height else '') + (f"[filesize<?{max_filesize}]" if max_filesize else '')
+    return '/'.join(alternative + filters for alternative in PROGRESSIVE_VIDEO_FORMAT.split('/'))
+
+def open_progressive_stream(platform_name, url, temp_dir, download_format='video', cookie_set=None,
+                            max_height=None, max_filesize=None):
+    """Abre um stream direto da mídia quando existe um formato progressivo (sem merge) ou áudio no codec pedido.
+
+    Retorna um MediaStream ou None quando a mídia exige merge/conversão (usar o download completo).
+    """
+    if download_format != 'video' and download_format not in AUDIO_OUTPUTS:
+        return None
+    from yt_dlp.networking import Request
+    from yt_dlp.networking.exceptions import RequestError
+    from yt_dlp.utils import DownloadError
+
+    ydl_opts = _base_ydl_opts(platform_name, temp_dir)
+    if download_format == 'video':
+        ydl_opts['format'] = _progressive_format(max_height, max_filesize)
+    else:
+        try:
+            info = _extract_info(platform_name, url, cookie_set)
+            plan = plan_download_format(info, download_format, max_height, max_filesize)
+        except (DownloadError, ValueError) as e:
+            logger.info(f"{platform_name}: Streaming de áudio indisponível para '{url}': {e}")
+            return None
+        if plan['postprocessors']:
+            logger.info(f"{platform_name}: Áudio exige conversão para '{download_format}'; streaming indisponível para '{url}'.")
+            return None
+        if not plan['exact']:
+            logger.info(f"{platform_name}: Formato de áudio sem format_id; streaming indisponível para '{url}'.")
+            return None
+        ydl_opts['format'] = plan['format'].split('/')[0] # Só o formato nativo; sem alternativas que exijam conversão
+    ydl = _new_ydl(ydl_opts, platform_name, cookie_set)
+    try:
+        info = _process_with_cached_info(ydl, platform_name, url, cookie_set, download=False)
+        if info.get('requested_formats') or not info.get('url'):
+            logger.info(f"{platform_name}: Formato selecionado exige merge; streaming indisponível para '{url}'.")
+            ydl.close()
+            return None
+        # O mesmo YoutubeDL faz a requisição, reaproveitando cookies e headers da extração
+        response = ydl.urlopen(Request(info['url'], headers=info.get('http_headers') or {}))
+    except DownloadError as e:
+        logger.info(f"{platform_name}: Nenhum formato progressivo disponível para '{url}': {e}")
+        ydl.close()
+        return None
+    except RequestError as e:
+        # Ex: URL assinada em cache expirada (HTTP 403/410); o download completo extrai de novo
+        logger.warning(f"{platform_name}: Falha ao abrir o stream de '{url}' ({e}); usando o download completo.")
+        ydl.close()
+        invalidate_info(_pool_key(platform_name, cookie_set), url)
+        return None
+    except Exception:
+        ydl.close()
+        raise
+
+    filename = os.path.basename(ydl.prepare_filename(info))
+    logger.info(f"{platform_name}: Streaming progressivo de '{url}' (formato {info.get('format_id')}, arquivo '{filename}').")
+
+    def read_chunks():
+        while True:
+            chunk = response.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            metrics.add_bytes_downloaded(platform_name, len(chunk))
+            yield chunk
+
+    def close():
+        response.close()
+        ydl.close()
+
+    return MediaStream(filename, read_chunks(), close)
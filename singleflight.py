@@ -0,0 +1,164 @@
+import os
+import time
+import fcntl
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# --- Configuração ---
+SINGLE_FLIGHT_DIR = os.environ.get('SINGLE_FLIGHT_DIR', os.path.join(tempfile.gettempdir(), 'media_singleflight'))
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.environ.get('SINGLE_FLIGHT_WAIT_SECONDS', '170'))
+# Por quanto tempo uma falha do líder é repassada a quem estava esperando pela mesma chave
+SINGLE_FLIGHT_FAILURE_TTL_SECONDS = float(os.environ.get('SINGLE_FLIGHT_FAILURE_TTL_SECONDS', '30'))
+# Arquivos de lock sem uso há mais que isso são removidos pela varredura periódica
+SINGLE_FLIGHT_LOCK_MAX_AGE_SECONDS = float(os.environ.get('SINGLE_FLIGHT_LOCK_MAX_AGE_SECONDS', '3600'))
+POLL_INTERVAL_SECONDS = 0.2
+
+_registry_lock = threading.Lock()
+_key_locks = {}  # chave -> [threading.Lock, número de usuários]
+
+class Flight:
+    """Estado de uma requisição dentro da seção crítica de uma chave."""
+
+    def __init__(self, key, waited):
+        self.key = key
+        self.waited = waited  # True se outra requisição estava baixando a mesma chave
+        self.failure_path = os.path.join(SINGLE_FLIGHT_DIR, f"{key}.err")
+
+    def record_failure(self, message):
+        try:
+            with open(self.failure_path, 'w') as f:
+                f.write(message)
+        except OSError as e:
+            logger.warning(f"SingleFlight: Não foi possível registrar falha para '{self.key}': {e}")
+
+    def clear_failure(self):
+        try:
+            os.remove(self.failure_path)
+        except FileNotFoundError:
+            pass
+
+    def recent_failure(self):
+        """Retorna a mensagem da falha do líder, se ela for recente."""
+        try:
+            if time.time() - os.path.getmtime(self.failure_path) > SINGLE_FLIGHT_FAILURE_TTL_SECONDS:
+                return None
+            with open(self.failure_path, 'r') as f:
+                return f.read()
+        except OSError:
+            return None
+
+def _acquire_key_lock(key):
+    with _registry_lock:
+        entry = _key_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    return entry
+
+def _release_key_lock(key, entry):
+    with _registry_lock:
+        entry[1] -= 1
+        if entry[1] == 0:
+            _key_locks.pop(key, None)
+
+def _flock_with_timeout(lock_file, deadline):
+    """Tenta obter o lock de arquivo até o prazo. Retorna (obtido, precisou_esperar)."""
+    waited = False
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True, waited
+        except BlockingIOError:
+            waited = True
+            if time.monotonic() >= deadline:
+                return False, waited
+            time.sleep(POLL_INTERVAL_SECONDS)
+
+def _is_current(lock_file, path):
+    """True se o arquivo aberto ainda é o que está no caminho (a varredura pode tê-lo removido)."""
+    try:
+        opened, current = os.fstat(lock_file.fileno()), os.stat(path)
+    except FileNotFoundError:
+        return False
+    return (opened.st_dev, opened.st_ino) == (current.st_dev, current.st_ino)
+
+def _open_locked(path, deadline):
+    """Abre e trava o arquivo de lock da chave. Retorna (arquivo, obtido, precisou_esperar)."""
+    waited = False
+    while True:
+        lock_file = open(path, 'a')
+        acquired, waited_file = _flock_with_timeout(lock_file, deadline)
+        waited = waited or waited_file
+        if not acquired or _is_current(lock_file, path):
+            return lock_file, acquired, waited
+        # Travamos um arquivo já removido pela varredura: quem chegar agora usa um arquivo novo
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+@contextmanager
+def single_flight(key):
+    """Garante que apenas uma requisição por chave execute o bloco por vez.
+
+    Coordena threads do mesmo worker (lock em memória) e workers do mesmo host (flock).
+    Quem chega depois espera o líder terminar e deve reconsultar o cache ao entrar.
+    Se o prazo de espera estourar, o bloco é executado mesmo assim, sem coordenação.
+    """
+    os.makedirs(SINGLE_FLIGHT_DIR, exist_ok=True)
+    deadline = time.monotonic() + SINGLE_FLIGHT_WAIT_SECONDS
+    entry = _acquire_key_lock(key)
+    thread_lock = entry[0]
+    waited = not thread_lock.acquire(blocking=False)
+    if waited and not thread_lock.acquire(timeout=SINGLE_FLIGHT_WAIT_SECONDS):
+        logger.warning(f"SingleFlight: Tempo de espera esgotado para '{key}' (threads); seguindo sem coordenação.")
+        _release_key_lock(key, entry)
+        yield Flight(key, waited)
+        return
+
+    lock_file = None
+    try:
+        lock_file, acquired, waited_file = _open_locked(os.path.join(SINGLE_FLIGHT_DIR, f"{key}.lock"), deadline)
+        if not acquired:
+            logger.warning(f"SingleFlight: Tempo de espera esgotado para '{key}' (workers); seguindo sem coordenação.")
+        if waited or waited_file:
+            logger.info(f"SingleFlight: Requisição para '{key}' aguardou um download em andamento.")
+        yield Flight(key, waited or waited_file)
+    finally:
+        if lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            finally:
+                lock_file.close()
+        thread_lock.release()
+        _release_key_lock(key, entry)
+
+def sweep_stale_files():
+    """Remove falhas expiradas (<chave>.err) e locks antigos que ninguém está usando (<chave>.lock)."""
+    now = time.time()
+    removed = 0
+    try:
+        names = os.listdir(SINGLE_FLIGHT_DIR)
+    except FileNotFoundError:
+        return 0
+    for name in names:
+        path = os.path.join(SINGLE_FLIGHT_DIR, name)
+        try:
+            age = now - os.path.getmtime(path)
+            if name.endswith('.err') and age > SINGLE_FLIGHT_FAILURE_TTL_SECONDS:
+                os.remove(path)
+                removed += 1
+            elif name.endswith('.lock') and age > SINGLE_FLIGHT_LOCK_MAX_AGE_SECONDS:
+                with open(path, 'a') as lock_file:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue # Em uso por um download
+                    if _is_current(lock_file, path):
+                        os.remove(path)
+                        removed += 1
+        except FileNotFoundError:
+            pass # Removido por outro worker durante a varredura
+    if removed:
+        logger.info(f"SingleFlight: {removed} arquivo(s) antigo(s) removido(s) de '{SINGLE_FLIGHT_DIR}'.")
+    return removed
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import math
+import shutil
+import fcntl
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from singleflight import sweep_stale_files
+
+logger = logging.getLogger(__name__)
+
+# --- Configuração do Armazenamento Temporário (via variáveis de ambiente) ---
+# Raiz dos diretórios de trabalho das requisições (ex: /dev/shm para mídias pequenas em memória)
+STORAGE_ROOT = os.environ.get('STORAGE_ROOT', tempfile.gettempdir())
+# Cota global (todos os workers) dos diretórios de trabalho; 0 = sem cota
+STORAGE_MAX_BYTES = int(os.environ.get('STORAGE_MAX_BYTES', str(4 * 1024 ** 3)))  # 4 GiB
+# Espaço reservado por download na admissão, enquanto o tamanho real ainda não é conhecido
+STORAGE_RESERVATION_BYTES = int(os.environ.get('STORAGE_RESERVATION_BYTES', str(128 * 1024 ** 2)))  # 128 MiB
+# Espera máxima por espaço antes de recusar a requisição com 503
+STORAGE_ADMISSION_WAIT_SECONDS = float(os.environ.get('STORAGE_ADMISSION_WAIT_SECONDS', '5'))
+# Diretórios sem marcador de dono (versões antigas) são considerados órfãos após este tempo sem alteração
+STORAGE_ORPHAN_MAX_AGE_SECONDS = int(os.environ.get('STORAGE_ORPHAN_MAX_AGE_SECONDS', '3600'))
+STORAGE_SWEEP_INTERVAL_SECONDS = int(os.environ.get('STORAGE_SWEEP_INTERVAL_SECONDS', '300'))
+
+WORKDIR_PREFIX = "downloader_"
+OWNER_FILENAME = ".owner"
+LOCK_FILENAME = ".downloader_storage.lock"
+ADMISSION_POLL_SECONDS = 0.25
+
+class StorageFullError(Exception):
+    """Sem espaço na cota de armazenamento temporário; o cliente deve tentar novamente após `retry_after` segundos."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+def _process_start(pid):
+    """Instante de início do processo (campo 22 do /proc/<pid>/stat), para distinguir PIDs reutilizados."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(')', 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+def dir_size(path):
+    """Soma dos tamanhos dos arquivos sob `path`."""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except FileNotFoundError:
+                pass # Removido durante a varredura
+    return total
+
+class StorageManager:
+    """Diretórios de trabalho das requisições sob uma raiz configurável, com cota global e limpeza de órfãos.
+
+    Cada diretório guarda um marcador com o processo dono e o espaço reservado; a admissão soma, para todos
+    os workers, o maior valor entre o uso real e a reserva de cada diretório vivo.
+    """
+
+    def __init__(self, root, max_bytes, reservation_bytes, admission_wait, orphan_max_age):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.reservation_bytes = reservation_bytes
+        self.admission_wait = admission_wait
+        self.orphan_max_age = orphan_max_age
+        self.lock_path = os.path.join(root, LOCK_FILENAME)
+        self._thread_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        """Serializa a admissão entre threads e processos."""
+        with self._thread_lock, open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _workdirs(self):
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.root, name) for name in names if name.startswith(WORKDIR_PREFIX)]
+
+    def _read_owner(self, path):
+        try:
+            with open(os.path.join(path, OWNER_FILENAME)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _is_orphan(self, path, now):
+        owner = self._read_owner(path)
+        if owner and owner.get('started'):
+            return _process_start(owner['pid']) != owner['started']
+        try:
+            return now - os.path.getmtime(path) > self.orphan_max_age
+        except FileNotFoundError:
+            return False
+
+    def usage(self):
+        """Uso dos diretórios de trabalho: bytes em disco, bytes considerados pela cota e quantidade."""
+        used = accounted = count = 0
+        for path in self._workdirs():
+            size = dir_size(path)
+            owner = self._read_owner(path) or {}
+            used += size
+            accounted += max(size, owner.get('reserved', 0))
+            count += 1
+        return {'used_bytes': used, 'accounted_bytes': accounted, 'workdirs': count}
+
+    def _fits(self, reserve_bytes):
+        if reserve_bytes and shutil.disk_usage(self.root).free < reserve_bytes:
+            return False
+        return not self.max_bytes or self.usage()['accounted_bytes'] + reserve_bytes <= self.max_bytes
+
+    def create_workdir(self, reserve_bytes=None):
+        """Cria o diretório de trabalho de uma requisição, aguardando espaço na cota por até `admission_wait` segundos.
+
+        reserve_bytes=0 (ex: consultas de metadados, que não baixam mídia) é sempre admitido.
+        """
+        reserve_bytes = self.reservation_bytes if reserve_bytes is None else reserve_bytes
+        deadline = time.monotonic() + self.admission_wait
+        while True:
+            with self._locked():
+                if not reserve_bytes or self._fits(reserve_bytes):
+                    path = tempfile.mkdtemp(prefix=WORKDIR_PREFIX, dir=self.root)
+                    with open(os.path.join(path, OWNER_FILENAME), 'w') as f:
+                        json.dump({'pid': os.getpid(), 'started': _process_start(os.getpid()), 'reserved': reserve_bytes}, f)
+                    return path
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(ADMISSION_POLL_SECONDS)
+        logger.warning(f"Armazenamento: cota de {self.max_bytes} bytes esgotada em '{self.root}'; requisição recusada.")
+        raise StorageFullError("Servidor sem espaço temporário disponível no momento.", self.admission_wait)
+
+    def sweep_orphans(self):
+        """Remove diretórios de trabalho de processos que morreram (ex: worker morto pelo timeout do gunicorn)."""
+        now = time.time()
+        removed = 0
+        for path in self._workdirs():
+            if self._is_orphan(path, now):
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        if removed:
+            logger.info(f"Armazenamento: {removed} diretório(s) de trabalho órfão(s) removido(s) de '{self.root}'.")
+        return removed
+
+    def stats(self):
+        return dict(self.usage(), root=self.root, max_bytes=self.max_bytes, reservation_bytes=self.reservation_bytes,
+                    free_bytes=shutil.disk_usage(self.root).free)
+
+storage_manager = StorageManager(STORAGE_ROOT, STORAGE_MAX_BYTES, STORAGE_RESERVATION_BYTES,
+                                 STORAGE_ADMISSION_WAIT_SECONDS, STORAGE_ORPHAN_MAX_AGE_SECONDS)
+
+_sweeper_started = False
+
+def _sweep_forever():
+    while True:
+        try:
+            storage_manager.sweep_orphans()
+        except Exception:
+            logger.exception("Armazenamento: erro na limpeza de diretórios órfãos")
+        try:
+            sweep_stale_files()
+        except Exception:
+            logger.exception("Armazenamento: erro na limpeza dos arquivos de single-flight")
+        time.sleep(STORAGE_SWEEP_INTERVAL_SECONDS)
+
+def start_orphan_sweeper():
+    """Limpa os órfãos (e os arquivos antigos do single-flight) agora e depois a cada STORAGE_SWEEP_INTERVAL_SECONDS."""
+    global _sweeper_started
+    if not _sweeper_started:
+        _sweeper_started = True
+        threading.Thread(target=_sweep_forever, name="storage-sweeper", daemon=True).start()
+
+def create_workdir(reserve_bytes=None):
+    return storage_manager.create_workdir(reserve_bytes)
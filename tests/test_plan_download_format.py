@@ -0,0 +1,74 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from platform_downloader import plan_download_format, FALLBACK_VIDEO_FORMAT # noqa: E402
+
+def _fmt(format_id, ext, vcodec, acodec, height=None, tbr=None, abr=None):
+    return {'format_id': format_id, 'url': f"https://example.invalid/{format_id}", 'ext': ext,
+            'vcodec': vcodec, 'acodec': acodec, 'height': height, 'tbr': tbr, 'abr': abr}
+
+# Formatos no estilo do YouTube, na ordem do extractor (sem a ordenação de process_video_result)
+UNSORTED_FORMATS = [
+    _fmt('140', 'm4a', 'none', 'mp4a.40.2', abr=129.5, tbr=129.5),
+    _fmt('251', 'webm', 'none', 'opus', abr=135.0, tbr=135.0),
+    _fmt('137', 'mp4', 'avc1.640028', 'none', height=1080, tbr=4500),
+    _fmt('18', 'mp4', 'avc1.42001E', 'mp4a.40.2', height=360, tbr=600),
+    _fmt('139', 'm4a', 'none', 'mp4a.40.5', abr=48.8, tbr=48.8),
+    _fmt('136', 'mp4', 'avc1.4d401f', 'none', height=720, tbr=2500),
+    _fmt('249', 'webm', 'none', 'opus', abr=50.0, tbr=50.0),
+    _fmt('248', 'webm', 'vp9', 'none', height=1080, tbr=3000),
+    _fmt('250', 'webm', 'none', 'opus', abr=70.0, tbr=70.0),
+]
+
+def _plan(download_format, **limits):
+    return plan_download_format({'formats': list(UNSORTED_FORMATS)}, download_format, **limits)
+
+def test_m4a_picks_best_native_track():
+    plan = _plan('m4a')
+    assert plan['format'].startswith('140/')
+    assert not plan['postprocessors']
+
+def test_opus_picks_best_native_track():
+    plan = _plan('opus')
+    assert plan['format'].startswith('251/')
+    assert not plan['postprocessors']
+
+def test_mp3_converts_best_audio_track():
+    plan = _plan('mp3')
+    assert plan['format'].split('/')[0] in ('140', '251')
+    assert plan['postprocessors'][0]['preferredcodec'] == 'mp3'
+
+def test_video_merges_best_h264_with_best_m4a():
+    plan = _plan('video')
+    assert plan['merge']
+    assert plan['format'].startswith('137+140/')
+
+def test_video_respects_max_height():
+    plan = _plan('video', max_height=720)
+    assert plan['format'].startswith('136+140/')
+
+def test_progressive_when_no_separate_stream_fits():
+    plan = _plan('video', max_height=360)
+    assert not plan['merge']
+    assert plan['format'].startswith('18/')
+
+def test_progressive_wins_at_same_height():
+    formats = UNSORTED_FORMATS + [_fmt('22', 'mp4', 'avc1.64001F', 'mp4a.40.2', height=720, tbr=1500)]
+    plan = plan_download_format({'formats': formats}, 'video', max_height=720)
+    assert not plan['merge']
+    assert plan['format'].startswith('22/')
+
+def test_missing_format_id_falls_back_to_generic_selection():
+    formats = [dict(f, format_id=None) for f in UNSORTED_FORMATS]
+    video = plan_download_format({'formats': formats}, 'video')
+    assert video['format'] == FALLBACK_VIDEO_FORMAT and not video['exact']
+    audio = plan_download_format({'formats': formats}, 'm4a')
+    assert audio['format'] == 'bestaudio/best' and not audio['exact']
+
+def test_unmet_limits_raise_value_error():
+    with pytest.raises(ValueError):
+        _plan('video', max_height=144)
@@ -0,0 +1,74 @@
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip('yt_dlp')
+
+from platform_downloader import download_with_yt_dlp, open_progressive_stream # noqa: E402
+from ytdlp_pool import info_cache, info_cache_key # noqa: E402
+
+MEDIA_BODY = b'\x00\x00\x00\x18ftypmp42' + b'\x00' * 4096
+CHAIN_COOKIE = 'tt_chain_token=fixture-token'
+
+class CookieGatedHandler(BaseHTTPRequestHandler):
+    """Página que define um cookie na extração e mídia que só é entregue com ele (como o tt_chain_token do TikTok).
+
+    /expired/<id> aponta para uma mídia que sempre responde 410 (URL assinada expirada).
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith(('/page/', '/expired/')):
+            video_id = self.path.rsplit('/', 1)[-1]
+            media_dir = 'media' if self.path.startswith('/page/') else 'gone'
+            body = (f'<html><head><title>{video_id}</title></head><body>'
+                    f'<video src="/{media_dir}/{video_id}.mp4" type="video/mp4"></video></body></html>').encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Set-Cookie', f"{CHAIN_COOKIE}; Path=/")
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path.startswith('/media/') and CHAIN_COOKIE in (self.headers.get('Cookie') or ''):
+            self.send_response(200)
+            self.send_header('Content-Type', 'video/mp4')
+            self.send_header('Content-Length', str(len(MEDIA_BODY)))
+            self.end_headers()
+            self.wfile.write(MEDIA_BODY)
+        elif self.path.startswith('/gone/'):
+            self.send_error(410)
+        else:
+            self.send_error(403)
+
+@pytest.fixture
+def gated_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CookieGatedHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+def test_download_reuses_cookies_set_during_extraction(gated_server, tmp_path):
+    files = download_with_yt_dlp('TikTok', f"{gated_server}/page/download1", str(tmp_path))
+    with open(files[0], 'rb') as f:
+        assert f.read() == MEDIA_BODY
+
+def test_progressive_stream_reuses_cookies_set_during_extraction(gated_server, tmp_path):
+    stream = open_progressive_stream('TikTok', f"{gated_server}/page/stream1", str(tmp_path))
+    try:
+        assert b''.join(stream.iter_chunks()) == MEDIA_BODY
+    finally:
+        stream.close()
+
+def test_progressive_stream_falls_back_when_media_url_fails(gated_server, tmp_path):
+    url = f"{gated_server}/expired/stream2"
+    assert open_progressive_stream('TikTok', url, str(tmp_path)) is None
+    assert info_cache.get(info_cache_key('TikTok', url)) is None # URLs expiradas não ficam em cache
@@ -0,0 +1,204 @@
+import os
+import math
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import metrics
+from platform_downloader import classify_download_error
+
+logger = logging.getLogger(__name__)
+
+# --- Configuração do Limitador por Plataforma (via variáveis de ambiente, valores por worker) ---
+# Chamadas à origem por segundo, ex: "YouTube=1,TikTok=2,Instagram=0.5" (0 = sem limite)
+UPSTREAM_RATE_LIMITS = os.environ.get('UPSTREAM_RATE_LIMITS', 'YouTube=1,TikTok=2,Instagram=0.5')
+# Rajada máxima acumulada no bucket de cada plataforma
+UPSTREAM_BURST = int(os.environ.get('UPSTREAM_BURST', '5'))
+# Espera máxima por um token antes de recusar a requisição com 503
+UPSTREAM_MAX_WAIT_SECONDS = float(os.environ.get('UPSTREAM_MAX_WAIT_SECONDS', '10'))
+# Falhas de bloqueio (bot/429) seguidas que abrem o circuito da plataforma
+UPSTREAM_BREAKER_THRESHOLD = int(os.environ.get('UPSTREAM_BREAKER_THRESHOLD', '3'))
+# Tempo aberto na primeira vez; dobra a cada reabertura seguida, até o máximo
+UPSTREAM_BREAKER_COOLDOWN_SECONDS = int(os.environ.get('UPSTREAM_BREAKER_COOLDOWN_SECONDS', '60'))
+UPSTREAM_BREAKER_MAX_COOLDOWN_SECONDS = int(os.environ.get('UPSTREAM_BREAKER_MAX_COOLDOWN_SECONDS', '900'))
+
+# Classes de erro (classify_download_error) que indicam bloqueio pela origem
+THROTTLE_ERROR_CLASSES = ('bot_detection', 'rate_limited')
+# Após um bloqueio a taxa cai pela metade, sem passar deste fator da taxa configurada
+MIN_RATE_FACTOR = 0.1
+
+class UpstreamUnavailableError(Exception):
+    """A origem está bloqueando ou limitando as chamadas; o cliente deve tentar novamente após `retry_after` segundos."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+class AdaptiveTokenBucket:
+    """Token bucket com redução multiplicativa da taxa a cada bloqueio e recuperação gradual a cada sucesso."""
+
+    def __init__(self, rate, burst):
+        self.base_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait):
+        """Reserva um token. Retorna a espera necessária, ou None (sem reservar) se ela passar de `max_wait`."""
+        if not self.base_rate:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Saldo negativo = chamadas já reservadas à frente na fila
+            wait = max(0, (1 - self.tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            self.tokens -= 1
+            return wait
+
+    def retry_after(self):
+        return (1 - min(self.tokens, 0)) / self.rate if self.base_rate else 0
+
+    def slow_down(self):
+        with self._lock:
+            self.rate = max(self.base_rate * MIN_RATE_FACTOR, self.rate / 2)
+
+    def speed_up(self):
+        with self._lock:
+            self.rate = min(self.base_rate, self.rate + self.base_rate * MIN_RATE_FACTOR)
+
+class CircuitBreaker:
+    """Abre após falhas de bloqueio seguidas; depois do cooldown deixa passar uma chamada de teste (meio-aberto)."""
+
+    def __init__(self, threshold, cooldown, max_cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.failures < self.threshold:
+            return 'closed'
+        return 'open' if time.monotonic() < self.open_until else 'half_open'
+
+    def before_call(self):
+        """Retorna None se a chamada pode seguir, ou os segundos até a próxima tentativa."""
+        with self._lock:
+            state = self.state
+            if state == 'open':
+                return self.open_until - time.monotonic()
+            if state == 'half_open':
+                if self.probing:
+                    return self.cooldown
+                self.probing = True
+            return None
+
+    def release_probe(self):
+        with self._lock:
+            self.probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = self.trips = 0
+            self.probing = False
+
+    def record_failure(self):
+        """Registra um bloqueio. Retorna o tempo que o circuito ficará aberto, ou None se continuar fechado."""
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            if self.failures < self.threshold:
+                return None
+            self.trips += 1
+            open_seconds = min(self.max_cooldown, self.cooldown * 2 ** (self.trips - 1))
+            self.open_until = time.monotonic() + open_seconds
+            return open_seconds
+
+class UpstreamGuard:
+    """Limitador e circuit breaker de uma plataforma."""
+
+    def __init__(self, platform, rate):
+        self.platform = platform
+        self.bucket = AdaptiveTokenBucket(rate, UPSTREAM_BURST)
+        self.breaker = CircuitBreaker(UPSTREAM_BREAKER_THRESHOLD, UPSTREAM_BREAKER_COOLDOWN_SECONDS,
+                                      UPSTREAM_BREAKER_MAX_COOLDOWN_SECONDS)
+
+    def admit(self):
+        """Aguarda a vez da chamada ou levanta UpstreamUnavailableError sem tocar na origem."""
+        retry_after = self.breaker.before_call()
+        if retry_after is not None:
+            metrics.count_error(self.platform, 'circuit_open')
+            raise UpstreamUnavailableError(f"{self.platform}: origem bloqueando requisições; circuito aberto.", retry_after)
+        wait = self.bucket.reserve(UPSTREAM_MAX_WAIT_SECONDS)
+        if wait is None:
+            # Libera a chamada de teste reservada acima, se houver
+            self.breaker.release_probe()
+            metrics.count_error(self.platform, 'rate_limited_local')
+            raise UpstreamUnavailableError(f"{self.platform}: limite de requisições à origem atingido.", self.bucket.retry_after())
+        if wait > 0:
+            time.sleep(wait)
+
+    def record(self, error_class):
+        """Ajusta taxa e circuito conforme o resultado (None = sucesso)."""
+        if error_class not in THROTTLE_ERROR_CLASSES:
+            # Erros do pedido (vídeo privado, URL inválida) também mostram que a origem está respondendo
+            self.bucket.speed_up()
+            self.breaker.record_success()
+            return
+        self.bucket.slow_down()
+        open_seconds = self.breaker.record_failure()
+        logger.warning(f"{self.platform}: bloqueio da origem ({error_class}); taxa reduzida para {self.bucket.rate:.2f}/s.")
+        if open_seconds:
+            logger.error(f"{self.platform}: circuito aberto por {open_seconds}s após {self.breaker.failures} bloqueios seguidos.")
+
+    def stats(self):
+        return {'state': self.breaker.state, 'rate_per_second': self.bucket.rate, 'base_rate_per_second': self.bucket.base_rate,
+                'consecutive_throttles': self.breaker.failures}
+
+_rate_limits = {name.strip(): float(value) for name, value in
+                (item.split('=', 1) for item in UPSTREAM_RATE_LIMITS.split(',') if '=' in item)}
+_guards = {}
+_guards_lock = threading.Lock()
+
+def get_guard(platform):
+    with _guards_lock:
+        if platform not in _guards:
+            _guards[platform] = UpstreamGuard(platform, _rate_limits.get(platform, 0))
+        return _guards[platform]
+
+def chained_messages(error):
+    """Tipo e mensagem da exceção e das que ela encadeia (o erro original do yt-dlp/Instaloader fica em __context__)."""
+    messages = []
+    while error is not None and len(messages) < 5:
+        messages.append(f"{type(error).__name__}: {error}")
+        error = error.__cause__ or error.__context__
+    return " | ".join(messages)
+
+@contextmanager
+def guarded(platform):
+    """Envolve uma chamada à origem: espera/recusa pelo limitador e alimenta o circuito com o erro classificado."""
+    guard = get_guard(platform)
+    guard.admit()
+    try:
+        yield
+    except UpstreamUnavailableError:
+        guard.breaker.release_probe()
+        raise
+    except Exception as e:
+        guard.record(classify_download_error(chained_messages(e)))
+        raise
+    guard.record(None)
+
+def guard_stats():
+    with _guards_lock:
+        return {platform: guard.stats() for platform, guard in _guards.items()}
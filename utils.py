@@ -1,70 +1,188 @@
+import io
 import os
 import logging
+import mimetypes
 import subprocess
+import time
 import zipfile
-import base64
+import threading
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+import metrics
 
 logger = logging.getLogger(__name__)
 
-def create_temp_file_from_env(env_var_name, temp_file_name, temp_dir):
-    """Cria um arquivo temporário a partir de uma variável de ambiente codificada em Base64."""
-    env_content_b64 = os.environ.get(env_var_name)
-    if not env_content_b64:
-        logger.warning(f"Variável de ambiente '{env_var_name}' não encontrada.")
-        return None
+STREAM_CHUNK_SIZE = 256 * 1024
+# Processos ffmpeg simultâneos na extração de áudio (padrão: número de CPUs)
+FFMPEG_MAX_WORKERS = int(os.environ.get('FFMPEG_MAX_WORKERS', str(os.cpu_count() or 1)))
+# Codec de saída da extração de áudio: 'mp3', 'm4a' ou 'auto'
+AUDIO_OUTPUT_CODEC = os.environ.get('AUDIO_OUTPUT_CODEC', 'mp3').lower()
+# Extensões comprimidas com deflate nos ZIPs; todo o resto (mp4, jpg, mp3...) vai sem compressão
+ZIP_DEFLATE_EXTENSIONS = ('.txt', '.json', '.xml', '.csv', '.srt', '.vtt')
+
+class MediaStream:
+    """Mídia entregue em pedaços diretamente da origem, sem gravar o arquivo em disco.
+
+    A leitura e o fechamento podem vir de threads diferentes (ASGI: cada pedaço é lido em uma thread do pool e
+    o fechamento roda em outra após a desconexão do cliente): close() espera a leitura em andamento terminar.
+    """
+
+    def __init__(self, filename, chunks, close_callback=None):
+        self.filename = filename
+        self.chunks = chunks
+        self._close_callback = close_callback
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def iter_chunks(self):
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+                chunk = next(self.chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._close_callback:
+            self._close_callback()
+
+def guess_mimetype(file_path):
+    mimetype, _ = mimetypes.guess_type(file_path)
+    if file_path.lower().endswith(".zip"):
+        mimetype = "application/zip"
+    elif mimetype is None:
+        if file_path.lower().endswith(".mp4"): mimetype = "video/mp4"
+        elif file_path.lower().endswith(".mp3"): mimetype = "audio/mpeg"
+        else: mimetype = 'application/octet-stream'
+    return mimetype
+
+def attachment_disposition(filename):
+    """Content-Disposition de anexo com fallback ASCII e o nome original em UTF-8 (RFC 5987)."""
+    ascii_filename = filename.encode('ascii', 'replace').decode('ascii').replace('"', "'")
+    return f"attachment; filename=\"{ascii_filename}\"; filename*=UTF-8''{quote(filename)}"
+
+def probe_audio_codec(media_path):
+    """Retorna o codec do primeiro stream de áudio (ex: 'aac', 'mp3') usando ffprobe, ou None."""
+    command = [
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'a:0',
+        '-show_entries', 'stream=codec_name',
+        '-of', 'default=noprint_wrappers=1:nokey=1',
+        media_path
+    ]
     try:
-        file_content = base64.b64decode(env_content_b64).decode('utf-8')
-        temp_file_path = os.path.join(temp_dir, temp_file_name)
-        with open(temp_file_path, 'w') as f:
-            f.write(file_content)
-        logger.info(f"Arquivo temporário '{temp_file_path}' criado a partir de '{env_var_name}'.")
-        return temp_file_path
-    except Exception as e:
-        logger.error(f"Falha ao criar arquivo temporário a partir de '{env_var_name}': {e}")
+        result = subprocess.run(command, check=True, capture_output=True, text=True, timeout=30)
+        return result.stdout.strip() or None
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError) as e:
+        logger.warning(f"ffprobe falhou para '{media_path}': {e}")
         return None
 
-def extract_audio_from_video_if_needed(video_files, temp_dir):
-    """Extrai áudio MP3 de arquivos de vídeo usando FFmpeg."""
-    audio_files = []
-    if not video_files:
-        return audio_files
+def _audio_command(video_path, source_codec, output_codec, output_base):
+    """Monta o comando FFmpeg, copiando o stream de áudio quando ele já é compatível com a saída."""
+    if output_codec == 'auto':
+        output_codec = {'aac': 'm4a', 'mp3': 'mp3'}.get(source_codec, 'mp3')
+
+    if output_codec == 'm4a':
+        codec_args = ['-c:a', 'copy'] if source_codec == 'aac' else ['-c:a', 'aac', '-b:a', '192k']
+        output_path = f"{output_base}.m4a"
+    else:
+        codec_args = ['-c:a', 'copy'] if source_codec == 'mp3' else ['-q:a', '0']
+        output_path = f"{output_base}.mp3"
+
+    command = ['ffmpeg', '-i', video_path, '-map', 'a', *codec_args, '-y', output_path]
+    return command, output_path
+
+def _extract_audio(video_path, temp_dir, output_codec, platform='unknown'):
+    """Extrai o áudio de um vídeo. Retorna (caminho_do_audio, segundos) ou (None, segundos) em caso de falha."""
+    started = time.monotonic()
+    source_codec = probe_audio_codec(video_path)
+    base_name = os.path.splitext(os.path.basename(video_path))[0]
+    command, output_audio_path = _audio_command(video_path, source_codec, output_codec, os.path.join(temp_dir, base_name))
+    mode = 'cópia' if 'copy' in command else 'recodificação'
+
+    logger.info(f"Tentando extrair áudio de '{video_path}' para '{output_audio_path}' ({mode}, codec de origem: {source_codec})")
+    try:
+        subprocess.run(command, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        logger.error(f"FFmpeg falhou ao extrair áudio de '{video_path}'.")
+        logger.error(f"Comando: {' '.join(command)}")
+        logger.error(f"Stderr: {e.stderr}")
+        metrics.count_error(platform, 'ffmpeg')
+        return None, time.monotonic() - started
+
+    elapsed = time.monotonic() - started
+    metrics.observe_stage('transcode', platform, elapsed)
+    logger.info(f"Áudio extraído com sucesso: {output_audio_path} ({mode}, {elapsed:.2f}s)")
+    return output_audio_path, elapsed
+
+def iter_extracted_audio(video_paths, temp_dir, output_codec=None, max_workers=None, remove_source=False, platform='unknown'):
+    """Extração de áudio em pipeline, com vários processos ffmpeg em paralelo: produz os áudios prontos.
+
+    Os vídeos são enviados ao pool de ffmpeg assim que recebidos; os áudios saem na ordem em que terminam.
+    output_codec: 'mp3', 'm4a' ou 'auto' (mantém o codec de origem quando possível). Padrão: AUDIO_OUTPUT_CODEC.
+    """
+    output_codec = output_codec or AUDIO_OUTPUT_CODEC
+    workers = max_workers or FFMPEG_MAX_WORKERS
+    started = time.monotonic()
+    submitted = extracted = 0
 
-    for video_path in video_files:
+    def extract(video_path):
         if not os.path.exists(video_path):
             logger.warning(f"Arquivo de vídeo não encontrado para extração de áudio: {video_path}")
-            continue
-        
-        base_name = os.path.splitext(os.path.basename(video_path))[0]
-        output_audio_path = os.path.join(temp_dir, f"{base_name}.mp3")
-        
-        command = [
-            'ffmpeg',
-            '-i', video_path,
-            '-q:a', '0',
-            '-map', 'a',
-            '-y',
-            output_audio_path
-        ]
-        
-        logger.info(f"Tentando extrair áudio de '{video_path}' para '{output_audio_path}'")
+            return None
         try:
-            result = subprocess.run(command, check=True, capture_output=True, text=True)
-            logger.info(f"Áudio extraído com sucesso: {output_audio_path}")
-            audio_files.append(output_audio_path)
-        except subprocess.CalledProcessError as e:
-            logger.error(f"FFmpeg falhou ao extrair áudio de '{video_path}'.")
-            logger.error(f"Comando: {' '.join(command)}")
-            logger.error(f"Stderr: {e.stderr}")
+            result = _extract_audio(video_path, temp_dir, output_codec, platform)
         except FileNotFoundError:
             logger.error("Comando 'ffmpeg' não encontrado. Certifique-se de que o FFmpeg está instalado e no PATH do sistema.")
             raise Exception("Dependência 'ffmpeg' não encontrada.")
+        if remove_source and os.path.exists(video_path):
+            os.remove(video_path)
+        return result[0]
 
-    if not audio_files:
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ffmpeg") as executor:
+        for video_path in video_paths:
+            pending.add(executor.submit(extract, video_path))
+            submitted += 1
+            done, pending = wait(pending, timeout=0, return_when=FIRST_COMPLETED)
+            for future in done:
+                audio_path = future.result()
+                if audio_path:
+                    extracted += 1
+                    yield audio_path
+        for future in as_completed(pending):
+            audio_path = future.result()
+            if audio_path:
+                extracted += 1
+                yield audio_path
+
+    logger.info(f"Extração de áudio: {extracted}/{submitted} arquivo(s) em {time.monotonic() - started:.2f}s "
+                f"com até {workers} processo(s) paralelos.")
+    if submitted and not extracted:
         logger.warning("Nenhum arquivo de áudio foi extraído dos vídeos fornecidos.")
 
-    return audio_files
+def zip_compression_for(file_path):
+    """Mídia já é comprimida: armazena sem compressão. Só arquivos de texto usam deflate."""
+    ext = os.path.splitext(file_path)[1].lower()
+    return zipfile.ZIP_DEFLATED if ext in ZIP_DEFLATE_EXTENSIONS else zipfile.ZIP_STORED
+
+def _unique_arcname(name, used_names):
+    base, ext = os.path.splitext(name)
+    candidate, counter = name, 1
+    while candidate in used_names:
+        candidate = f"{base}_{counter}{ext}"
+        counter += 1
+    used_names.add(candidate)
+    return candidate
 
-def create_zip_from_files(files_to_zip, zip_filename, target_dir):
+def create_zip_from_files(files_to_zip, zip_filename, target_dir, platform='unknown'):
     """Cria um arquivo ZIP a partir de uma lista de caminhos de arquivo."""
     if not files_to_zip:
         return None
@@ -72,12 +190,72 @@ def create_zip_from_files(files_to_zip, zip_filename, target_dir):
     zip_path = os.path.join(target_dir, zip_filename)
     logger.info(f"Criando ZIP '{zip_path}' com {len(files_to_zip)} arquivo(s).")
     
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+    used_names = set()
+    with metrics.timed('zip', platform), zipfile.ZipFile(zip_path, 'w') as zipf:
         for file_path in files_to_zip:
             if os.path.exists(file_path):
-                zipf.write(file_path, os.path.basename(file_path))
+                zipf.write(file_path, _unique_arcname(os.path.basename(file_path), used_names), compress_type=zip_compression_for(file_path))
                 logger.debug(f"Adicionado ao ZIP: {os.path.basename(file_path)}")
             else:
                 logger.warning(f"Arquivo não encontrado para adicionar ao ZIP: {file_path}")
                 
-    return zip_path
\ No newline at end of file
+    return zip_path
+
+class _ZipStreamBuffer(io.RawIOBase):
+    """Destino não pesquisável para o zipfile: acumula os bytes escritos até serem drenados."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def iter_zip_stream(files, remove_after=True, chunk_size=STREAM_CHUNK_SIZE, platform='unknown'):
+    """Gera um ZIP em pedaços a partir de um iterável de arquivos, sem montar o arquivo em disco.
+
+    Cada membro é emitido assim que o arquivo correspondente fica disponível; com remove_after,
+    o arquivo de origem é apagado logo após entrar no ZIP.
+    """
+    buffer = _ZipStreamBuffer()
+    used_names = set()
+    count = 0
+    zip_seconds = 0.0 # Só o tempo gasto montando os membros, sem a espera pelos arquivos
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True) as zipf:
+        for file_path in files:
+            if not os.path.exists(file_path):
+                logger.warning(f"Arquivo não encontrado para adicionar ao ZIP: {file_path}")
+                continue
+            zinfo = zipfile.ZipInfo.from_file(file_path, _unique_arcname(os.path.basename(file_path), used_names))
+            zinfo.compress_type = zip_compression_for(file_path)
+            with open(file_path, 'rb') as src, zipf.open(zinfo, 'w') as dest:
+                while True:
+                    started = time.monotonic()
+                    data = src.read(chunk_size)
+                    if not data:
+                        break
+                    dest.write(data)
+                    pending = buffer.drain()
+                    zip_seconds += time.monotonic() - started
+                    if pending:
+                        yield pending
+            count += 1
+            if remove_after:
+                os.remove(file_path)
+            pending = buffer.drain()
+            if pending:
+                yield pending
+    metrics.observe_stage('zip', platform, zip_seconds)
+    logger.info(f"ZIP em streaming concluído com {count} arquivo(s).")
+    pending = buffer.drain()
+    if pending:
+        yield pending
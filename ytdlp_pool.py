@@ -0,0 +1,100 @@
+import os
+import time
+import queue
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import metrics
+from cache import canonical_media_id, InfoCache
+
+logger = logging.getLogger(__name__)
+
+# --- Configuração (via variáveis de ambiente) ---
+# Instâncias de YoutubeDL mantidas vivas por plataforma, apenas para extração de metadados
+YTDLP_POOL_SIZE = int(os.environ.get('YTDLP_POOL_SIZE', '2'))
+# As URLs assinadas do YouTube expiram em ~6h; o TTL precisa ficar bem abaixo disso
+YTDLP_INFO_CACHE_TTL_SECONDS = int(os.environ.get('YTDLP_INFO_CACHE_TTL_SECONDS', '1800'))
+YTDLP_INFO_CACHE_MAX_ENTRIES = int(os.environ.get('YTDLP_INFO_CACHE_MAX_ENTRIES', '256'))
+YTDLP_POOL_DIR = os.environ.get('YTDLP_POOL_DIR', os.path.join(tempfile.gettempdir(), 'ytdlp_pool'))
+
+class ExtractorPool:
+    """Mantém instâncias de YoutubeDL por plataforma (e conjunto de cookies), preservando extractors e dados do player."""
+
+    def __init__(self, size):
+        self.size = size
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _create(self, pool_key, ydl_factory):
+        work_dir = os.path.join(YTDLP_POOL_DIR, pool_key.lower())
+        os.makedirs(work_dir, exist_ok=True)
+        logger.info(f"{pool_key}: Criando instância persistente do YoutubeDL para extração.")
+        return ydl_factory(work_dir)
+
+    @contextmanager
+    def lease(self, pool_key, ydl_factory):
+        """Empresta uma instância exclusiva (YoutubeDL não é thread-safe) e a devolve ao final.
+
+        `ydl_factory(work_dir)` cria a instância; `pool_key` é a plataforma, ou 'plataforma/conjunto de cookies'.
+        """
+        with self._lock:
+            if pool_key not in self._pools:
+                self._pools[pool_key] = [queue.LifoQueue(), 0]
+            pool = self._pools[pool_key]
+            try:
+                ydl = pool[0].get_nowait()
+            except queue.Empty:
+                ydl = None
+                if pool[1] < self.size:
+                    pool[1] += 1
+                    ydl = self._create(pool_key, ydl_factory)
+        if ydl is None:
+            ydl = pool[0].get()
+        try:
+            yield ydl
+        finally:
+            pool[0].put(ydl)
+
+def preload():
+    """Importa o yt-dlp e inicializa os extractors usados (YouTube, TikTok) e os pós-processadores.
+
+    Chamado no master do gunicorn (preload_app): os workers herdam os módulos já carregados por copy-on-write.
+    """
+    started = time.monotonic()
+    import yt_dlp
+    import yt_dlp.postprocessor
+    with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
+        for ie_key in ('Youtube', 'TikTok'):
+            ydl.get_info_extractor(ie_key)
+    logger.info(f"yt-dlp pré-carregado em {time.monotonic() - started:.2f}s.")
+
+extractor_pool = ExtractorPool(YTDLP_POOL_SIZE)
+info_cache = InfoCache(YTDLP_INFO_CACHE_TTL_SECONDS, YTDLP_INFO_CACHE_MAX_ENTRIES)
+
+def info_cache_key(pool_key, url):
+    return f"{pool_key}|{canonical_media_id(url) or url}"
+
+def extract_info_cached(platform_name, url, ydl_factory, pool_key=None):
+    """Retorna o info-dict bruto (process=False) do vídeo, do cache ou de uma instância persistente.
+
+    O resultado é uma cópia independente, pronta para ydl.process_ie_result() com qualquer formato. O cache é
+    separado por `pool_key` (plataforma e conjunto de cookies): as URLs assinadas valem para os cookies da extração.
+    """
+    pool_key = pool_key or platform_name
+    key = info_cache_key(pool_key, url)
+    info = info_cache.get(key)
+    if info is not None:
+        logger.info(f"{platform_name}: Metadados em cache para '{url}'; extração ignorada.")
+        return info
+
+    with extractor_pool.lease(pool_key, ydl_factory) as ydl, metrics.timed('extraction', platform_name):
+        info = ydl.extract_info(url, download=False, process=False)
+    # Playlists e redirecionamentos carregam geradores; só vídeos resolvidos vão para o cache
+    if info.get('_type', 'video') == 'video':
+        info_cache.put(key, info)
+    return info
+
+def invalidate_info(pool_key, url):
+    info_cache.invalidate(info_cache_key(pool_key, url))